@@ -15,6 +15,9 @@ class AdminDashboard {
             employees: [],
             companyHandbook: null // Added company handbook data
         };
+        // Contacts are paged by contacts_api.py; keep the cursor for "Load more"
+        this.contactsNextCursor = null;
+        this.contactsTotal = null;
         
         this.init();
     }
@@ -56,6 +59,22 @@ class AdminDashboard {
     }
     
     async loadAllData() {
+        // One request for every collection; fall back to the per-collection endpoints
+        // if the bootstrap endpoint is unavailable.
+        try {
+            const result = await app.apiRequest('/cgi-bin/dashboard_bootstrap_api.py');
+            if (result.success) {
+                this.applyBootstrapData(result.data);
+                if (result.errors) {
+                    console.error('Some dashboard sections failed to load:', result.errors);
+                }
+                this.renderCurrentSection();
+                return;
+            }
+        } catch (error) {
+            console.warn('Dashboard bootstrap failed, loading sections individually:', error);
+        }
+
         try {
             await Promise.all([
                 this.loadContacts(),
@@ -72,13 +91,44 @@ class AdminDashboard {
             app.showAlert('Failed to load dashboard data', 'error');
         }
     }
-    
+
+    applyBootstrapData(data) {
+        if (data.contacts) this.setContactsPage(data.contacts, false);
+        if (data.team) this.data.team = data.team;
+        if (data.careers) this.data.careers = data.careers;
+        if (data.resources) this.data.resources = data.resources;
+        if (data.products) this.data.products = data.products;
+        if (data.employees) this.data.employees = data.employees;
+        if ('handbook' in data) this.data.companyHandbook = data.handbook;
+    }
+
     async loadContacts() {
         const result = await app.apiRequest('/cgi-bin/contacts_api.py');
         if (result.success) {
-            this.data.contacts = result.data;
+            this.setContactsPage(result, false);
         }
     }
+
+    async loadMoreContacts() {
+        if (!this.contactsNextCursor) return;
+        try {
+            const result = await app.apiRequest(`/cgi-bin/contacts_api.py?after=${encodeURIComponent(this.contactsNextCursor)}`);
+            if (result.success) {
+                this.setContactsPage(result, true);
+                this.renderContacts();
+            } else {
+                app.showAlert(result.error || 'Failed to load more contacts', 'error');
+            }
+        } catch (error) {
+            app.showAlert('Failed to load more contacts', 'error');
+        }
+    }
+
+    setContactsPage(page, append) {
+        this.data.contacts = append ? this.data.contacts.concat(page.data) : page.data;
+        this.contactsNextCursor = page.next_cursor || null;
+        this.contactsTotal = page.total_estimate ?? null;
+    }
     
     async loadTeam() {
         const result = await app.apiRequest('/cgi-bin/team_api.py');
@@ -202,6 +252,12 @@ class AdminDashboard {
                     </tbody>
                 </table>
             </div>
+            ${this.contactsNextCursor ? `
+                <div class="text-center mt-2">
+                    <p class="text-muted">Showing ${this.data.contacts.length} of ${this.contactsTotal !== null ? '~' + this.contactsTotal : 'many'} submissions</p>
+                    <button class="btn btn-secondary" onclick="dashboard.loadMoreContacts()">Load more</button>
+                </div>
+            ` : ''}
         `;
     }
     
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+HTTP load benchmark for the Matrica Networks server
+Starts server.py's run_server() on a free port against a seeded copy of matrica.db, drives
+a weighted mix of public, employee, admin and upload traffic from concurrent clients, and
+reports requests/sec and p50/p95/p99 latency per endpoint as JSON.
+
+    python3 benchmark.py --duration 20 --users 16 --output single.json
+    python3 benchmark.py --concurrency threads --keep-alive --output threads.json --compare single.json
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import server
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'cgi-bin'))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'database'))
+
+import password_hashing # bcrypt in a bounded worker pool
+import init_db
+import migrations
+
+DEFAULT_SOURCE_DB = os.path.join(SCRIPT_DIR, 'database', 'matrica.db')
+# Relative weight of each traffic mix; a client picks one flow at a time with these odds
+DEFAULT_MIX = 'public=5,employee=3,admin=1,upload=1'
+BENCH_PASSWORD = 'bench-password'
+REQUEST_TIMEOUT = 30
+STARTUP_TIMEOUT = 30
+
+# Public pages and the catalogue API each one loads (assets/js/main.js)
+PUBLIC_PAGES = [
+    ('/index.html', None),
+    ('/products.html', '/cgi-bin/products_api.py'),
+    ('/careers.html', '/cgi-bin/careers_api.py'),
+    ('/resources.html', '/cgi-bin/resources_api.py'),
+    ('/about.html', '/cgi-bin/team_api.py'),
+]
+# What employee_dashboard.html loads after login
+EMPLOYEE_DASHBOARD_APIS = [
+    '/cgi-bin/employee_profile_api.py', '/cgi-bin/attendance_api.py', '/cgi-bin/tasks_api.py',
+    '/cgi-bin/leave_api.py', '/cgi-bin/employee_documents_api.py', '/cgi-bin/education_api.py',
+    '/cgi-bin/handbook_api.py',
+]
+
+
+class Stats:
+    """Latencies and error counts per endpoint for one client thread (merged at the end)."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def merge(self, other):
+        for name, values in other.latencies.items():
+            self.latencies.setdefault(name, []).extend(values)
+        for name, count in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + count
+
+
+class Client:
+    """One simulated browser: a connection, a login session and remembered ETags."""
+
+    def __init__(self, port, employee, measure_from, revalidate=False):
+        self.port = port
+        self.employee = employee  # (id, username)
+        self.measure_from = measure_from
+        self.revalidate = revalidate
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+        self.headers = {}
+        self.etags = {}
+        self.stats = Stats()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request and record its latency under 'METHOD /path'. Returns (status, body)."""
+        headers = dict(headers or {})
+        if method == 'GET' and self.revalidate and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        name = f"{method} {path.split('?')[0]}"
+        measured = time.time() >= self.measure_from
+        start = time.perf_counter()
+        status, data = self._send(method, path, body, headers)
+        elapsed = time.perf_counter() - start
+        ok = status is not None and status < 400 and b'"success": false' not in data
+        if measured:
+            self.stats.record(name, elapsed, ok)
+        return status, data
+
+    def _send(self, method, path, body, headers):
+        # A keep-alive connection the server has since closed fails on first use; retry once
+        for attempt in (1, 2):
+            reused = self.conn.sock is not None
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if method == 'GET' and response.getheader('ETag'):
+                    self.etags[path] = response.getheader('ETag')
+                return response.status, data
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.conn.close()
+                if not reused or attempt == 2:
+                    return None, b''
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                return None, b''
+
+    def get(self, path):
+        return self.request('GET', path, headers=self.headers)
+
+    def login(self):
+        employee_id, username = self.employee
+        body = f"username={username}&password={BENCH_PASSWORD}"
+        _, data = self.request('POST', '/cgi-bin/employee_auth_api.py', body,
+                               {'Content-Type': 'application/x-www-form-urlencoded'})
+        token = json.loads(data or b'{}').get('token')
+        self.headers = {'X-Employee-ID': str(employee_id)}
+        if token:
+            self.headers['Authorization'] = f"Bearer {token}"
+
+
+def public_flow(client, rng, options):
+    """A visitor opening one public page and the catalogue it loads."""
+    page, api = rng.choice(PUBLIC_PAGES)
+    client.request('GET', page)
+    client.request('GET', '/assets/css/main.css')
+    client.request('GET', '/assets/js/main.js')
+    if api:
+        client.request('GET', api)
+
+
+def employee_flow(client, rng, options):
+    """An employee opening the dashboard; now and then they also ask for leave."""
+    for api in EMPLOYEE_DASHBOARD_APIS:
+        client.get(api)
+    if rng.random() < 0.1:
+        start = date.today() + timedelta(days=rng.randint(7, 60))
+        body = f"start_date={start}&end_date={start + timedelta(days=rng.randint(0, 4))}&reason=Benchmark"
+        client.request('POST', '/cgi-bin/leave_api.py', body,
+                       {**client.headers, 'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+def admin_flow(client, rng, options):
+    """The admin dashboard's bootstrap request, then the attendance report."""
+    client.request('GET', '/cgi-bin/dashboard_bootstrap_api.py')
+    client.request('GET', '/cgi-bin/attendance_report_api.py')
+
+
+def upload_flow(client, rng, options):
+    """An employee uploading a document and deleting it again.
+
+    The content is random so every upload is a new blob, and the delete releases it, so a
+    run leaves nothing behind in uploads/.
+    """
+    boundary = uuid.uuid4().hex
+    content = rng.randbytes(options.upload_bytes)
+    body = b''.join([
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"document_type\"\r\n\r\nbenchmark\r\n".encode(),
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"document_file\"; filename=\"benchmark.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n".encode(),
+        content,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    status, data = client.request('POST', '/cgi-bin/employee_documents_api.py', body,
+                                  {**client.headers, 'Content-Type': f"multipart/form-data; boundary={boundary}"})
+    document = json.loads(data or b'{}').get('data') if status == 200 else None
+    if document:
+        client.request('DELETE', f"/cgi-bin/employee_documents_api.py?id={document['id']}", headers=client.headers)
+
+
+FLOWS = {
+    'public': public_flow,
+    'employee': employee_flow,
+    'admin': admin_flow,
+    'upload': upload_flow,
+}
+
+
+def parse_mix(text):
+    """'public=5,employee=3' -> {'public': 5.0, 'employee': 3.0}; raises ValueError"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in FLOWS:
+            raise ValueError(f"Unknown mix '{name}'; choose from {', '.join(FLOWS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one flow with a positive weight")
+    return mix
+
+
+def prepare_database(source, target, users):
+    """Copy source (or a fresh init_db.py database) to target and add one employee per client.
+
+    Returns [(employee_id, username)]. Every benchmark employee has BENCH_PASSWORD.
+    """
+    if os.path.exists(source):
+        with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+            src.backup(dst)  # Consistent even while a server is writing to source
+    else:
+        init_db.init_database(target)
+    conn = sqlite3.connect(target)
+    try:
+        migrations.migrate(conn)
+        password_hash = password_hashing.hash_password(BENCH_PASSWORD)
+        employees = []
+        cursor = conn.cursor()
+        for n in range(1, users + 1):
+            username = f"bench{n:03d}"
+            cursor.execute("DELETE FROM employees WHERE username = ?", (username,))
+            cursor.execute(
+                "INSERT INTO employees (full_name, username, password_hash, designation, email) VALUES (?, ?, ?, ?, ?)",
+                (f"Benchmark User {n}", username, password_hash, 'Engineer', f"{username}@bench.invalid"))
+            employees.append((cursor.lastrowid, username))
+        conn.commit()
+    finally:
+        conn.close()
+    return employees
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, db_path, log_file, options):
+    """Run server.run_server() in a child process and wait until it accepts connections."""
+    env = dict(os.environ, MATRICA_DB_PATH=db_path)
+    # Every client connects from 127.0.0.1, so the per-IP login bucket would throttle the logins
+    env.setdefault('MATRICA_LOGIN_THROTTLE', 'off')
+    kwargs = dict(port=port, host='127.0.0.1', dispatch=options.dispatch, concurrency=options.concurrency,
+                  workers=options.workers, queue_depth=options.queue_depth, keep_alive=options.keep_alive)
+    code = f"import server; server.run_server(**{kwargs!r})"
+    process = subprocess.Popen([sys.executable, '-u', '-c', code], cwd=SCRIPT_DIR, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f"Server did not start listening within {STARTUP_TIMEOUT}s")
+
+
+def stop_server(process):
+    """Stop like Ctrl+C, so a pre-fork parent also stops its workers."""
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_client(client, mix, rng, options, deadline):
+    names, weights = list(mix), list(mix.values())
+    if 'employee' in mix or 'upload' in mix:
+        client.login()
+    while time.time() < deadline:
+        FLOWS[rng.choices(names, weights)[0]](client, rng, options)
+    client.conn.close()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(stats, seconds):
+    def summary(latencies, errors):
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "requests_per_sec": round(len(latencies) / seconds, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+
+    endpoints = {name: summary(values, stats.errors.get(name, 0))
+                 for name, values in sorted(stats.latencies.items())}
+    every = [value for values in stats.latencies.values() for value in values]
+    total = summary(every, sum(stats.errors.values())) if every else {"requests": 0}
+    return total, endpoints
+
+
+def run_benchmark(options):
+    mix = parse_mix(options.mix)
+    with tempfile.TemporaryDirectory(prefix='matrica-bench-') as scratch:
+        db_path = os.path.join(scratch, 'matrica.db')
+        employees = prepare_database(options.db, db_path, options.users)
+        port = free_port()
+        with open(os.path.join(scratch, 'server.log'), 'w+') as log_file:
+            try:
+                process = start_server(port, db_path, log_file, options)
+            except RuntimeError:
+                log_file.seek(0)
+                sys.stderr.write(log_file.read()[-4000:])
+                raise
+            try:
+                measure_from = time.time() + options.warmup
+                deadline = measure_from + options.duration
+                clients = [Client(port, employees[n], measure_from, options.revalidate) for n in range(options.users)]
+                threads = [threading.Thread(target=run_client, args=(client, mix, random.Random(options.seed + n), options, deadline))
+                           for n, client in enumerate(clients)]
+                print(f"Benchmarking {options.dispatch}/{options.concurrency} on port {port}: {options.users} clients, "
+                      f"{options.warmup:g}s warm-up, {options.duration:g}s measured", file=sys.stderr)
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                stop_server(process)
+
+    stats = Stats()
+    for client in clients:
+        stats.merge(client.stats)
+    total, endpoints = summarize(stats, options.duration)
+    return {
+        "config": {
+            "dispatch": options.dispatch, "concurrency": options.concurrency, "workers": options.workers,
+            "queue_depth": options.queue_depth, "keep_alive": options.keep_alive, "users": options.users,
+            "duration": options.duration, "warmup": options.warmup, "mix": mix, "revalidate": options.revalidate,
+            "upload_bytes": options.upload_bytes, "seed": options.seed,
+        },
+        "environment": {
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+        },
+        "total": total,
+        "endpoints": endpoints,
+    }
+
+
+def compare(baseline, result):
+    """Lines comparing requests/sec and p95 per endpoint with an earlier report."""
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+    lines = [f"{'endpoint':48} {'req/s':>9} {'change':>7} {'p95 ms':>9} {'change':>7}"]
+    rows = [('total', baseline.get('total', {}), result['total'])]
+    rows += [(name, baseline.get('endpoints', {}).get(name, {}), values) for name, values in result['endpoints'].items()]
+    for name, old, new in rows:
+        if not new.get('requests'):
+            continue
+        lines.append(f"{name:48} {new['requests_per_sec']:9.1f} {change(old.get('requests_per_sec'), new['requests_per_sec']):>7} "
+                     f"{new['p95_ms']:9.1f} {change(old.get('p95_ms'), new['p95_ms']):>7}")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test server.py and report throughput and latency per endpoint")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds to measure (default: 10)")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of traffic before measuring starts (default: 2)")
+    parser.add_argument('--users', type=int, default=8, help="Concurrent clients, each with its own employee account (default: 8)")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"Weighted traffic flows, from {', '.join(FLOWS)} (default: {DEFAULT_MIX})")
+    parser.add_argument('--revalidate', action='store_true',
+                        help="Send If-None-Match with the ETag of an earlier response, like a browser revisiting a page")
+    parser.add_argument('--upload-bytes', type=int, default=64 * 1024, help="Size of each uploaded document (default: 65536)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the traffic (default: 1)")
+    parser.add_argument('--db', default=DEFAULT_SOURCE_DB,
+                        help="Database to copy for the run; a fresh init_db.py database if it doesn't exist")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', metavar='REPORT', help="Also print the change from an earlier JSON report")
+    # The server under test, as in server.py
+    parser.add_argument('--dispatch', choices=server.DISPATCH_MODES, default='inprocess')
+    parser.add_argument('--concurrency', choices=server.CONCURRENCY_MODES, default='single')
+    parser.add_argument('--workers', type=int, default=server.DEFAULT_WORKERS)
+    parser.add_argument('--queue-depth', type=int, default=server.DEFAULT_QUEUE_DEPTH)
+    parser.add_argument('--keep-alive', action='store_true')
+    options = parser.parse_args(argv)
+    try:
+        parse_mix(options.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    return options
+
+
+def main():
+    options = parse_args()
+    result = run_benchmark(options)
+    report = json.dumps(result, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    total = result['total']
+    if total.get('requests'):
+        print(f"{total['requests']} requests, {total['errors']} errors, {total['requests_per_sec']} req/s, "
+              f"p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, p99 {total['p99_ms']} ms", file=sys.stderr)
+    if options.compare:
+        with open(options.compare) as f:
+            print('\n'.join(compare(json.load(f), result)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
@@ -7,16 +6,15 @@ import sys
 from datetime import datetime, date as datetime_date
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import session_tokens # Signed, expiring employee session tokens
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-
-def get_db_connection():
-    return sqlite3.connect(DB_PATH)
-
 def get_today_attendance(employee_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -91,14 +89,19 @@ def punch_out(employee_id):
     finally:
         conn.close()
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID")
+    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    # Checked before the ETag goes out, so an expired or revoked token never gets a 304. Old
+    # clients may send X-Employee-ID / employee_id instead only with MATRICA_REQUIRE_SESSION=off
+    employee_id_str = session_tokens.employee_id_from_request() if method != 'OPTIONS' else None
+    conditional_get.send_etag(['attendance'], extra=[datetime_date.today().isoformat()])
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -106,7 +109,6 @@ def main():
         print(json.dumps({"status": "ok"}))
         sys.exit(0)
 
-    employee_id_str = os.environ.get('HTTP_X_EMPLOYEE_ID')
     query_params = urllib.parse.parse_qs(os.environ.get('QUERY_STRING', ''))
     action = query_params.get('action', [None])[0]
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Admin attendance report API
+Hours worked, late arrivals and missing punch-outs per employee over a date range,
+read from the attendance_daily summary that init_db.py's triggers maintain
+"""
+
+import json
+import os
+import re
+import sys
+import urllib.parse
+from datetime import date as datetime_date
+from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+
+# Initialize logger
+script_name = os.path.basename(__file__)
+logger = get_logger(script_name)
+
+# A punch-in after this time of day (HH:MM) counts as a late arrival, unless the request sets late_after
+LATE_AFTER = os.environ.get('MATRICA_LATE_AFTER', '09:30')
+GROUPINGS = ('employee', 'month')
+
+def parse_time_of_day(text):
+    """'HH:MM' -> seconds after midnight; raises ValueError"""
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', text)
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(f"'late_after' must be a time of day as HH:MM, got '{text}'.")
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60
+
+def parse_report_params(query_string):
+    """Parse start, end, employee_id, group and late_after; raises ValueError on bad input.
+
+    The range defaults to the current month up to today.
+    """
+    query_params = urllib.parse.parse_qs(query_string)
+    get_param = lambda name: query_params.get(name, [''])[0].strip()
+
+    today = datetime_date.today()
+    try:
+        start = datetime_date.fromisoformat(get_param('start')) if get_param('start') else today.replace(day=1)
+        end = datetime_date.fromisoformat(get_param('end')) if get_param('end') else today
+    except ValueError:
+        raise ValueError("'start' and 'end' must be dates as YYYY-MM-DD.")
+    if start > end:
+        raise ValueError("'start' must not be after 'end'.")
+
+    employee_id = get_param('employee_id')
+    if employee_id and not employee_id.isdigit():
+        raise ValueError("'employee_id' must be an integer.")
+
+    group = get_param('group') or 'employee'
+    if group not in GROUPINGS:
+        raise ValueError(f"'group' must be one of: {', '.join(GROUPINGS)}.")
+
+    late_after = get_param('late_after') or LATE_AFTER
+    return start, end, int(employee_id) if employee_id else None, group, late_after, parse_time_of_day(late_after)
+
+def build_report_query(start, end, employee_id=None, group='employee', late_after_seconds=0):
+    """SELECT statement and parameters for get_attendance_report()"""
+    month_column = "substr(d.date, 1, 7)" if group == 'month' else "NULL"
+    where = "d.date BETWEEN ? AND ?"
+    params = [late_after_seconds, datetime_date.today().isoformat(), start.isoformat(), end.isoformat()]
+    if employee_id is not None:
+        where += " AND d.employee_id = ?"
+        params.append(employee_id)
+    return f'''
+        SELECT d.employee_id, e.full_name, {month_column} AS month,
+               COUNT(*), SUM(d.worked_seconds),
+               SUM(d.punch_in_seconds > ?), SUM(NOT d.punched_out AND d.date < ?)
+        FROM attendance_daily d
+        JOIN employees e ON e.id = d.employee_id
+        WHERE {where}
+        GROUP BY d.employee_id, month
+        ORDER BY e.full_name, d.employee_id, month
+    ''', params
+
+def get_attendance_report(start, end, employee_id=None, group='employee', late_after_seconds=0):
+    """Totals per employee (and per month with group='month') for start..end inclusive.
+
+    A day still missing its punch-out only counts as missing once it is over.
+    """
+    query, params = build_report_query(start, end, employee_id, group, late_after_seconds)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    report = []
+    for employee_id, full_name, month, days, worked_seconds, late, missing in rows:
+        entry = {
+            "employee_id": employee_id, "full_name": full_name,
+            "days_present": days, "hours_worked": round(worked_seconds / 3600, 2),
+            "late_arrivals": late, "missing_punch_outs": missing
+        }
+        if group == 'month':
+            entry["month"] = month
+        report.append(entry)
+    return report
+
+@logged
+def main():
+    print("Content-Type: application/json")
+    print("Access-Control-Allow-Origin: *")
+    print("Access-Control-Allow-Methods: GET, OPTIONS")
+    print("Access-Control-Allow-Headers: Content-Type")
+    # Today matters too: it decides which open days count as missing punch-outs
+    conditional_get.send_etag(['attendance', 'employees'], extra=[datetime_date.today().isoformat()])
+    print()
+
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
+
+    if method == 'OPTIONS':
+        logger.info("Handling OPTIONS request.")
+        print(json.dumps({"status": "ok"}))
+        sys.exit(0)
+
+    try:
+        if method == 'GET':
+            try:
+                start, end, employee_id, group, late_after, late_after_seconds = parse_report_params(os.environ.get('QUERY_STRING', ''))
+            except ValueError as e:
+                logger.warning(f"Invalid report parameters: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                sys.exit(0)
+
+            logger.info(f"Attendance report {start}..{end} by {group} (employee_id={employee_id}, late_after={late_after})")
+            report = get_attendance_report(start, end, employee_id, group, late_after_seconds)
+            print(json.dumps({"success": True, "data": report, "start": start.isoformat(), "end": end.isoformat(),
+                              "group": group, "late_after": late_after}))
+
+        else:
+            logger.warning(f"Method {method} not allowed for this endpoint.")
+            print(json.dumps({"success": False, "error": f"Method {method} not allowed."}))
+
+    except Exception as e:
+        logger.error(f"Unhandled error in {script_name}: {e}", exc_info=True)
+        print(json.dumps({"success": False, "error": "An internal server error occurred."}))
+
+if __name__ == "__main__":
+    logger.info(f"{script_name} script started (likely direct execution or misconfiguration).")
+    main()
@@ -11,6 +11,8 @@ import urllib.parse
 import re
 from html import escape
 from logger_config import get_logger # Import the logger
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import login_throttle # Per-username / per-IP login rate limits
 
 # Initialize logger for this script
 script_name = os.path.basename(__file__)
@@ -71,9 +73,17 @@ def parse_multipart_form_data(post_data):
     
     return form_data
 
+def form_value(form_data, name):
+    """A field from either parser: parse_qs gives lists, the multipart parser plain strings"""
+    value = form_data.get(name, '')
+    return value[0] if isinstance(value, list) else value
+
 def parse_form_data():
     """Parse form data from POST request"""
-    content_length = int(os.environ.get('CONTENT_LENGTH', 0))
+    try:
+        content_length = int(os.environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
     if content_length > 0:
         post_data = sys.stdin.read(content_length)
         
@@ -92,16 +102,22 @@ def parse_form_data():
         return parsed_data
     return {}
 
+@logged
 def main():
     """Main handler function"""
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: POST, OPTIONS")
     print("Access-Control-Allow-Headers: Content-Type")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    form_data = {}
+    if method == 'POST':
+        # Read the form before ending the headers, so a throttled login can still be answered 429
+        form_data = parse_form_data()
+        login_throttle.admit('admin', escape(form_value(form_data, 'username')))
     print()
     
     try:
-        method = os.environ.get('REQUEST_METHOD', 'GET')
         logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
         if method == 'OPTIONS':
@@ -111,12 +127,9 @@ def main():
         
         if method == 'POST':
             logger.info("Processing POST request for login.")
-            form_data = parse_form_data()
-            
-            username_val = form_data.get('username', [''])[0] if isinstance(form_data.get('username'), list) else form_data.get('username', '')
-            username = escape(username_val)
+            username = escape(form_value(form_data, 'username'))
             
-            password_val = form_data.get('password', [''])[0] if isinstance(form_data.get('password'), list) else form_data.get('password', '')
+            password_val = form_value(form_data, 'password')
             # Password is not escaped as it's used for comparison, not display. It's also not logged directly.
 
             if not username or not password_val:
@@ -126,6 +139,7 @@ def main():
             
             if authenticate_user(username, password_val):
                 logger.info(f"User '{username}' authenticated successfully.")
+                login_throttle.record_success('admin', username)
                 print(json.dumps({
                     "success": True, 
                     "message": "Login successful",
@@ -136,6 +150,7 @@ def main():
                 }))
             else:
                 logger.warning(f"Failed login attempt for user '{username}'.")
+                login_throttle.record_failure('admin', username)
                 print(json.dumps({"success": False, "error": "Invalid username or password"}))
         
         else:
@@ -0,0 +1,96 @@
+import os
+
+from db_config import get_db_connection
+from form_parser import UPLOAD_ROOT
+
+# Uploads are stored once per content digest: uploads/blobs/<first two hex digits>/<sha256><ext>.
+# The extension is kept so the static server still sends the right Content-Type.
+BLOB_DIR = os.path.join(UPLOAD_ROOT, 'blobs')
+BLOB_WEB_PREFIX = '/uploads/blobs'
+
+
+def web_path_to_disk(web_path):
+    """Map an /uploads/... path stored in the database to the file on disk, or None if it points elsewhere."""
+    if not web_path or not web_path.startswith('/uploads/'):
+        return None
+    disk_path = os.path.normpath(os.path.join(os.path.dirname(UPLOAD_ROOT), web_path.lstrip('/')))
+    if not disk_path.startswith(UPLOAD_ROOT + os.sep):
+        return None
+    return disk_path
+
+
+def store(upload, ext):
+    """Keep an uploaded file (form_parser.UploadedFile) and return its web path.
+
+    If a file with the same content is already stored the upload is discarded and the
+    existing copy gains a reference. Each stored path must be handed to release()
+    exactly once, when the record pointing at it is deleted or replaced.
+    """
+    ext = ext.lower()
+    web_path = f"{BLOB_WEB_PREFIX}/{upload.sha256[:2]}/{upload.sha256}{ext}"
+    disk_path = web_path_to_disk(web_path)
+
+    conn = get_db_connection()
+    try:
+        # IMMEDIATE takes the write lock up front, so a concurrent release() of the same
+        # blob can't unlink the file between the refcount check and the rename below.
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO upload_blobs (file_path, sha256, size, refcount) VALUES (?, ?, ?, 1)
+            ON CONFLICT(file_path) DO UPDATE SET refcount = refcount + 1
+        """, (web_path, upload.sha256, upload.size))
+        if os.path.exists(disk_path):
+            upload.discard()
+        else:
+            upload.save_as(disk_path)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return web_path
+
+
+def release(web_path):
+    """Drop one reference to a stored file, unlinking it when nothing points at it any more.
+
+    Files uploaded before the blob store existed have no refcount row; they were only
+    ever referenced by one record, so they are removed straight away as before.
+    Call it after the caller's own change has committed. Returns True when this was the
+    last reference.
+    """
+    disk_path = web_path_to_disk(web_path)
+    if disk_path is None:
+        return False
+
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT refcount FROM upload_blobs WHERE file_path = ?", (web_path,)).fetchone()
+        if row is not None and row[0] > 1:
+            conn.execute("UPDATE upload_blobs SET refcount = refcount - 1 WHERE file_path = ?", (web_path,))
+            unlink = False
+        else:
+            conn.execute("DELETE FROM upload_blobs WHERE file_path = ?", (web_path,))
+            unlink = True
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if unlink:
+        # Unlinked only once the row is committed away, so a rollback never leaves a row
+        # pointing at a missing file. Under the write lock again, since a store() of the same
+        # content may have claimed the file in between.
+        conn = get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            claimed = conn.execute("SELECT 1 FROM upload_blobs WHERE file_path = ?", (web_path,)).fetchone()
+            if claimed is None and os.path.exists(disk_path):
+                os.remove(disk_path)
+            conn.rollback()
+        finally:
+            conn.close()
+    return unlink
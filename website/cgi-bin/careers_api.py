@@ -12,16 +12,15 @@ import sqlite3
 from html import escape
 import re
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import response_cache # Cached public GET responses, invalidated on writes
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-def get_db_connection():
-    """Get database connection"""
-    db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-    return sqlite3.connect(db_path)
-
 def get_all_careers():
     """Get all career opportunities"""
     conn = get_db_connection()
@@ -55,6 +54,7 @@ def add_career(data):
     career_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    response_cache.invalidate('careers')
     
     return career_id
 
@@ -68,6 +68,7 @@ def delete_career(career_id):
     
     conn.commit()
     conn.close()
+    response_cache.invalidate('careers')
     
     return affected > 0
 
@@ -85,6 +86,7 @@ def update_career(career_id, data):
     affected = cursor.rowcount
     conn.commit()
     conn.close()
+    response_cache.invalidate('careers')
 
     return affected > 0
 
@@ -153,12 +155,19 @@ def parse_multipart_form_data(post_data):
     
     return form_data
 
+@logged
 def main():
     """Main handler function"""
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS") # Added PUT
     print("Access-Control-Allow-Headers: Content-Type")
+    # A GET is looked up in the response cache first: a hit carries its ETag, so neither the
+    # headers nor a 304 need the database
+    cached = None
+    if os.environ.get('REQUEST_METHOD', 'GET') == 'GET':
+        cached = response_cache.lookup('careers', f"{script_name}?{os.environ.get('QUERY_STRING', '')}")
+    conditional_get.send_cached_etag(cached)
     print()
     
     try:
@@ -172,8 +181,7 @@ def main():
         
         if method == 'GET':
             logger.info("Handling GET request for all careers.")
-            careers = get_all_careers()
-            print(json.dumps({"success": True, "data": careers}))
+            print(cached.get_or_build(lambda: json.dumps({"success": True, "data": get_all_careers()})))
             
         elif method == 'POST' or method == 'PUT':
             logger.info(f"Handling {method} request for career.")
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import sqlite3
+import sys
+
+from db_config import get_db_connection
+from http_headers import etag_matches
+
+
+def table_versions(tables):
+    """Current change counters of tables, or None if the database predates table_versions."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT table_name, version FROM table_versions WHERE table_name IN ({', '.join('?' * len(tables))})",
+                       list(tables))
+        return dict(cursor.fetchall())
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def script_version():
+    """mtime of the running API script, so a deployed code change also changes its ETags"""
+    script = os.path.basename(os.environ.get('SCRIPT_NAME', ''))
+    try:
+        return os.stat(os.path.join(API_DIR, script)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def make_etag(tables, extra=()):
+    """ETag for the current GET: the request (script, query, employee or session) plus the versions of tables.
+
+    extra holds anything else the response depends on, e.g. today's date.
+    """
+    versions = table_versions(tables)
+    if versions is None:
+        return None
+    parts = [
+        os.environ.get('SCRIPT_NAME', ''),
+        script_version(),
+        os.environ.get('QUERY_STRING', ''),
+        os.environ.get('HTTP_X_EMPLOYEE_ID', ''),
+        os.environ.get('HTTP_AUTHORIZATION', ''),
+        sorted(versions.items()),
+        list(extra),
+    ]
+    return '"' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def send_etag(tables, extra=()):
+    """Print the ETag and caching headers of a GET response built from tables.
+
+    Call it while the response headers are being printed, before the blank line. If
+    the client already holds this version (If-None-Match), the response is finished
+    as a bodyless 304 and the script exits without running its queries.
+    """
+    if os.environ.get('REQUEST_METHOD', 'GET') != 'GET':
+        return None
+    return _send_etag_headers(make_etag(tables, extra))
+
+
+def send_cached_etag(response):
+    """send_etag() for a GET answered through response_cache (a CachedResponse).
+
+    A fresh cached entry carries the ETag it was built with, so a hit, whether it ends
+    in a 304 or not, never touches the database. Only a miss reads table_versions; its
+    ETag is kept on response and cached along with the body built later.
+    """
+    if response is None or os.environ.get('REQUEST_METHOD', 'GET') != 'GET':
+        return None
+    if response.etag is None:
+        response.etag = make_etag([response.table])
+    return _send_etag_headers(response.etag)
+
+
+def _send_etag_headers(etag):
+    if etag is None:
+        return None
+
+    print(f"ETag: {etag}")
+    # Browsers may keep the body but must check back before reusing it
+    print("Cache-Control: private, no-cache")
+    print("Vary: X-Employee-ID, Authorization")
+    if etag_matches(os.environ.get('HTTP_IF_NONE_MATCH', ''), etag):
+        print("Status: 304 Not Modified")
+        print()
+        sys.exit(0)
+    return etag
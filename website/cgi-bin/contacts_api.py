@@ -4,32 +4,107 @@ Contacts management API
 Handles contact form submissions
 """
 
+import base64
 import json
 import os
 import sys
 import urllib.parse
 import sqlite3
 from html import escape
-from datetime import datetime
+from datetime import datetime, timedelta
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-def get_db_connection():
-    """Get database connection"""
-    db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-    return sqlite3.connect(db_path)
+# Contacts are listed newest first, one page at a time, using keyset pagination on
+# (timestamp, id): each page continues strictly after the last row of the previous one,
+# which the idx_contacts_timestamp_id index serves without scanning skipped rows.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Counting every matching row would cost a full scan on a large inbox, so filtered
+# counts stop here and are reported as an estimate.
+COUNT_CAP = 10000
+
+def encode_cursor(timestamp, contact_id):
+    """Opaque 'after' cursor pointing at the last contact of a page"""
+    raw = json.dumps([timestamp, contact_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from an 'after' cursor; raises ValueError if malformed"""
+    try:
+        timestamp, contact_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(contact_id)
+    except Exception:
+        raise ValueError("Invalid 'after' cursor.")
+
+def build_contact_filters(filters):
+    """Translate the supported filters into WHERE clauses and their parameters"""
+    clauses, params = [], []
+    if filters.get('subject'):
+        clauses.append('subject = ?')
+        params.append(filters['subject'])
+    if filters.get('company'):
+        escaped = filters['company'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("company LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if filters.get('date_from'):
+        clauses.append('timestamp >= ?')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        # date_to includes the whole day
+        next_day = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        clauses.append('timestamp < ?')
+        params.append(next_day.strftime('%Y-%m-%d'))
+    return clauses, params
+
+def estimate_contact_count(cursor, clauses, params):
+    """Cheap total for the filter set, returned as (count, is_exact)"""
+    if not clauses:
+        # Contacts are never deleted, so the id span is the row count; both ends are index lookups
+        cursor.execute('SELECT COALESCE(MAX(id) - MIN(id) + 1, 0) FROM contacts')
+        return cursor.fetchone()[0], False
+    cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM contacts WHERE {' AND '.join(clauses)} LIMIT ?)",
+                   params + [COUNT_CAP])
+    count = cursor.fetchone()[0]
+    return count, count < COUNT_CAP
+
+def build_contacts_page_query(limit=DEFAULT_PAGE_SIZE, after=None, filters=None):
+    """SELECT statement and parameters for one page, newest first"""
+    clauses, params = build_contact_filters(filters or {})
+    if after:
+        after_timestamp, after_id = decode_cursor(after)
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend([after_timestamp, after_id])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    # One extra row tells whether there is another page
+    return f'''
+        SELECT id, name, email, phone, company, subject, message, timestamp
+        FROM contacts {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1]
+
+def get_contacts_page(limit=DEFAULT_PAGE_SIZE, after=None, filters=None):
+    """Get one page of contact submissions, newest first"""
+    query, params = build_contacts_page_query(limit, after, filters)
+    count_clauses, count_params = build_contact_filters(filters or {})
 
-def get_all_contacts():
-    """Get all contact submissions"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, name, email, phone, company, subject, message, timestamp FROM contacts ORDER BY timestamp DESC')
+    cursor.execute(query, params)
     rows = cursor.fetchall()
+    total_estimate, total_exact = estimate_contact_count(cursor, count_clauses, count_params)
     conn.close()
-    
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
     contacts = []
     for row in rows:
         contacts.append({
@@ -42,8 +117,42 @@ def get_all_contacts():
             'message': row[6],
             'timestamp': row[7]
         })
-    
-    return contacts
+
+    return {
+        'data': contacts,
+        'next_cursor': encode_cursor(rows[-1][7], rows[-1][0]) if has_more else None,
+        'total_estimate': total_estimate,
+        'total_exact': total_exact
+    }
+
+def parse_list_params(query_string):
+    """Parse limit, after and filters from the GET query string; raises ValueError on bad input"""
+    query_params = urllib.parse.parse_qs(query_string)
+    get_param = lambda name: query_params.get(name, [''])[0].strip()
+
+    limit_raw = get_param('limit')
+    try:
+        limit = int(limit_raw) if limit_raw else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError("'limit' must be an integer.")
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    filters = {
+        'subject': get_param('subject'),
+        'company': get_param('company'),
+        'date_from': get_param('date_from'),
+        'date_to': get_param('date_to')
+    }
+    for name in ('date_from', 'date_to'):
+        if filters[name]:
+            try:
+                datetime.strptime(filters[name], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format.")
+
+    return limit, get_param('after') or None, filters
 
 def add_contact(data):
     """Add new contact submission"""
@@ -77,12 +186,14 @@ def parse_form_data():
         return urllib.parse.parse_qs(post_data)
     return {}
 
+@logged
 def main():
     """Main handler function"""
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, OPTIONS")
     print("Access-Control-Allow-Headers: Content-Type")
+    conditional_get.send_etag(['contacts'])
     print()
     
     try:
@@ -95,9 +206,15 @@ def main():
             return
         
         if method == 'GET':
-            logger.info("Handling GET request for all contacts.")
-            contacts = get_all_contacts()
-            print(json.dumps({"success": True, "data": contacts}))
+            try:
+                limit, after, filters = parse_list_params(os.environ.get('QUERY_STRING', ''))
+                logger.info(f"Handling GET request for contacts page: limit={limit}, after={after}, filters={ {k: v for k, v in filters.items() if v} }")
+                page = get_contacts_page(limit, after, filters)
+            except ValueError as ve:
+                logger.warning(f"Invalid contacts query: {ve}")
+                print(json.dumps({"success": False, "error": str(ve)}))
+                return
+            print(json.dumps({"success": True, **page}))
             
         elif method == 'POST':
             logger.info("Handling POST request for new contact submission.")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Admin dashboard bootstrap API
+Returns every collection the admin dashboard needs in one response
+"""
+
+import json
+import os
+import sys
+import urllib.parse
+from logger_config import get_logger # Import the logger
+from db_config import read_transaction # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+
+import contacts_api
+import team_api
+import careers_api
+import resources_api
+import products_api
+import employee_admin_api
+import handbook_api
+
+# Initialize logger
+script_name = os.path.basename(__file__)
+logger = get_logger(script_name)
+
+# Section name -> loader. The loaders are the same functions the individual APIs
+# use for their GET requests, so each section has exactly the shape the dashboard
+# already gets from the per-collection endpoint.
+SECTIONS = {
+    'contacts': contacts_api.get_contacts_page, # First page plus next_cursor, like GET contacts_api.py
+    'team': team_api.get_all_team_members,
+    'careers': careers_api.get_all_careers,
+    'resources': resources_api.get_all_resources,
+    'products': products_api.get_all_products,
+    'employees': employee_admin_api.get_all_employees,
+    'handbook': handbook_api.get_current_handbook,
+}
+
+# Tables behind SECTIONS; a change to any of them changes the bootstrap response's ETag
+SECTION_TABLES = ['contacts', 'team', 'careers', 'resources', 'products', 'employees', 'company_handbook']
+
+def parse_sections(query_string):
+    """Return the requested section names (all of them when 'sections' is absent)."""
+    query_params = urllib.parse.parse_qs(query_string)
+    requested = query_params.get('sections', [''])[0]
+    if not requested:
+        return list(SECTIONS), []
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SECTIONS]
+    return [name for name in names if name in SECTIONS], unknown
+
+def load_sections(names):
+    """Load the given sections from a single read snapshot. Returns (data, errors)."""
+    data, errors = {}, {}
+    with read_transaction():
+        for name in names:
+            try:
+                data[name] = SECTIONS[name]()
+            except Exception as e:
+                # One broken collection shouldn't blank the whole dashboard
+                logger.error(f"Failed to load dashboard section '{name}': {e}", exc_info=True)
+                errors[name] = "Failed to load section."
+    return data, errors
+
+@logged
+def main():
+    print("Content-Type: application/json")
+    print("Access-Control-Allow-Origin: *")
+    print("Access-Control-Allow-Methods: GET, OPTIONS")
+    print("Access-Control-Allow-Headers: Content-Type")
+    conditional_get.send_etag(SECTION_TABLES)
+    print()
+
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
+
+    if method == 'OPTIONS':
+        logger.info("Handling OPTIONS request.")
+        print(json.dumps({"status": "ok"}))
+        sys.exit(0)
+
+    try:
+        if method == 'GET':
+            names, unknown = parse_sections(os.environ.get('QUERY_STRING', ''))
+            if unknown:
+                logger.warning(f"Unknown dashboard sections requested: {unknown}")
+                print(json.dumps({"success": False, "error": f"Unknown sections: {', '.join(unknown)}. Valid sections: {', '.join(SECTIONS)}"}))
+                sys.exit(0)
+
+            logger.info(f"Loading dashboard sections: {names}")
+            data, errors = load_sections(names)
+            response = {"success": True, "data": data}
+            if errors:
+                response["errors"] = errors
+            print(json.dumps(response))
+
+        else:
+            logger.warning(f"Method {method} not allowed for this endpoint.")
+            print(json.dumps({"success": False, "error": f"Method {method} not allowed."}))
+
+    except Exception as e:
+        logger.error(f"Unhandled error in {script_name}: {e}", exc_info=True)
+        print(json.dumps({"success": False, "error": "An internal server error occurred."}))
+
+if __name__ == "__main__":
+    logger.info(f"{script_name} script started (likely direct execution or misconfiguration).")
+    main()
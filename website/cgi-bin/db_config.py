@@ -0,0 +1,176 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.environ.get(
+    'MATRICA_DB_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'matrica.db')
+)
+
+# How long a writer waits for a competing writer before SQLite raises "database is locked" (ms)
+BUSY_TIMEOUT_MS = int(os.environ.get('MATRICA_DB_BUSY_TIMEOUT_MS', 5000))
+# Prepared statements kept per connection; every API query fits comfortably
+CACHED_STATEMENTS = 256
+
+# One connection per thread (and per process, for pre-fork workers). Under CGI each script
+# runs in a fresh process so this is simply one connection per request; under in-process
+# dispatch (server.py) the connection and its statement cache outlive the request.
+_local = threading.local()
+
+
+class QueryStats:
+    """SQLite time, statement count and rows fetched for one request (see start_query_stats)."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+
+
+class _TimedCursor:
+    """Cursor wrapper that adds the time spent in each call to the thread's QueryStats."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return getattr(self._cursor, method)(*args)
+        finally:
+            self._stats.seconds += time.perf_counter() - start
+
+    def execute(self, *args):
+        self._stats.queries += 1
+        self._timed('execute', *args)
+        return self
+
+    def executemany(self, *args):
+        self._stats.queries += 1
+        self._timed('executemany', *args)
+        return self
+
+    def fetchone(self):
+        row = self._timed('fetchone')
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed('fetchmany', *args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed('fetchall')
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Thin wrapper around the thread's shared sqlite3 connection.
+
+    The API modules were written against short-lived connections and call close() when
+    they are done. Here close() hands the connection back instead: any transaction left
+    open (e.g. after an exception before commit) is rolled back and the connection stays
+    open for the next caller on this thread.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        stats = getattr(_local, 'stats', None)
+        return _TimedCursor(cursor, stats) if stats is not None else cursor
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def commit(self):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return self._conn.commit()
+        start = time.perf_counter()
+        try:
+            return self._conn.commit()
+        finally:
+            stats.seconds += time.perf_counter() - start
+
+    def close(self):
+        # Inside read_transaction() the snapshot belongs to the caller that opened it
+        if self._conn.in_transaction and not getattr(_local, 'snapshot', False):
+            self._conn.rollback()
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS)
+    # WAL lets dashboard reads proceed while a punch-in or upload is being written,
+    # instead of every reader and writer serializing on the rollback journal.
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def get_db_connection():
+    """Get the calling thread's database connection, opening and tuning it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # A connection inherited across fork() must never be used by the child
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return PooledConnection(conn)
+
+
+
+@contextlib.contextmanager
+def read_transaction():
+    """Run several reads against one consistent snapshot of the database.
+
+    Any API function called inside the block that fetches the thread's connection
+    sees the same snapshot, so existing get_all_* helpers can be composed without
+    each one starting its own implicit read. Only reads belong in here.
+    """
+    conn = get_db_connection()
+    conn.execute("BEGIN")
+    _local.snapshot = True
+    try:
+        yield conn
+    finally:
+        _local.snapshot = False
+        conn.rollback()  # Nothing was written; this just releases the snapshot
+
+
+def start_query_stats():
+    """Start timing this thread's SQLite calls; returns the QueryStats being filled in."""
+    _local.stats = QueryStats()
+    return _local.stats
+
+
+def stop_query_stats():
+    """Stop timing and return the QueryStats collected since start_query_stats() (or None)."""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
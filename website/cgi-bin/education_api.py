@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
@@ -7,16 +6,16 @@ import sys
 from html import escape
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import session_tokens # Signed, expiring employee session tokens
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-
-def get_db_connection():
-    return sqlite3.connect(DB_PATH)
-
 def get_education_history(employee_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -32,6 +31,20 @@ def get_education_history(employee_id):
     conn.close()
     return history
 
+def get_education_record(record_id):
+    conn = get_db_connection()
+    row = conn.execute("""
+        SELECT id, institution_name, degree, year_of_completion, details
+        FROM education_history WHERE id = ?
+    """, (record_id,)).fetchone()
+    conn.close()
+    if row: # employee_id is implied
+        return {
+            "id": row[0], "institution_name": row[1], "degree": row[2],
+            "year_of_completion": row[3], "details": row[4]
+        }
+    return None
+
 def add_education_record(employee_id, data):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -95,14 +108,19 @@ def delete_education_record(record_id, employee_id):
     finally:
         conn.close()
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID")
+    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    # Checked before the ETag goes out, so an expired or revoked token never gets a 304. Old
+    # clients may send X-Employee-ID / employee_id instead only with MATRICA_REQUIRE_SESSION=off
+    employee_id_str = session_tokens.employee_id_from_request() if method != 'OPTIONS' else None
+    conditional_get.send_etag(['education_history'])
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -110,8 +128,12 @@ def main():
         print(json.dumps({"status": "ok"}))
         sys.exit(0)
 
-    employee_id_str = os.environ.get('HTTP_X_EMPLOYEE_ID')
-    form = cgi.FieldStorage()
+    try:
+        form = parse_form()
+    except FormError as e:
+        logger.warning(f"Rejected request body: {e}")
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(0)
 
     if not employee_id_str:
         if method in ['POST', 'PUT']:
@@ -169,12 +191,7 @@ def main():
                 print(json.dumps({"success": False, "error": error}))
             else:
                 logger.info(f"Education record added with ID: {record_id} for employee {employee_id}")
-                new_record_query = get_db_connection().execute("SELECT id, institution_name, degree, year_of_completion, details FROM education_history WHERE id = ?", (record_id,)).fetchone()
-                new_record_data = {
-                     "id": new_record_query[0], "institution_name": new_record_query[1],
-                     "degree": new_record_query[2], "year_of_completion": new_record_query[3],
-                     "details": new_record_query[4]
-                } if new_record_query else None # employee_id is implied
+                new_record_data = get_education_record(record_id)
                 print(json.dumps({"success": True, "message": "Education record added.", "data": new_record_data}))
 
         elif method == 'PUT':
@@ -216,12 +233,7 @@ def main():
                  print(json.dumps({"success": False, "error": error}))
             elif success:
                  logger.info(f"Education record ID {record_id} updated for employee {employee_id}.")
-                 updated_record_query = get_db_connection().execute("SELECT id, institution_name, degree, year_of_completion, details FROM education_history WHERE id = ?", (record_id,)).fetchone()
-                 updated_record_data = {
-                     "id": updated_record_query[0], "institution_name": updated_record_query[1],
-                     "degree": updated_record_query[2], "year_of_completion": updated_record_query[3],
-                     "details": updated_record_query[4]
-                 } if updated_record_query else None
+                 updated_record_data = get_education_record(record_id)
                  print(json.dumps({"success": True, "message": "Education record updated.", "data": updated_record_data}))
             else: # Should be caught by specific error or success
                 logger.warning(f"Update for education record ID {record_id} (employee {employee_id}) resulted in no changes or record not found.")
@@ -1,34 +1,24 @@
 #!/usr/bin/env python3
-import cgi
+import csv
+import io
 import json
 import sqlite3
 import os
 import sys
-import bcrypt # For password hashing
-import uuid
 from html import escape
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+import blob_store # Content-addressed, reference-counted upload storage
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import password_hashing # bcrypt in a bounded worker pool
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-# Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-UPLOAD_DIR_PROFILE_PICS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'profile_pictures')
-os.makedirs(UPLOAD_DIR_PROFILE_PICS, exist_ok=True)
-
-def get_db_connection():
-    """Get database connection."""
-    return sqlite3.connect(DB_PATH)
-
-def hash_password(plain_password):
-    """Hash a plain password using bcrypt."""
-    salt = bcrypt.gensalt()
-    hashed_bytes = bcrypt.hashpw(plain_password.encode('utf-8'), salt)
-    return hashed_bytes.hex() # Store as hex string
-
 def save_profile_picture(file_item):
     """Save uploaded profile picture and return its web-accessible path."""
     if not file_item or not file_item.filename:
@@ -38,13 +28,7 @@ def save_profile_picture(file_item):
     if ext.lower() not in ['.jpg', '.jpeg', '.png', '.gif']:
         raise ValueError("Invalid file type for profile picture. Only JPG, PNG, GIF allowed.")
 
-    unique_filename = str(uuid.uuid4()) + ext.lower()
-    file_path = os.path.join(UPLOAD_DIR_PROFILE_PICS, unique_filename)
-
-    with open(file_path, 'wb') as f:
-        f.write(file_item.file.read())
-
-    return f"/uploads/profile_pictures/{unique_filename}"
+    return blob_store.store(file_item, ext)
 
 def get_all_employees():
     conn = get_db_connection()
@@ -57,27 +41,30 @@ def get_all_employees():
     conn.close()
     return employees
 
-def add_employee(data, profile_pic_item):
+def add_employee(data, profile_pic_item, password_hash):
     profile_picture_url = data.get('profile_picture_url', '')
+    stored_picture_url = None
     if profile_pic_item and profile_pic_item.filename:
         try:
-            profile_picture_url = save_profile_picture(profile_pic_item)
+            profile_picture_url = stored_picture_url = save_profile_picture(profile_pic_item)
         except ValueError as e:
             return None, str(e) # Return error message
 
+    committed = False
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
+        cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO employees (full_name, username, password_hash, designation, profile_picture_url, email, phone)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
-            data['full_name'], data['username'], hash_password(data['password']),
+            data['full_name'], data['username'], password_hash,
             data.get('designation', ''), profile_picture_url,
             data.get('email', ''), data.get('phone', '')
         ))
         employee_id = cursor.lastrowid
         conn.commit()
+        committed = True
         return employee_id, None
     except sqlite3.IntegrityError as e: # Handles UNIQUE constraint violations (e.g., username, email)
         conn.rollback()
@@ -88,42 +75,183 @@ def add_employee(data, profile_pic_item):
         return None, f"Database integrity error: {str(e)}"
     finally:
         conn.close()
+        if stored_picture_url and not committed:
+            blob_store.release(stored_picture_url) # No employee ended up referencing it, whatever went wrong
+
+IMPORT_COLUMNS = ['full_name', 'username', 'password', 'designation', 'email', 'phone']
+IMPORT_REQUIRED = ['full_name', 'username', 'password']
+# Rows accepted in one import; hashing runs at roughly (workers / bcrypt cost) rows per second
+MAX_IMPORT_ROWS = 1000
+
+def read_import_rows(file_item):
+    """Parse an uploaded CSV (with a header row) or NDJSON file into [(row_number, dict)].
+
+    The format is taken from the file extension, or from the first character when the
+    extension is neither. Raises ValueError if the file as a whole can't be read.
+    """
+    with open(file_item.temp_path, encoding='utf-8-sig', newline='') as f:
+        text = f.read()
+    _, ext = os.path.splitext(file_item.filename.lower())
+    is_ndjson = ext in ('.ndjson', '.jsonl') or (ext != '.csv' and text.lstrip().startswith('{'))
+
+    rows = []
+    if is_ndjson:
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {line_number} is not valid JSON.")
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {line_number} is not a JSON object.")
+            rows.append((line_number, record))
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames:
+            raise ValueError("The CSV file is empty.")
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        for record in reader:
+            if None in record:
+                raise ValueError(f"Line {reader.line_num} has more values than the header.")
+            if any(value and value.strip() for value in record.values() if isinstance(value, str)):
+                rows.append((reader.line_num, record)) # Line in the file, counting the header as 1
+
+    unknown = sorted({key for _, record in rows for key in record if key not in IMPORT_COLUMNS})
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(map(str, unknown))}. Expected: {', '.join(IMPORT_COLUMNS)}.")
+    if not rows:
+        raise ValueError("The file has no employee rows.")
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f"At most {MAX_IMPORT_ROWS} employees can be imported at once; the file has {len(rows)}.")
+    return rows
+
+def validate_import_rows(cursor, rows):
+    """Clean each row and check it against the others and the employees table.
+
+    Returns (employees, errors): employees as (row_number, data) with every column a
+    stripped string (email None when blank, so any number of rows may leave it out),
+    errors as {"row", "username", "error"} dicts.
+    """
+    employees, errors = [], []
+    seen_usernames, seen_emails = {}, {}
+    for row_number, record in rows:
+        data = {column: str(record.get(column) if record.get(column) is not None else '').strip() for column in IMPORT_COLUMNS}
+        data['email'] = data['email'] or None
+        problem = None
+        missing = [column for column in IMPORT_REQUIRED if not data[column]]
+        if missing:
+            problem = f"Missing {', '.join(missing)}."
+        elif data['username'] in seen_usernames:
+            problem = f"Username repeats row {seen_usernames[data['username']]}."
+        elif data['email'] and data['email'] in seen_emails:
+            problem = f"Email repeats row {seen_emails[data['email']]}."
+        if problem:
+            errors.append({"row": row_number, "username": data['username'], "error": problem})
+            continue
+        seen_usernames[data['username']] = row_number
+        if data['email']:
+            seen_emails[data['email']] = row_number
+        employees.append((row_number, data))
+
+    # Conflicts with existing employees, found before any password is hashed
+    taken_usernames, taken_emails = set(), set()
+    for column, values, taken in (('username', list(seen_usernames), taken_usernames), ('email', list(seen_emails), taken_emails)):
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            cursor.execute(f"SELECT {column} FROM employees WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk)
+            taken.update(row[0] for row in cursor.fetchall())
+    for row_number, data in employees:
+        if data['username'] in taken_usernames:
+            errors.append({"row": row_number, "username": data['username'], "error": "Username already exists."})
+        elif data['email'] in taken_emails:
+            errors.append({"row": row_number, "username": data['username'], "error": "Email already exists."})
+    errors.sort(key=lambda error: error['row'])
+    return employees, errors
+
+def import_employees(file_item, dry_run=False):
+    """Create every employee in an uploaded CSV/NDJSON file, or none of them.
+
+    Returns (created, errors): created as {"row", "id", "username"} dicts (empty on a dry
+    run), errors per row. Passwords are hashed in parallel, and only once the whole
+    file has validated; the rows are then inserted in one transaction.
+    """
+    rows = read_import_rows(file_item)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        employees, errors = validate_import_rows(cursor, rows)
+        if errors or dry_run:
+            return [], errors
+        conn.commit() # End the validation read before the slow part
+
+        password_hashes = password_hashing.hash_passwords([data['password'] for _, data in employees])
+
+        cursor.execute("BEGIN IMMEDIATE")
+        created = []
+        for (row_number, data), password_hash in zip(employees, password_hashes):
+            try:
+                cursor.execute("""
+                    INSERT INTO employees (full_name, username, password_hash, designation, profile_picture_url, email, phone)
+                    VALUES (?, ?, ?, ?, '', ?, ?)
+                """, (data['full_name'], data['username'], password_hash, data['designation'], data['email'], data['phone']))
+                created.append({"row": row_number, "id": cursor.lastrowid, "username": data['username']})
+            except sqlite3.IntegrityError as e: # Created by someone else since validation
+                field = 'Email' if 'employees.email' in str(e) else 'Username'
+                errors.append({"row": row_number, "username": data['username'], "error": f"{field} already exists."})
+        if errors:
+            conn.rollback()
+            return [], errors
+        conn.commit()
+        return created, []
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-def update_employee(employee_id, data, profile_pic_item):
+def update_employee(employee_id, data, profile_pic_item, password_hash=None):
     profile_picture_url = data.get('profile_picture_url') # Might be None if not provided
 
+    stored_picture_url = None
+
     # If a new file is uploaded, it takes precedence
     if profile_pic_item and profile_pic_item.filename:
         try:
-            # Consider deleting old picture if one exists and is managed by this system
-            profile_picture_url = save_profile_picture(profile_pic_item)
+            profile_picture_url = stored_picture_url = save_profile_picture(profile_pic_item)
         except ValueError as e:
             return False, str(e)
 
+    updated = False
+    old_picture_url = None
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    fields_to_update = {
-        "full_name": data['full_name'],
-        "username": data['username'],
-        "designation": data.get('designation', ''),
-        "email": data.get('email', ''),
-        "phone": data.get('phone', '')
-    }
-    if profile_picture_url is not None: # Only update if new URL or file was processed
-        fields_to_update["profile_picture_url"] = profile_picture_url
-
-    # Conditionally update password if provided
-    if data.get('password'):
-        fields_to_update["password_hash"] = hash_password(data['password'])
-
-    set_clause = ", ".join([f"{key} = ?" for key in fields_to_update.keys()])
-    values = list(fields_to_update.values()) + [employee_id]
-
     try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT profile_picture_url FROM employees WHERE id = ?", (employee_id,))
+        row = cursor.fetchone()
+        old_picture_url = row[0] if row else None
+
+        fields_to_update = {
+            "full_name": data['full_name'],
+            "username": data['username'],
+            "designation": data.get('designation', ''),
+            "email": data.get('email', ''),
+            "phone": data.get('phone', '')
+        }
+        if profile_picture_url is not None: # Only update if new URL or file was processed
+            fields_to_update["profile_picture_url"] = profile_picture_url
+
+        # Conditionally update password if provided
+        if password_hash:
+            fields_to_update["password_hash"] = password_hash
+
+        set_clause = ", ".join([f"{key} = ?" for key in fields_to_update.keys()])
+        values = list(fields_to_update.values()) + [employee_id]
+
         cursor.execute(f"UPDATE employees SET {set_clause} WHERE id = ?", tuple(values))
         conn.commit()
-        return cursor.rowcount > 0, None
+        updated = cursor.rowcount > 0
+        return updated, None
     except sqlite3.IntegrityError as e:
         conn.rollback()
         if "UNIQUE constraint failed: employees.username" in str(e):
@@ -133,12 +261,22 @@ def update_employee(employee_id, data, profile_pic_item):
         return False, f"Database integrity error: {str(e)}"
     finally:
         conn.close()
-
-def reset_employee_password(employee_id, new_password):
+        # Runs after the commit. Drop the reference the employee no longer holds: the old picture
+        # once it is replaced, by an upload or a URL typed into the form, or the new upload if
+        # nothing was updated (no such employee, a constraint, or any other error). An upload
+        # always holds its own reference, even when it has the same content as the old picture.
+        if not updated:
+            if stored_picture_url:
+                blob_store.release(stored_picture_url)
+        elif old_picture_url and (stored_picture_url or
+                                  (profile_picture_url is not None and profile_picture_url != old_picture_url)):
+            blob_store.release(old_picture_url)
+
+def reset_employee_password(employee_id, password_hash):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE employees SET password_hash = ? WHERE id = ?", (hash_password(new_password), employee_id))
+        cursor.execute("UPDATE employees SET password_hash = ? WHERE id = ?", (password_hash, employee_id))
         conn.commit()
         return cursor.rowcount > 0
     except Exception:
@@ -150,23 +288,51 @@ def reset_employee_password(employee_id, new_password):
 def delete_employee(employee_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Consider deleting profile picture file if it exists
+    cursor.execute("SELECT profile_picture_url FROM employees WHERE id = ?", (employee_id,))
+    row = cursor.fetchone()
     cursor.execute("DELETE FROM employees WHERE id = ?", (employee_id,))
     conn.commit()
     success = cursor.rowcount > 0
     conn.close()
+    if success and row and row[0]:
+        # The picture goes once no other employee shares it; links outside /uploads/ are left alone
+        blob_store.release(row[0])
     return success
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS")
     print("Access-Control-Allow-Headers: Content-Type")
-    print()
+    conditional_get.send_etag(['employees'])
 
     method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
-    form = cgi.FieldStorage() # Initialize once
+    try:
+        form = parse_form()
+    except FormError as e:
+        logger.warning(f"Rejected request body: {e}")
+        print()
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(0)
+
+    # Adding an employee, updating one and resetting a password all hash the form's password.
+    # That happens here, before the headers end, so a busy hashing pool is answered 429
+    # Too Many Requests whether admit() saw it coming or it filled up just after.
+    password_hash = None
+    importing = method == 'POST' and form.getvalue('action') == 'import'
+    if importing:
+        if form.getvalue('dry_run') not in ('1', 'true'):
+            password_hashing.admit() # The batch then waits for free workers instead of raising HashingBusy
+    elif method in ('POST', 'PUT') and form.getvalue('password'):
+        password_hashing.admit()
+        try:
+            password_hash = password_hashing.hash_password(form.getvalue('password'))
+        except password_hashing.HashingBusy as e:
+            logger.warning(f"Password hashing turned away: {e}")
+            password_hashing.send_busy()
+    print()
 
     if method == 'OPTIONS':
         logger.info("Handling OPTIONS request.")
@@ -179,6 +345,31 @@ def main():
             employees = get_all_employees()
             print(json.dumps({"success": True, "data": employees}))
 
+        elif importing:
+            file_item = form['import_file'] if 'import_file' in form else None
+            dry_run = form.getvalue('dry_run') in ('1', 'true')
+            logger.info(f"Handling bulk employee import: {file_item.filename if file_item else None} ({'dry run' if dry_run else 'import'})")
+            if not file_item or not file_item.filename:
+                logger.warning("Employee import attempt without a file.")
+                print(json.dumps({"success": False, "error": "A CSV or NDJSON file is required (field 'import_file')."}))
+                sys.exit(0)
+
+            try:
+                created, errors = import_employees(file_item, dry_run)
+            except ValueError as e:
+                logger.warning(f"Rejected employee import file: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                sys.exit(0)
+
+            if errors:
+                logger.warning(f"Employee import rejected: {len(errors)} row(s) with errors")
+                print(json.dumps({"success": False, "error": f"{len(errors)} row(s) have errors; no employees were imported.", "errors": errors}))
+            elif dry_run:
+                print(json.dumps({"success": True, "message": "The file is valid; no employees were imported (dry run)."}))
+            else:
+                logger.info(f"Imported {len(created)} employees")
+                print(json.dumps({"success": True, "message": f"Imported {len(created)} employees.", "data": created}))
+
         elif method == 'POST':
             logger.info("Handling POST request to add new employee.")
             data = {field: form.getvalue(field) for field in form if field != 'profile_picture_file'}
@@ -190,7 +381,7 @@ def main():
                 print(json.dumps({"success": False, "error": "Full name, username, and password are required."}))
                 sys.exit(0)
 
-            employee_id, error = add_employee(data, profile_pic_item)
+            employee_id, error = add_employee(data, profile_pic_item, password_hash)
             if error:
                 logger.error(f"Error adding employee: {error}")
                 print(json.dumps({"success": False, "error": error}))
@@ -220,13 +411,12 @@ def main():
             logger.info(f"Action for PUT: {action}, Employee ID: {employee_id}")
 
             if action == 'reset_password':
-                new_password = form.getvalue('password')
                 logger.debug(f"Password reset attempt for employee ID: {employee_id}")
-                if not new_password:
+                if not password_hash:
                     logger.warning(f"Password reset for employee ID {employee_id} failed: New password not provided.")
                     print(json.dumps({"success": False, "error": "New password is required for reset."}))
                     sys.exit(0)
-                if reset_employee_password(employee_id, new_password):
+                if reset_employee_password(employee_id, password_hash):
                     logger.info(f"Password for employee ID {employee_id} reset successfully.")
                     print(json.dumps({"success": True, "message": "Password reset successfully."}))
                 else:
@@ -243,7 +433,7 @@ def main():
                      print(json.dumps({"success": False, "error": "Full name and username are required for update."}))
                      sys.exit(0)
 
-                success, error = update_employee(employee_id, data, profile_pic_item)
+                success, error = update_employee(employee_id, data, profile_pic_item, password_hash)
                 if error:
                      logger.error(f"Error updating employee ID {employee_id}: {error}")
                      print(json.dumps({"success": False, "error": error}))
@@ -1,41 +1,82 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
 import sys
-import bcrypt
 from html import escape
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import session_tokens # Signed, expiring employee session tokens
+import password_hashing # bcrypt in a bounded worker pool
+import login_throttle # Per-username / per-IP login rate limits
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-# Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-
-def get_db_connection():
-    """Get database connection."""
-    return sqlite3.connect(DB_PATH)
-
-def verify_password(plain_password, hashed_password_hex):
-    """Verify a plain password against a stored hex-encoded hashed password."""
+def rehash_password(employee_id, plain_password):
+    """Store the password again at the current bcrypt cost; a busy pool just defers it to the next login."""
     try:
-        hashed_password = bytes.fromhex(hashed_password_hex)
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
-    except (ValueError, TypeError):
-        return False
-
+        password_hash = password_hashing.hash_password(plain_password)
+    except password_hashing.HashingBusy:
+        logger.info(f"Hashing pool busy; rehash of employee ID {employee_id} deferred.")
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE employees SET password_hash = ? WHERE id = ?", (password_hash, employee_id))
+    conn.commit()
+    conn.close()
+    logger.info(f"Password of employee ID {employee_id} rehashed at cost {password_hashing.BCRYPT_ROUNDS}.")
+
+def authenticate(username, password):
+    """(employee row, whether the password matches it); the row is None for an unknown username"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, full_name, username, password_hash, designation, profile_picture_url, email, phone FROM employees WHERE username = ?", (username,))
+    employee_row = cursor.fetchone()
+    conn.close()
+    if not employee_row:
+        return None, False
+    return employee_row, password_hashing.verify_password(password, employee_row[3])
+
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: POST, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type")
+    print("Access-Control-Allow-Headers: Content-Type, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    form_data = {}
+    username = password = ''
+    login = None # (employee row, password matches) once the credentials are checked
+    login_error = None
+    if method == 'POST':
+        # Read the form and check the password before ending the headers, so a throttled
+        # login, or one the busy hashing pool can't take, can still be answered 429
+        try:
+            content_length = int(os.environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        form_data = urllib.parse.parse_qs(sys.stdin.read(content_length))
+        if form_data.get('action', [''])[0] != 'logout':
+            username = form_data.get('username', [''])[0].strip()
+            # Password is not logged for security
+            password = form_data.get('password', [''])[0].strip()
+            login_throttle.admit('employee', username)
+            password_hashing.admit()
+            if username and password:
+                logger.debug(f"Attempting login for username: {username}")
+                try:
+                    login = authenticate(username, password)
+                except password_hashing.HashingBusy as e:
+                    logger.warning(f"Employee login turned away: {e}")
+                    password_hashing.send_busy()
+                except Exception as e:
+                    login_error = e
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -46,43 +87,49 @@ def main():
     if method == 'POST':
         logger.info("Processing POST request for employee login.")
         try:
-            content_length = int(os.environ.get('CONTENT_LENGTH', 0))
-            post_data_raw = sys.stdin.read(content_length)
-            form_data = urllib.parse.parse_qs(post_data_raw)
-
-            username = form_data.get('username', [''])[0].strip()
-            # Password is not logged for security
-            password = form_data.get('password', [''])[0].strip()
-            logger.debug(f"Attempting login for username: {username}")
-
+            if form_data.get('action', [''])[0] == 'logout':
+                try:
+                    session = session_tokens.current_session()
+                except session_tokens.InvalidSession as e:
+                    # Already unusable; nothing to revoke
+                    logger.info(f"Logout with an invalid session token: {e}")
+                    session = None
+                if session:
+                    session_tokens.revoke(session)
+                    logger.info(f"Employee ID {session['sub']} logged out; session {session['jti']} revoked.")
+                print(json.dumps({"success": True}))
+                sys.exit(0)
 
             if not username or not password:
                 logger.warning("Employee login attempt with missing username or password.")
                 print(json.dumps({"success": False, "error": "Username and password are required."}))
                 sys.exit(0)
+            if login_error:
+                raise login_error
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT id, full_name, username, password_hash, designation, profile_picture_url, email, phone FROM employees WHERE username = ?", (username,))
-            employee_row = cursor.fetchone()
-            conn.close()
-
+            employee_row, password_matches = login
             if employee_row:
                 employee_id, full_name, emp_username, stored_password_hash, designation, profile_pic, email, phone = employee_row
-                if verify_password(password, stored_password_hash):
+                if password_matches:
                     logger.info(f"Employee '{username}' (ID: {employee_id}) authenticated successfully.")
+                    login_throttle.record_success('employee', username)
+                    if password_hashing.needs_rehash(stored_password_hash):
+                        rehash_password(employee_id, password)
                     employee_data = {
                         "id": employee_id, "full_name": full_name, "username": emp_username,
                         "designation": designation, "profile_picture_url": profile_pic,
                         "email": email, "phone": phone
                     }
-                    print(json.dumps({"success": True, "employee": employee_data}))
+                    token, claims = session_tokens.issue(employee_id)
+                    print(json.dumps({"success": True, "employee": employee_data,
+                                      "token": token, "expires_at": claims['exp']}))
                 else:
                     logger.warning(f"Invalid password for employee '{username}'.")
+                    login_throttle.record_failure('employee', username)
                     print(json.dumps({"success": False, "error": "Invalid username or password."}))
             else:
                 logger.warning(f"Employee username '{username}' not found.")
+                login_throttle.record_failure('employee', username)
                 print(json.dumps({"success": False, "error": "Invalid username or password."}))
 
         except Exception as e:
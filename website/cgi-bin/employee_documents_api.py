@@ -1,26 +1,22 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
 import sys
-import uuid
 from datetime import datetime
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+import blob_store # Content-addressed, reference-counted upload storage
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import session_tokens # Signed, expiring employee session tokens
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-# Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-UPLOAD_DIR_EMPLOYEE_DOCS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'employee_documents')
-os.makedirs(UPLOAD_DIR_EMPLOYEE_DOCS, exist_ok=True)
-
-def get_db_connection():
-    return sqlite3.connect(DB_PATH)
-
 def save_employee_document(employee_id, file_item, document_type):
     if not file_item or not file_item.filename:
         return None, "No file provided or filename missing."
@@ -31,21 +27,9 @@ def save_employee_document(employee_id, file_item, document_type):
     if ext.lower() not in allowed_extensions:
         return None, f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
 
-    # Sanitize document_type and original_filename for path construction (though uuid is main part)
-    sane_doc_type = "".join(c if c.isalnum() else "_" for c in document_type)
-    unique_filename_base = str(uuid.uuid4())
-
-    # Create a subdirectory for each employee if it doesn't exist
-    employee_specific_dir = os.path.join(UPLOAD_DIR_EMPLOYEE_DOCS, str(employee_id))
-    os.makedirs(employee_specific_dir, exist_ok=True)
-
-    unique_filename = f"{sane_doc_type}_{unique_filename_base}{ext.lower()}"
-    file_path_on_disk = os.path.join(employee_specific_dir, unique_filename)
-
     try:
-        with open(file_path_on_disk, 'wb') as f:
-            f.write(file_item.file.read())
-        web_accessible_path = f"/uploads/employee_documents/{employee_id}/{unique_filename}"
+        # Re-uploading the same scan (for this or another employee) reuses the stored copy
+        web_accessible_path = blob_store.store(file_item, ext)
         return web_accessible_path, original_filename, None
     except Exception as e:
         return None, None, f"Error saving file: {str(e)}"
@@ -100,16 +84,13 @@ def delete_document_record(doc_id, employee_id):
 
         conn.commit()
 
-        # Delete the actual file from disk
+        # Drop this record's reference; the file goes once no other document shares it
         if file_path_web:
-            base_website_dir = os.path.dirname(os.path.dirname(__file__))
-            file_path_disk = os.path.join(base_website_dir, file_path_web.lstrip('/'))
-            if os.path.exists(file_path_disk):
-                try:
-                    os.remove(file_path_disk)
-                except OSError as e:
-                    # Log this, but DB record is already deleted.
-                    print(f"Warning: Could not delete document file {file_path_disk}: {e}", file=sys.stderr)
+            try:
+                blob_store.release(file_path_web)
+            except Exception as e:
+                # Log this, but DB record is already deleted.
+                logger.warning(f"Could not release document file {file_path_web}: {e}")
         return True, None
     except Exception as e:
         conn.rollback()
@@ -117,14 +98,19 @@ def delete_document_record(doc_id, employee_id):
     finally:
         conn.close()
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, DELETE, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID")
+    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    # Checked before the ETag goes out, so an expired or revoked token never gets a 304. Old
+    # clients may send X-Employee-ID / employee_id instead only with MATRICA_REQUIRE_SESSION=off
+    employee_id_str = session_tokens.employee_id_from_request() if method != 'OPTIONS' else None
+    conditional_get.send_etag(['employee_documents'])
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -132,8 +118,12 @@ def main():
         print(json.dumps({"status": "ok"}))
         sys.exit(0)
 
-    employee_id_str = os.environ.get('HTTP_X_EMPLOYEE_ID')
-    form = cgi.FieldStorage() # Initialize once for POST
+    try:
+        form = parse_form()
+    except FormError as e:
+        logger.warning(f"Rejected request body: {e}")
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(0)
 
     if not employee_id_str:
         if method == 'POST': # For POST, employee_id might be in form data
@@ -180,18 +170,16 @@ def main():
                 print(json.dumps({"success": False, "error": error_save}))
                 sys.exit(0)
 
-            logger.info(f"Document file saved for employee {employee_id} at {web_path}")
+            logger.info(f"Document file saved for employee {employee_id} at {web_path} ({file_item.size} bytes, sha256 {file_item.sha256})")
             doc_db_id, error_db = add_document_record(employee_id, document_type, original_name, web_path)
             if error_db:
                 logger.error(f"Error adding document record to DB for employee {employee_id}: {error_db}")
-                if web_path: # Attempt to delete the saved file if DB record fails
-                    disk_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), web_path.lstrip('/'))
-                    if os.path.exists(disk_path):
-                        try:
-                            os.remove(disk_path)
-                            logger.info(f"Cleaned up orphaned file: {disk_path}")
-                        except Exception as e_rm:
-                            logger.error(f"Failed to cleanup orphaned file {disk_path}: {e_rm}")
+                if web_path: # Give back the reference taken when the file was stored
+                    try:
+                        blob_store.release(web_path)
+                        logger.info(f"Released orphaned file: {web_path}")
+                    except Exception as e_rm:
+                        logger.error(f"Failed to release orphaned file {web_path}: {e_rm}")
                 print(json.dumps({"success": False, "error": error_db}))
                 sys.exit(0)
 
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
@@ -7,15 +6,17 @@ import sys
 from html import escape
 import urllib.parse
 from logger_config import get_logger # Import the logger
-import uuid # For unique filenames, if needed for profile pic path generation
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+import blob_store # Content-addressed, reference-counted upload storage
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import session_tokens # Signed, expiring employee session tokens
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-# Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-
 # A simple mock for session management - in a real app, use secure session handling
 # For now, we'll assume employee_id might be passed or somehow available.
 # This part needs to be integrated with the actual employee login/session mechanism.
@@ -25,13 +26,6 @@ DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', '
 # For this step, we'll make it require an 'employee_id' parameter for GET/PUT for simplicity.
 # This is NOT secure for a real application without proper session validation.
 
-UPLOAD_DIR_EMPLOYEE_PROFILE_PICS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'employee_profiles')
-os.makedirs(UPLOAD_DIR_EMPLOYEE_PROFILE_PICS, exist_ok=True)
-
-
-def get_db_connection():
-    """Get database connection."""
-    return sqlite3.connect(DB_PATH)
 
 def save_employee_profile_picture(file_item):
     """Save uploaded profile picture and return its web-accessible path."""
@@ -42,14 +36,8 @@ def save_employee_profile_picture(file_item):
     if ext.lower() not in ['.jpg', '.jpeg', '.png', '.gif']:
         return None, "Invalid file type. Only JPG, PNG, GIF allowed."
 
-    unique_filename = str(uuid.uuid4()) + ext.lower()
-    file_path_on_disk = os.path.join(UPLOAD_DIR_EMPLOYEE_PROFILE_PICS, unique_filename)
-
     try:
-        with open(file_path_on_disk, 'wb') as f:
-            f.write(file_item.file.read())
-        web_accessible_path = f"/uploads/employee_profiles/{unique_filename}"
-        return web_accessible_path, None
+        return blob_store.store(file_item, ext), None
     except Exception as e:
         return None, f"Error saving file: {str(e)}"
 
@@ -119,14 +107,19 @@ def update_employee_profile_picture(employee_id, new_picture_url):
         conn.close()
 
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, PUT, POST, OPTIONS") # Added POST for potential separate pic upload
-    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID")
+    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    # Checked before the ETag goes out, so an expired or revoked token never gets a 304. Old
+    # clients may send X-Employee-ID / employee_id instead only with MATRICA_REQUIRE_SESSION=off
+    employee_id_str = session_tokens.employee_id_from_request() if method != 'OPTIONS' else None
+    conditional_get.send_etag(['employees'])
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -134,8 +127,12 @@ def main():
         print(json.dumps({"status": "ok"}))
         sys.exit(0)
 
-    employee_id_str = os.environ.get('HTTP_X_EMPLOYEE_ID')
-    form = cgi.FieldStorage() # Initialize for PUT if needed
+    try:
+        form = parse_form()
+    except FormError as e:
+        logger.warning(f"Rejected request body: {e}")
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(0)
 
     if not employee_id_str:
         if method in ['PUT', 'POST']: # Check form data for employee_id if not in header
@@ -170,7 +167,7 @@ def main():
 
         elif method == 'PUT':
             logger.info(f"Handling PUT request for employee profile ID: {employee_id}")
-            # cgi.FieldStorage 'form' is already initialized
+            # 'form' is already parsed
 
             data = {
                 'full_name': escape(form.getvalue('full_name', '')),
@@ -183,6 +180,13 @@ def main():
             profile_pic_file_item = form['profile_picture_file'] if 'profile_picture_file' in form else None
             file_error = None
 
+            logger.debug(f"Data for profile update (ID {employee_id}): {data}")
+            if not data.get('full_name') or not data.get('email'):
+                 logger.warning(f"Update attempt for employee ID {employee_id} with missing full name or email.")
+                 print(json.dumps({"success": False, "error": "Full name and email are required."}))
+                 sys.exit(0)
+
+            old_pic_path_web = new_profile_pic_web_path = None
             if profile_pic_file_item and profile_pic_file_item.filename:
                 logger.info(f"Processing profile picture upload for employee ID: {employee_id}")
                 current_profile = get_employee_profile(employee_id)
@@ -196,26 +200,23 @@ def main():
 
                 data['profile_picture_url'] = new_profile_pic_web_path
                 logger.info(f"New profile picture URL for employee ID {employee_id}: {new_profile_pic_web_path}")
-
-                if old_pic_path_web and old_pic_path_web.startswith('/uploads/employee_profiles/'):
-                    old_pic_disk_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), old_pic_path_web.lstrip('/'))
-                    if os.path.exists(old_pic_disk_path):
-                        try:
-                            os.remove(old_pic_disk_path)
-                            logger.info(f"Old profile picture deleted: {old_pic_disk_path}")
-                        except OSError as e:
-                            logger.warning(f"Could not delete old profile picture {old_pic_disk_path}: {e}")
             # If no new file, data['profile_picture_url'] will not be set here,
             # so update_employee_basic_info will preserve existing if 'profile_picture_url' not in data.
             # This is correct as employee form doesn't send text URL.
 
-            logger.debug(f"Data for profile update (ID {employee_id}): {data}")
-            if not data.get('full_name') or not data.get('email'):
-                 logger.warning(f"Update attempt for employee ID {employee_id} with missing full name or email.")
-                 print(json.dumps({"success": False, "error": "Full name and email are required."}))
-                 sys.exit(0)
-
-            success, error_msg = update_employee_basic_info(employee_id, data)
+            success = False
+            try:
+                success, error_msg = update_employee_basic_info(employee_id, data)
+            finally:
+                if new_profile_pic_web_path:
+                    # Only once the update is saved does the old picture lose its reference; if it
+                    # wasn't, the new one is the reference nobody holds
+                    released = old_pic_path_web if success else new_profile_pic_web_path
+                    try:
+                        if released and blob_store.release(released):
+                            logger.info(f"Profile picture deleted: {released}")
+                    except Exception as e:
+                        logger.warning(f"Could not release profile picture {released}: {e}")
 
             if success:
                 updated_profile = get_employee_profile(employee_id) # Fetch fresh data
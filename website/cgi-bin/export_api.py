@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Data export API
+Streams contacts, attendance, leave requests or tasks as CSV or NDJSON, a chunk of rows
+at a time straight from the SQLite cursor, so an export of any size starts at once and
+never sits in memory as a whole
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import urllib.parse
+import zlib
+from datetime import datetime, timedelta, date as datetime_date
+from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+from http_headers import accepts_gzip # Accept-Encoding parsing shared with server.py
+
+# Initialize logger
+script_name = os.path.basename(__file__)
+logger = get_logger(script_name)
+
+# Rows fetched, formatted and flushed to the client at a time
+CHUNK_ROWS = 1000
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+# Each export reads its table in id order, which is the table's own storage order, so SQLite
+# returns the first rows without sorting anything. 'date' is the column date_from/date_to
+# filter on; 'employee' the one employee_id filters on (one employee's rows are few enough
+# to sort).
+DATASETS = {
+    'contacts': {
+        'select': """
+            SELECT t.id, t.name, t.email, t.phone, t.company, t.subject, t.message, t.timestamp
+            FROM contacts t
+        """,
+        'tables': ['contacts'],
+        'date': 't.timestamp',
+        'employee': None,
+    },
+    'attendance': {
+        'select': """
+            SELECT t.id, t.employee_id, e.username, e.full_name, t.date, t.punch_in_time, t.punch_out_time
+            FROM attendance t LEFT JOIN employees e ON e.id = t.employee_id
+        """,
+        'tables': ['attendance', 'employees'],
+        'date': 't.date',
+        'employee': 't.employee_id',
+    },
+    'leave': {
+        'select': """
+            SELECT t.id, t.employee_id, e.username, e.full_name, t.start_date, t.end_date, t.reason, t.status,
+                   t.requested_at
+            FROM leave_requests t LEFT JOIN employees e ON e.id = t.employee_id
+        """,
+        'tables': ['leave_requests', 'employees'],
+        'date': 't.start_date',
+        'employee': 't.employee_id',
+    },
+    'tasks': {
+        'select': """
+            SELECT t.id, t.assigned_to_employee_id AS employee_id, e.username, e.full_name, t.title, t.description,
+                   t.due_date, t.status, t.created_at, t.updated_at
+            FROM tasks t LEFT JOIN employees e ON e.id = t.assigned_to_employee_id
+        """,
+        'tables': ['tasks', 'employees'],
+        'date': 't.due_date',
+        'employee': 't.assigned_to_employee_id',
+    },
+}
+
+def parse_export_params(query_string):
+    """Parse dataset, format, date_from, date_to and employee_id; raises ValueError on bad input"""
+    query_params = urllib.parse.parse_qs(query_string)
+    get_param = lambda name: query_params.get(name, [''])[0].strip()
+
+    params = {
+        'dataset': get_param('dataset'),
+        'format': get_param('format') or 'csv',
+        'date_from': get_param('date_from'),
+        'date_to': get_param('date_to'),
+        'employee_id': None,
+    }
+    if params['dataset'] not in DATASETS:
+        raise ValueError(f"'dataset' must be one of: {', '.join(DATASETS)}.")
+    if params['format'] not in FORMATS:
+        raise ValueError(f"'format' must be one of: {', '.join(FORMATS)}.")
+    for name in ('date_from', 'date_to'):
+        if params[name]:
+            try:
+                datetime.strptime(params[name], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format.")
+    if get_param('employee_id'):
+        if DATASETS[params['dataset']]['employee'] is None:
+            raise ValueError(f"'employee_id' doesn't apply to {params['dataset']}.")
+        try:
+            params['employee_id'] = int(get_param('employee_id'))
+        except ValueError:
+            raise ValueError("'employee_id' must be an integer.")
+    return params
+
+def build_export_query(params):
+    """SELECT statement and parameters for an export"""
+    dataset = DATASETS[params['dataset']]
+    clauses, values = [], []
+    # The date filters scan the table on purpose. The unary + keeps SQLite off the date
+    # indexes, because a range read through one comes out in date order: every matching row
+    # would be sorted into id order in a temp B-tree before the first could be sent. That
+    # holds the response back and buffers the whole export, which streaming exists to avoid.
+    # A scan in id order sends rows as it finds them, and an export range is usually a large
+    # part of the table anyway.
+    if params['date_from']:
+        clauses.append(f"+{dataset['date']} >= ?")
+        values.append(params['date_from'])
+    if params['date_to']:
+        # date_to includes the whole day, also for timestamps
+        next_day = datetime.strptime(params['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        clauses.append(f"+{dataset['date']} < ?")
+        values.append(next_day.strftime('%Y-%m-%d'))
+    if params['employee_id'] is not None:
+        clauses.append(f"{dataset['employee']} = ?")
+        values.append(params['employee_id'])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return f"{dataset['select']} {where} ORDER BY t.id", values
+
+class BodyWriter:
+    """Sends the export body to stdout's byte stream, gzipped if asked, flushing after every write"""
+
+    def __init__(self, compress):
+        self.out = sys.stdout.buffer
+        # wbits=31 writes the gzip container rather than a bare zlib stream
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.bytes = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.bytes += len(data)
+        if self.compressor:
+            # A sync flush per chunk lets the client decompress everything received so far
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.out.write(data)
+        self.out.flush()
+
+    def close(self):
+        if self.compressor:
+            self.out.write(self.compressor.flush())
+            self.out.flush()
+
+def stream_rows(cursor, export_format, write):
+    """Format the cursor's rows CHUNK_ROWS at a time, passing each chunk's text to write(); returns the row count"""
+    columns = [column[0] for column in cursor.description]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(columns)
+    count = 0
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            break
+        if export_format == 'csv':
+            writer.writerows(rows)
+        else:
+            buffer.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+        count += len(rows)
+        write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        write(buffer.getvalue())  # The CSV header of an export without rows
+    return count
+
+def export(params, compress):
+    """Send the response headers, then the export itself"""
+    dataset = DATASETS[params['dataset']]
+    print(f"Content-Type: {FORMATS[params['format']]}")
+    print(f'Content-Disposition: attachment; filename="{params["dataset"]}-{datetime_date.today().isoformat()}.{params["format"]}"')
+    print("Access-Control-Allow-Origin: *")
+    print("Access-Control-Allow-Methods: GET, OPTIONS")
+    print("Access-Control-Allow-Headers: Content-Type")
+    conditional_get.send_etag(dataset['tables'], extra=['gzip' if compress else 'identity'])
+    print("Vary: Accept-Encoding")
+    if compress:
+        print("Content-Encoding: gzip")
+    print()
+    # Flushing after the headers is what makes server.py stream the response rather than
+    # collect it; under CGI it hands them to the web server straight away
+    sys.stdout.flush()
+
+    body = BodyWriter(compress)
+    query, values = build_export_query(params)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, values)
+        count = stream_rows(cursor, params['format'], body.write)
+        body.close()
+    except OSError as e:
+        # The client went away; there is nobody left to tell
+        logger.warning(f"Export of {params['dataset']} stopped, client disconnected: {e}")
+        return
+    finally:
+        conn.close()
+    logger.info(f"Exported {count} {params['dataset']} rows as {params['format']} ({body.bytes} bytes before compression)")
+
+@logged
+def main():
+    """Main handler function"""
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
+
+    params = None
+    error = None
+    if method == 'GET':
+        try:
+            params = parse_export_params(os.environ.get('QUERY_STRING', ''))
+        except ValueError as e:
+            logger.warning(f"Invalid export parameters: {e}")
+            error = str(e)
+    elif method != 'OPTIONS':
+        logger.warning(f"Method {method} not allowed for this endpoint.")
+        error = f"Method {method} not allowed."
+
+    if params is None:
+        print("Content-Type: application/json")
+        print("Access-Control-Allow-Origin: *")
+        print("Access-Control-Allow-Methods: GET, OPTIONS")
+        print("Access-Control-Allow-Headers: Content-Type")
+        print()
+        if error:
+            print(json.dumps({"success": False, "error": error}))
+        else:
+            logger.info("Handling OPTIONS request.")
+            print(json.dumps({"status": "ok"}))
+        sys.exit(0)
+
+    compress = accepts_gzip(os.environ.get('HTTP_ACCEPT_ENCODING', ''))
+    logger.info(f"Exporting {params['dataset']} as {params['format']}{' (gzip)' if compress else ''}: "
+                f"date_from={params['date_from']}, date_to={params['date_to']}, employee_id={params['employee_id']}")
+    try:
+        export(params, compress)
+    except Exception as e:
+        # The headers are out by now: fail the request so the server cuts the response short
+        # instead of ending it like a complete export
+        logger.error(f"Unhandled error in {script_name}: {e}", exc_info=True)
+        raise
+
+if __name__ == "__main__":
+    logger.info(f"{script_name} script started (likely direct execution or misconfiguration).")
+    main()
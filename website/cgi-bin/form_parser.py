@@ -0,0 +1,307 @@
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import urllib.parse
+import weakref
+
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads')
+# File parts are streamed here first. It sits inside uploads/ so the final os.replace()
+# into place is a rename on the same filesystem, never a copy.
+STAGING_DIR = os.path.join(UPLOAD_ROOT, '.incoming')
+
+# Largest single uploaded file accepted (bytes)
+MAX_UPLOAD_BYTES = int(os.environ.get('MATRICA_MAX_UPLOAD_BYTES', 25 * 1024 * 1024))
+# Text fields are held in memory, so each one (and a urlencoded body as a whole) is kept small
+MAX_FIELD_BYTES = 1024 * 1024
+# No form in the site has more than a handful of fields
+MAX_PARTS = 128
+CHUNK_SIZE = 64 * 1024
+
+
+class FormError(ValueError):
+    """The request body is malformed or breaks one of the limits above."""
+
+
+class UploadTooLarge(FormError):
+    pass
+
+
+class UploadedFile:
+    """A file part that has been streamed to a staging file.
+
+    Mirrors the parts of cgi.FieldStorage the APIs relied on (name, filename, type)
+    and adds the size and SHA-256 computed while the part was written. The content is
+    never held in memory; call save_as() to move it to its final location.
+    """
+
+    def __init__(self, name, filename, content_type, temp_path, size, sha256):
+        self.name = name
+        self.filename = filename
+        self.type = content_type
+        self.temp_path = temp_path
+        self.size = size
+        self.sha256 = sha256
+
+    def save_as(self, path):
+        """Atomically move the upload to path; readers never see a partially written file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(self.temp_path, 0o644)  # mkstemp() creates the file owner-only
+        os.replace(self.temp_path, path)
+        self.temp_path = None
+        return path
+
+    def discard(self):
+        if self.temp_path:
+            _remove_quietly(self.temp_path)
+            self.temp_path = None
+
+
+class FormData:
+    """Parsed request fields, with the lookup methods of cgi.FieldStorage the APIs use."""
+
+    def __init__(self):
+        self._items = []
+        self._uploads = []
+        # Unsaved staging files are removed when the form goes away: at the end of the
+        # request under in-process dispatch, or at interpreter exit under CGI.
+        self._finalizer = weakref.finalize(self, _remove_unsaved, self._uploads)
+
+    def add_value(self, name, value):
+        self._items.append((name, value))
+
+    def add_file(self, upload):
+        self._items.append((upload.name, upload))
+        self._uploads.append(upload)
+
+    def __contains__(self, name):
+        return any(item_name == name for item_name, _ in self._items)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(dict.fromkeys(name for name, _ in self._items))
+
+    def __getitem__(self, name):
+        for item_name, value in self._items:
+            if item_name == name:
+                return value
+        raise KeyError(name)
+
+    def getlist(self, name):
+        return [value for item_name, value in self._items if item_name == name and not isinstance(value, UploadedFile)]
+
+    def getvalue(self, name, default=None):
+        """Text value of a field (a list if it was sent more than once); file parts are skipped."""
+        values = self.getlist(name)
+        if not values:
+            return default
+        return values[0] if len(values) == 1 else values
+
+    def close(self):
+        self._finalizer()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_unsaved(uploads):
+    for upload in uploads:
+        upload.discard()
+
+
+def parse_form(environ=None, stream=None, max_upload_bytes=MAX_UPLOAD_BYTES):
+    """Parse the query string and request body of the current request.
+
+    Drop-in for cgi.FieldStorage(): urlencoded fields are decoded in memory, file parts
+    of a multipart body are written to disk in CHUNK_SIZE pieces as they arrive.
+    Raises FormError (UploadTooLarge for an oversized file) on a bad body.
+    """
+    environ = os.environ if environ is None else environ
+    stream = sys.stdin.buffer if stream is None else stream
+
+    form = FormData()
+    method = environ.get('REQUEST_METHOD', 'GET').upper()
+    query_string = environ.get('QUERY_STRING', '')
+
+    if method not in ('GET', 'HEAD'):
+        content_type = environ.get('CONTENT_TYPE', '')
+        try:
+            content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise FormError("Invalid Content-Length.")
+
+        if content_length > 0 and content_type.lower().startswith('multipart/form-data'):
+            boundary = re.search(r'boundary="?([^";]+)"?', content_type)
+            if not boundary:
+                raise FormError("Multipart request without a boundary.")
+            reader = _BodyReader(stream, content_length)
+            _parse_multipart(reader, boundary.group(1).encode('latin-1'), form, max_upload_bytes)
+        elif content_length > 0 and content_type.lower().startswith('application/x-www-form-urlencoded'):
+            if content_length > MAX_FIELD_BYTES:
+                raise FormError("Form data is too large.")
+            body = stream.read(content_length).decode('utf-8', 'replace')
+            for name, value in urllib.parse.parse_qsl(body):
+                form.add_value(name, value)
+
+    for name, value in urllib.parse.parse_qsl(query_string):
+        form.add_value(name, value)
+    return form
+
+
+class _BodyReader:
+    """Reads at most content_length bytes of the body, a chunk at a time."""
+
+    def __init__(self, stream, content_length):
+        self._stream = stream
+        self._remaining = content_length
+
+    def read_chunk(self):
+        if self._remaining <= 0:
+            return b''
+        chunk = self._stream.read(min(CHUNK_SIZE, self._remaining))
+        self._remaining -= len(chunk)
+        return chunk
+
+
+def _parse_multipart(reader, boundary, form, max_upload_bytes):
+    delimiter = b'--' + boundary
+    buffer = b''
+
+    # Skip the preamble up to the first delimiter
+    while True:
+        index = buffer.find(delimiter)
+        if index != -1:
+            buffer = buffer[index + len(delimiter):]
+            break
+        chunk = reader.read_chunk()
+        if not chunk:
+            raise FormError("Multipart body has no parts.")
+        buffer = buffer[-len(delimiter):] + chunk
+
+    # Every part ends at CRLF followed by the delimiter
+    part_end = b'\r\n' + delimiter
+    parts = 0
+    while True:
+        while len(buffer) < 2:
+            chunk = reader.read_chunk()
+            if not chunk:
+                raise FormError("Multipart body ended unexpectedly.")
+            buffer += chunk
+        if buffer.startswith(b'--'):
+            return  # Closing delimiter
+        if not buffer.startswith(b'\r\n'):
+            raise FormError("Malformed multipart delimiter.")
+        buffer = buffer[2:]
+
+        parts += 1
+        if parts > MAX_PARTS:
+            raise FormError("Too many form fields.")
+
+        while b'\r\n\r\n' not in buffer:
+            if len(buffer) > MAX_FIELD_BYTES:
+                raise FormError("Multipart headers are too large.")
+            chunk = reader.read_chunk()
+            if not chunk:
+                raise FormError("Multipart body ended unexpectedly.")
+            buffer += chunk
+        raw_headers, buffer = buffer.split(b'\r\n\r\n', 1)
+        name, filename, content_type = _parse_part_headers(raw_headers)
+
+        if filename is None:
+            sink = _FieldSink(name)
+        else:
+            sink = _FileSink(name, filename, content_type, max_upload_bytes)
+        try:
+            while True:
+                index = buffer.find(part_end)
+                if index != -1:
+                    sink.write(buffer[:index])
+                    buffer = buffer[index + len(part_end):]
+                    break
+                # Keep a tail that could be the start of a delimiter split across chunks
+                keep = len(part_end) - 1
+                if len(buffer) > keep:
+                    sink.write(buffer[:-keep])
+                    buffer = buffer[-keep:]
+                chunk = reader.read_chunk()
+                if not chunk:
+                    raise FormError("Multipart body ended unexpectedly.")
+                buffer += chunk
+        except BaseException:
+            sink.abort()
+            raise
+        sink.finish(form)
+
+
+def _parse_part_headers(raw_headers):
+    name, filename, content_type = None, None, 'application/octet-stream'
+    for line in raw_headers.decode('utf-8', 'replace').split('\r\n'):
+        header, _, value = line.partition(':')
+        header = header.strip().lower()
+        if header == 'content-disposition':
+            name_match = re.search(r'(?:^|;)\s*name="([^"]*)"', value)
+            filename_match = re.search(r'(?:^|;)\s*filename="([^"]*)"', value)
+            name = name_match.group(1) if name_match else None
+            if filename_match:
+                # Old IE sends the full client path; only the base name is useful
+                filename = re.split(r'[\\/]', filename_match.group(1))[-1]
+        elif header == 'content-type':
+            content_type = value.strip()
+    if name is None:
+        raise FormError("Multipart part without a field name.")
+    return name, filename, content_type
+
+
+class _FieldSink:
+    def __init__(self, name):
+        self.name = name
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > MAX_FIELD_BYTES:
+            raise FormError(f"Field '{self.name}' is too large.")
+        self.chunks.append(data)
+
+    def abort(self):
+        pass
+
+    def finish(self, form):
+        form.add_value(self.name, b''.join(self.chunks).decode('utf-8', 'replace'))
+
+
+class _FileSink:
+    def __init__(self, name, filename, content_type, max_upload_bytes):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.max_upload_bytes = max_upload_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix='upload-', dir=STAGING_DIR)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_upload_bytes:
+            raise UploadTooLarge(f"File '{self.filename}' is larger than the {round(self.max_upload_bytes / (1024 * 1024), 1):g} MB limit.")
+        self.digest.update(data)
+        self.file.write(data)
+
+    def abort(self):
+        self.file.close()
+        _remove_quietly(self.temp_path)
+
+    def finish(self, form):
+        self.file.close()
+        form.add_file(UploadedFile(self.name, self.filename, self.content_type,
+                                   self.temp_path, self.size, self.digest.hexdigest()))
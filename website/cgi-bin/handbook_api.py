@@ -1,27 +1,21 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
 import sys
-import uuid
 from datetime import datetime
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+import blob_store # Content-addressed, reference-counted upload storage
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
 import traceback # For detailed exception logging
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-# Database setup
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-UPLOAD_DIR_HANDBOOK = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'company_handbook')
-os.makedirs(UPLOAD_DIR_HANDBOOK, exist_ok=True)
-
-def get_db_connection():
-    """Get database connection."""
-    return sqlite3.connect(DB_PATH)
-
 def get_current_handbook():
     """Retrieve current handbook details from DB."""
     conn = get_db_connection()
@@ -44,18 +38,9 @@ def save_handbook_file(file_item):
     if ext.lower() != '.pdf':
         raise ValueError("Invalid file type. Only PDF files are allowed for the handbook.")
 
-    # Use a fixed name or a name derived from original, but ensure uniqueness if multiple versions were stored.
-    # For a single handbook system, a fixed name like 'company_handbook.pdf' is simplest.
-    # unique_filename = "company_handbook" + ext.lower()
-    # Or, to allow different names if admin uploads "MyCompanyHandbook_v2.pdf"
-    unique_filename = str(uuid.uuid4()) + ext.lower() # Keep it unique to avoid caching issues if replaced
-
-    file_path_on_disk = os.path.join(UPLOAD_DIR_HANDBOOK, unique_filename)
-
-    with open(file_path_on_disk, 'wb') as f:
-        f.write(file_item.file.read())
-
-    web_accessible_path = f"/uploads/company_handbook/{unique_filename}"
+    # Stored under its content hash, so a new version always gets a new URL (no stale caches)
+    # and re-uploading the current handbook reuses the file already on disk.
+    web_accessible_path = blob_store.store(file_item, ext)
     return web_accessible_path, original_filename
 
 def add_or_replace_handbook(web_file_path, original_file_name):
@@ -63,18 +48,9 @@ def add_or_replace_handbook(web_file_path, original_file_name):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        # Delete any existing handbook records and their files first
+        # Replace any existing handbook records; their files are released once this commits
         cursor.execute("SELECT file_path FROM company_handbook")
-        old_files = cursor.fetchall()
-        for old_file_row in old_files:
-            old_file_disk_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), old_file_row[0].lstrip('/'))
-            if os.path.exists(old_file_disk_path):
-                try:
-                    os.remove(old_file_disk_path)
-                except OSError:
-                    # Log this error, but continue. Maybe file is locked or permissions issue.
-                    print(f"Warning: Could not delete old handbook file: {old_file_disk_path}", file=sys.stderr)
-
+        old_files = [old_file_row[0] for old_file_row in cursor.fetchall()]
 
         cursor.execute("DELETE FROM company_handbook") # Clear all old records
 
@@ -85,49 +61,54 @@ def add_or_replace_handbook(web_file_path, original_file_name):
         """, (original_file_name, web_file_path, datetime.now().isoformat()))
         handbook_id = cursor.lastrowid
         conn.commit()
-        return handbook_id
     except Exception as e:
         conn.rollback()
+        release_handbook_file(web_file_path) # No record ended up referencing the stored file
         raise e # Re-raise to be caught by main error handler
     finally:
         conn.close()
 
+    for old_file in old_files:
+        release_handbook_file(old_file)
+    return handbook_id
+
+def release_handbook_file(web_file_path):
+    """Drop a handbook record's reference to its stored file."""
+    try:
+        blob_store.release(web_file_path)
+    except Exception as e:
+        # Log this error, but continue. Maybe file is locked or permissions issue.
+        logger.warning(f"Could not release handbook file {web_file_path}: {e}")
+
 def delete_current_handbook():
     """Deletes the handbook record and its associated file."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT file_path FROM company_handbook ORDER BY id DESC LIMIT 1")
-        row = cursor.fetchone()
-        if row and row[0]:
-            file_to_delete_web_path = row[0]
-            # Convert web path to disk path
-            # Assumes UPLOAD_DIR_HANDBOOK is at website_root/uploads/company_handbook
-            # and web_accessible_path is /uploads/company_handbook/filename.pdf
-            base_website_dir = os.path.dirname(os.path.dirname(__file__)) # .../website/
-            file_to_delete_disk_path = os.path.join(base_website_dir, file_to_delete_web_path.lstrip('/'))
-
-            if os.path.exists(file_to_delete_disk_path):
-                try:
-                    os.remove(file_to_delete_disk_path)
-                except OSError as e:
-                    # Log this error, but proceed to delete DB record
-                    print(f"Warning: Could not delete handbook file {file_to_delete_disk_path}: {e}", file=sys.stderr)
+        cursor.execute("SELECT file_path FROM company_handbook")
+        old_files = [row[0] for row in cursor.fetchall() if row[0]]
 
         cursor.execute("DELETE FROM company_handbook") # Deletes all records, assuming only one matters
+        deleted = cursor.rowcount > 0 # True if any record was deleted
         conn.commit()
-        return cursor.rowcount > 0 # True if any record was deleted
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         conn.close()
 
+    # The file is unlinked only when no other record still references it
+    for old_file in old_files:
+        release_handbook_file(old_file)
+    return deleted
+
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, DELETE, OPTIONS")
     print("Access-Control-Allow-Headers: Content-Type")
+    conditional_get.send_etag(['company_handbook'])
     print()
 
     method = os.environ.get('REQUEST_METHOD', 'GET')
@@ -151,7 +132,12 @@ def main():
 
         elif method == 'POST':
             logger.info("Handling POST request to upload company handbook.")
-            form = cgi.FieldStorage()
+            try:
+                form = parse_form()
+            except FormError as e:
+                logger.warning(f"Rejected request body: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                sys.exit(0)
             file_item = form['handbook_file'] if 'handbook_file' in form else None
 
             if not file_item or not file_item.filename:
@@ -162,7 +148,7 @@ def main():
             try:
                 logger.debug(f"Attempting to save handbook file: {file_item.filename}")
                 web_path, original_name = save_handbook_file(file_item)
-                logger.info(f"Handbook file '{original_name}' saved to {web_path}")
+                logger.info(f"Handbook file '{original_name}' saved to {web_path} ({file_item.size} bytes, sha256 {file_item.sha256})")
                 add_or_replace_handbook(web_path, original_name)
                 logger.info(f"Handbook record updated in DB for '{original_name}'.")
                 print(json.dumps({"success": True, "message": "Handbook uploaded successfully.", "data": {"file_name": original_name, "file_path": web_path, "uploaded_at": datetime.now().isoformat()}}))
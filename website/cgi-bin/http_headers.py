@@ -0,0 +1,27 @@
+# Request-header parsing shared by server.py and the API scripts, so both
+# answer a header the same way. Standard library only: server.py imports it in every mode.
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison as If-None-Match requires: W/ prefixes are ignored and '*' matches anything"""
+    for candidate in (if_none_match or '').split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """True unless the client left gzip out of Accept-Encoding or gave it q=0"""
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', 'x-gzip', '*'):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import cgi
 import json
 import sqlite3
 import os
@@ -8,16 +7,15 @@ from datetime import datetime, date as datetime_date
 from html import escape
 import urllib.parse
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import session_tokens # Signed, expiring employee session tokens
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-
-def get_db_connection():
-    return sqlite3.connect(DB_PATH)
-
 def get_employee_leave_history(employee_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -34,6 +32,20 @@ def get_employee_leave_history(employee_id):
     conn.close()
     return history
 
+def get_leave_request(request_id):
+    conn = get_db_connection()
+    row = conn.execute("""
+        SELECT id, start_date, end_date, reason, status, requested_at
+        FROM leave_requests WHERE id = ?
+    """, (request_id,)).fetchone()
+    conn.close()
+    if row:
+        return {
+            "id": row[0], "start_date": row[1], "end_date": row[2], "reason": row[3],
+            "status": row[4], "requested_at": row[5]
+        }
+    return None
+
 def add_leave_request(employee_id, data):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -67,14 +79,19 @@ def add_leave_request(employee_id, data):
     finally:
         conn.close()
 
+@logged
 def main():
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID")
+    print("Access-Control-Allow-Headers: Content-Type, X-Employee-ID, Authorization")
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    # Checked before the ETag goes out, so an expired or revoked token never gets a 304. Old
+    # clients may send X-Employee-ID / employee_id instead only with MATRICA_REQUIRE_SESSION=off
+    employee_id_str = session_tokens.employee_id_from_request() if method != 'OPTIONS' else None
+    conditional_get.send_etag(['leave_requests'])
     print()
 
-    method = os.environ.get('REQUEST_METHOD', 'GET')
     logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
 
     if method == 'OPTIONS':
@@ -82,7 +99,6 @@ def main():
         print(json.dumps({"status": "ok"}))
         sys.exit(0)
 
-    employee_id_str = os.environ.get('HTTP_X_EMPLOYEE_ID')
     form_params_post_body = None # To store parsed body if employee_id was from header
 
     if not employee_id_str:
@@ -146,14 +162,7 @@ def main():
                 print(json.dumps({"success": False, "error": error}))
             else:
                 logger.info(f"Leave request ID {record_id} submitted for employee {employee_id}.")
-                conn_temp = get_db_connection()
-                new_req_cursor = conn_temp.execute("SELECT id, start_date, end_date, reason, status, requested_at FROM leave_requests WHERE id = ?", (record_id,))
-                new_req_row = new_req_cursor.fetchone()
-                conn_temp.close()
-                new_req_data = {
-                    "id": new_req_row[0], "start_date": new_req_row[1], "end_date": new_req_row[2],
-                    "reason": new_req_row[3], "status": new_req_row[4], "requested_at": new_req_row[5]
-                } if new_req_row else None
+                new_req_data = get_leave_request(record_id)
                 print(json.dumps({"success": True, "message": "Leave request submitted.", "data": new_req_data}))
 
         else:
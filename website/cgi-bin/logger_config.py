@@ -1,5 +1,7 @@
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
@@ -13,44 +15,192 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # This might be tricky in CGI context as __file__ of the main script is what we want.
 # We'll pass the script name to the get_logger function.
 
+LOGGER_NAME = "MatricaAppLogger"
+REQUEST_LOGGER_NAME = "MatricaRequestLog"
+REQUEST_LOG_FILE = os.path.join(LOG_DIR, 'requests.log')
+
+# Logging is configured from the environment so the same code runs verbose in development
+# and quiet in production without edits:
+#   MATRICA_LOG_LEVEL       DEBUG / INFO / WARNING / ERROR (default INFO)
+#   MATRICA_LOG_MODE        'async' writes from a background thread, 'sync' writes on the request path
+#   MATRICA_LOG_ROTATE      'size', 'time' or 'none' (leave rotation to logrotate)
+#   MATRICA_LOG_MAX_BYTES   size rotation threshold; MATRICA_LOG_WHEN the time rotation interval
+#   MATRICA_LOG_BACKUPS     rotated files to keep
+#   MATRICA_LOG_QUEUE_SIZE  records buffered for the writer thread in async mode
+#   MATRICA_LOG_QUEUE_FULL  'drop' (default) or 'block' when that buffer is full
+LOG_LEVEL = logging.getLevelName(os.environ.get('MATRICA_LOG_LEVEL', 'INFO').upper())
+LOG_MODE = os.environ.get('MATRICA_LOG_MODE', 'async')
+LOG_ROTATE = os.environ.get('MATRICA_LOG_ROTATE', 'size')
+LOG_MAX_BYTES = int(os.environ.get('MATRICA_LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_WHEN = os.environ.get('MATRICA_LOG_WHEN', 'midnight')
+LOG_BACKUPS = int(os.environ.get('MATRICA_LOG_BACKUPS', 5))
+LOG_QUEUE_SIZE = int(os.environ.get('MATRICA_LOG_QUEUE_SIZE', 10000))
+LOG_QUEUE_FULL = os.environ.get('MATRICA_LOG_QUEUE_FULL', 'drop')
+# Records written per flush by the writer thread
+LOG_BATCH_SIZE = 256
+
+if not isinstance(LOG_LEVEL, int):
+    LOG_LEVEL = logging.INFO
+
+class ScriptNameFilter(logging.Filter):
+    """Tags each record with the script that logged it (the child logger's name)."""
+
+    def filter(self, record):
+        prefix = LOGGER_NAME + "."
+        record.script_name = record.name[len(prefix):] if record.name.startswith(prefix) else record.name
+        return True
+
+class _BatchFlushMixin:
+    """File handler that leaves flushing to the queue listener, which flushes once per batch."""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+class BatchedRotatingFileHandler(_BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+class BatchedTimedRotatingFileHandler(_BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+class BatchedFileHandler(_BatchFlushMixin, logging.FileHandler):
+    pass
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that drains whatever is waiting and writes it with a single flush."""
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing on a full queue at shutdown
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        q = self.queue
+        has_task_done = hasattr(q, 'task_done')
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+            if has_task_done:
+                for _ in batch:
+                    q.task_done()
+            if stop:
+                break
+
+class PolicyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that owns its listener and applies the queue-full policy.
+
+    With 'drop' a full queue never stalls a request; the number of lost records is
+    logged as soon as there is room again. With 'block' the caller waits for space.
+    """
+
+    def __init__(self, file_handler, maxsize, policy):
+        super().__init__(queue.Queue(maxsize))
+        self.file_handler = file_handler
+        self.policy = policy
+        self.dropped = 0
+        self.listener = None
+        self.start_listener()
+
+    def start_listener(self):
+        self.listener = BatchingQueueListener(self.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def after_fork_in_child(self):
+        # The writer thread doesn't survive fork(), and the queue's locks may have been held
+        # by another thread at that moment; give the child a fresh queue and thread.
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = 0
+        self.start_listener()
+
+    def enqueue(self, record):
+        if self.policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': LOGGER_NAME, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Log queue was full; dropped {self.dropped} record(s)"}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit: write out everything still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+def _build_file_handler(log_file, batched):
+    if LOG_ROTATE == 'size':
+        handler_class = BatchedRotatingFileHandler if batched else logging.handlers.RotatingFileHandler
+        return handler_class(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    if LOG_ROTATE == 'time':
+        handler_class = BatchedTimedRotatingFileHandler if batched else logging.handlers.TimedRotatingFileHandler
+        return handler_class(log_file, when=LOG_WHEN, backupCount=LOG_BACKUPS)
+    return (BatchedFileHandler if batched else logging.FileHandler)(log_file)
+
+def _attach_file_output(logger, log_file, formatter, filters=()):
+    """Point logger at log_file, through the background writer in async mode."""
+    fh = _build_file_handler(log_file, batched=LOG_MODE == 'async')
+    fh.setFormatter(formatter)
+    for log_filter in filters:
+        fh.addFilter(log_filter)
+
+    if LOG_MODE == 'async':
+        # The request thread only puts the record on a queue; a background thread does
+        # the file writes. Rotation happens on that thread too.
+        qh = PolicyQueueHandler(fh, LOG_QUEUE_SIZE, LOG_QUEUE_FULL)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=qh.after_fork_in_child)
+        logger.addHandler(qh)
+    else:
+        logger.addHandler(fh)
+
 def get_logger(script_name_for_log):
-    # Use a fixed logger name to ensure all scripts use the same logger instance and handlers
-    logger = logging.getLogger("MatricaAppLogger")
+    # All scripts share the handlers of one parent logger. Each script gets its own child
+    # logger so that, when several API modules live in the same process (in-process dispatch
+    # in server.py), every line is still tagged with the script that wrote it.
+    logger = logging.getLogger(LOGGER_NAME)
 
     # Prevent adding multiple handlers if get_logger is called multiple times by the same process
-    # (though each CGI script invocation is typically a new process)
     if not logger.handlers:
-        logger.setLevel(logging.DEBUG) # Set to DEBUG to capture all levels; can be configured higher in production
-
-        # File Handler
-        # Use a WatchedFileHandler if available and appropriate for production (handles log rotation by external tools)
-        # For simplicity here, using RotatingFileHandler or just FileHandler.
-        # Let's use FileHandler for now, rotation can be mentioned in README for production.
-        fh = logging.FileHandler(LOG_FILE)
-        fh.setLevel(logging.DEBUG)
-
-        # Console Handler (useful for local dev if CGI output to console is monitored, less so in prod)
-        # For CGI, stderr is often where this would go and get mixed with web server error logs.
-        # We are directing Python's stderr prints in APIs to actual server logs, so this might be redundant
-        # or could be configured differently. For now, let's keep it simple.
-        # ch = logging.StreamHandler(sys.stderr) # Or sys.stdout
-        # ch.setLevel(logging.ERROR)
+        # Records below this level are discarded before any formatting work is done
+        logger.setLevel(LOG_LEVEL)
 
         # Formatter
         # Include the name of the script that generated the log message
         formatter = logging.Formatter(
-            f'%(asctime)s - %(levelname)s - [{script_name_for_log}] - %(message)s',
+            '%(asctime)s - %(levelname)s - [%(script_name)s] - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
-        fh.setFormatter(formatter)
-        # ch.setFormatter(formatter)
+        _attach_file_output(logger, LOG_FILE, formatter, [ScriptNameFilter()])
 
-        logger.addHandler(fh)
-        # logger.addHandler(ch)
+    return logger.getChild(script_name_for_log)
 
-    # To use the specific script name in each log message without changing the logger instance name,
-    # we can return a logger adapter or just rely on the formatter as done above.
-    # The formatter solution is simpler for this context.
+def get_request_logger():
+    """Logger for the structured request log: one JSON object per line in REQUEST_LOG_FILE."""
+    logger = logging.getLogger(REQUEST_LOGGER_NAME)
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _attach_file_output(logger, REQUEST_LOG_FILE, logging.Formatter('%(message)s'))
     return logger
 
 # Example usage (for testing this module directly, not for actual use in other scripts):
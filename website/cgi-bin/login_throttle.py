@@ -0,0 +1,224 @@
+import collections
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+from db_config import DB_PATH
+
+# Token buckets for login attempts, one per username and one per client IP. A bucket holds
+# up to *_BURST attempts and refills at *_PER_MINUTE; a login that finds either bucket empty
+# is refused with 429 before any database lookup or bcrypt work.
+USER_BURST = int(os.environ.get('MATRICA_LOGIN_USER_BURST', 5))
+USER_PER_MINUTE = float(os.environ.get('MATRICA_LOGIN_USER_PER_MINUTE', 5))
+IP_BURST = int(os.environ.get('MATRICA_LOGIN_IP_BURST', 30))
+IP_PER_MINUTE = float(os.environ.get('MATRICA_LOGIN_IP_PER_MINUTE', 30))
+
+# Consecutive failures beyond FREE_FAILURES block the username for 1s, 2s, 4s, ...
+# up to MAX_BACKOFF seconds. A successful login clears the count.
+FREE_FAILURES = int(os.environ.get('MATRICA_LOGIN_FREE_FAILURES', 3))
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = float(os.environ.get('MATRICA_LOGIN_MAX_BACKOFF', 900))
+
+# 'memory' keeps the buckets in this process; 'sqlite' keeps them in THROTTLE_DB so every
+# CGI process and pre-fork worker shares them; 'off' disables throttling. 'auto' is memory
+# when server.py dispatches in-process in a single process (it calls use_memory_store()),
+# and sqlite otherwise.
+STORE = os.environ.get('MATRICA_LOGIN_THROTTLE', 'auto').lower()
+THROTTLE_DB = os.path.join(os.path.dirname(DB_PATH), 'login_throttle.db')
+# Buckets kept in memory before the least recently used are forgotten
+MAX_MEMORY_KEYS = 10000
+# Shared rows untouched for this long are deleted (a full bucket with no failures)
+STALE_AFTER = 24 * 3600
+
+
+class MemoryStore:
+    """Bucket states in a dict, least recently used dropped beyond MAX_MEMORY_KEYS."""
+
+    def __init__(self, max_keys=MAX_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._states = collections.OrderedDict()  # key -> [tokens, updated, failures, blocked_until]
+        self._lock = threading.Lock()
+
+    def update(self, keys, change):
+        """Call change(states) with the states of keys under one lock and store the result."""
+        with self._lock:
+            states = {key: list(self._states[key]) if key in self._states else None for key in keys}
+            result = change(states)
+            for key, state in states.items():
+                self._states[key] = state
+                self._states.move_to_end(key)
+            while len(self._states) > self.max_keys:
+                self._states.popitem(last=False)
+            return result
+
+
+class SqliteStore:
+    """Bucket states in a small SQLite file of their own, updated in IMMEDIATE transactions."""
+
+    def __init__(self, path=THROTTLE_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS login_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    failures INTEGER NOT NULL,
+                    blocked_until REAL NOT NULL
+                )
+            ''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def update(self, keys, change):
+        """Like MemoryStore.update, but returns None without calling change() if the file is unusable."""
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error:
+            # Fail open: a locked or unwritable throttle file must not stop every login
+            return None
+        try:
+            states = {}
+            for key in keys:
+                row = conn.execute("SELECT tokens, updated, failures, blocked_until FROM login_buckets WHERE key = ?", (key,)).fetchone()
+                states[key] = list(row) if row else None
+            result = change(states)
+            conn.executemany("INSERT OR REPLACE INTO login_buckets VALUES (?, ?, ?, ?, ?)",
+                             [(key, *state) for key, state in states.items()])
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM login_buckets WHERE updated < ? AND failures = 0", (time.time() - STALE_AFTER,))
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_store = None
+_store_lock = threading.Lock()
+_use_memory = False
+
+
+def use_memory_store():
+    """Called by server.py when it runs the API scripts in-process, except under pre-fork."""
+    global _use_memory
+    _use_memory = True
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                kind = STORE if STORE != 'auto' else ('memory' if _use_memory else 'sqlite')
+                _store = MemoryStore() if kind == 'memory' else SqliteStore()
+    return _store
+
+
+def _keys(scope, username):
+    """(key, burst, refill per second) of each bucket a login attempt draws from."""
+    keys = [(f"{scope}:ip:{os.environ.get('REMOTE_ADDR', '')}", IP_BURST, IP_PER_MINUTE / 60)]
+    if username:
+        keys.append((f"{scope}:user:{username.lower()}", USER_BURST, USER_PER_MINUTE / 60))
+    return keys
+
+
+def _refill(state, burst, rate, now):
+    if state is None:
+        return [float(burst), now, 0, 0.0]
+    tokens, updated, failures, blocked_until = state
+    return [min(float(burst), tokens + (now - updated) * rate), now, failures, blocked_until]
+
+
+def take(scope, username):
+    """Draw one attempt from the username's and IP's buckets.
+
+    Returns 0 if the login may go ahead, otherwise the seconds to wait (nothing is drawn).
+    """
+    if STORE == 'off':
+        return 0
+    buckets = _keys(scope, username)
+    now = time.time()
+
+    def change(states):
+        wait = 0
+        for key, burst, rate in buckets:
+            state = states[key] = _refill(states[key], burst, rate, now)
+            if state[3] > now:
+                wait = max(wait, state[3] - now)
+            elif state[0] < 1:
+                wait = max(wait, (1 - state[0]) / rate if rate > 0 else MAX_BACKOFF)
+        if not wait:
+            for key, _, _ in buckets:
+                states[key][0] -= 1
+        return wait
+
+    return _get_store().update([key for key, _, _ in buckets], change)
+
+
+def admit(scope, username):
+    """Refuse a throttled login with 429 Too Many Requests.
+
+    Call it while the response headers are being printed, before the blank line. If
+    either bucket is empty or backing off, the response is finished with Retry-After
+    and the script exits.
+    """
+    wait = take(scope, username)
+    if wait:
+        retry_after = math.ceil(wait)
+        print("Status: 429 Too Many Requests")
+        print(f"Retry-After: {retry_after}")
+        print()
+        print(json.dumps({"success": False, "error": f"Too many login attempts. Please try again in {retry_after}s."}))
+        sys.exit(0)
+
+
+def _user_bucket(scope, username):
+    """Only the username's bucket backs off: one office behind a NAT shares an IP."""
+    return [bucket for bucket in _keys(scope, username) if ':user:' in bucket[0]]
+
+
+def record_failure(scope, username):
+    """Count a failed login; past FREE_FAILURES in a row the username backs off exponentially."""
+    buckets = _user_bucket(scope, username)
+    if STORE == 'off' or not buckets:
+        return
+    now = time.time()
+
+    def change(states):
+        for key, burst, rate in buckets:
+            state = states[key] = _refill(states[key], burst, rate, now)
+            state[2] += 1
+            if state[2] > FREE_FAILURES:
+                state[3] = now + min(MAX_BACKOFF, BACKOFF_BASE * 2 ** min(state[2] - FREE_FAILURES - 1, 30))
+
+    _get_store().update([key for key, _, _ in buckets], change)
+
+
+def record_success(scope, username):
+    """Clear the username's failure count and back-off after a successful login."""
+    buckets = _user_bucket(scope, username)
+    if STORE == 'off' or not buckets:
+        return
+    now = time.time()
+
+    def change(states):
+        for key, burst, rate in buckets:
+            state = states[key] = _refill(states[key], burst, rate, now)
+            state[2], state[3] = 0, 0.0
+
+    _get_store().update([key for key, _, _ in buckets], change)
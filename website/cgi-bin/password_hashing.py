@@ -0,0 +1,222 @@
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import bcrypt
+
+# bcrypt cost factor for new hashes. Stored hashes with a different cost are rehashed on
+# the next successful login, so changing it needs no migration.
+BCRYPT_ROUNDS = min(max(int(os.environ.get('MATRICA_BCRYPT_ROUNDS', 12)), 4), 31)
+
+# Under the bundled server's in-process dispatch, bcrypt runs in this many worker processes
+# instead of on the request threads, so a burst of logins can't starve other endpoints.
+# At most HASH_QUEUE_DEPTH more jobs wait for a worker; beyond that logins get a 429.
+# MATRICA_HASH_WORKERS=0 hashes inline, as CGI scripts (one process per request) always do.
+HASH_WORKERS = int(os.environ.get('MATRICA_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_QUEUE_DEPTH = int(os.environ.get('MATRICA_HASH_QUEUE_DEPTH', 16))
+# How long a job that got past admit() may wait for a queue slot
+QUEUE_WAIT = 2.0
+RETRY_AFTER = 1
+
+
+class HashingBusy(Exception):
+    """Every worker is busy and the queue is full."""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _exit_with_server(server_pid):
+    """Pool worker initializer: exit once the server process is gone.
+
+    A server killed by a signal never shuts its pool down, and the workers, children of
+    the fork server rather than of the server itself, would otherwise wait forever.
+    """
+    def watch():
+        while True:
+            time.sleep(1)
+            try:
+                os.kill(server_pid, 0)
+            except ProcessLookupError:
+                os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class HashingPool:
+    """Runs bcrypt calls in a bounded process pool, or inline until enable() is called.
+
+    The executor is created on first use in each process, so pre-fork workers get their own.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue_depth=HASH_QUEUE_DEPTH):
+        self.workers = workers
+        self.limit = workers + queue_depth
+        self.enabled = False
+        self._slots = threading.BoundedSemaphore(max(self.limit, 1))
+        self._pending = 0
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = self.workers > 0
+
+    def saturated(self):
+        return self.enabled and self._pending >= self.limit
+
+    def run(self, function, *args):
+        if not self.enabled:
+            return function(*args)
+        if not self._slots.acquire(timeout=QUEUE_WAIT):
+            raise HashingBusy(f"{self._pending} password hashing jobs pending")
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._get_executor().submit(function, *args).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); start a fresh pool next time
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def map(self, function, arg_tuples):
+        """function(*args) for every tuple, spread over the workers; results in order.
+
+        For batches: unlike run() it uses the worker processes even before enable() (under
+        CGI the pool is started for the batch), and it waits for slots instead of raising
+        HashingBusy. At most one job per worker is outstanding at a time, so the rest of the
+        queue stays free for logins, which wait behind one batch job at most.
+        """
+        if self.workers <= 1 or len(arg_tuples) <= 1:
+            return [function(*args) for args in arg_tuples]
+        executor = self._get_executor()
+        results = [None] * len(arg_tuples)
+        outstanding = collections.deque()
+
+        def collect():
+            index, future = outstanding.popleft()
+            try:
+                results[index] = future.result()
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+
+        try:
+            for index, args in enumerate(arg_tuples):
+                if len(outstanding) >= self.workers:
+                    collect()
+                self._slots.acquire()
+                with self._lock:
+                    self._pending += 1
+                try:
+                    outstanding.append((index, executor.submit(function, *args)))
+                except BaseException:
+                    with self._lock:
+                        self._pending -= 1
+                    self._slots.release()
+                    raise
+            while outstanding:
+                collect()
+        except concurrent.futures.process.BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            # After a failure, give back the slots of jobs nobody will collect
+            while outstanding:
+                outstanding.popleft()[1].cancel()
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+        return results
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # forkserver: workers are not forked from this multi-threaded server process
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method),
+                    initializer=_exit_with_server, initargs=(os.getpid(),))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+
+_pool = HashingPool()
+
+
+def use_pool():
+    """Called by server.py when it runs the API scripts in-process."""
+    _pool.enable()
+
+
+def admit():
+    """Turn the request away with 429 Too Many Requests while the hashing pool is saturated.
+
+    Call it while the response headers are being printed, before the blank line. If the
+    pool is full, the response is finished with a Retry-After header and the script exits.
+    """
+    if _pool.saturated():
+        send_busy()
+
+
+def send_busy():
+    """Finish the response with 429 Too Many Requests and Retry-After, and exit.
+
+    Also the answer to a HashingBusy raised after admit() let the request through (the pool
+    filled up in between), so scripts hash before printing the blank line that ends the
+    response headers.
+    """
+    print("Status: 429 Too Many Requests")
+    print(f"Retry-After: {RETRY_AFTER}")
+    print()
+    print(json.dumps({"success": False, "error": "The server is busy. Please try again in a moment."}))
+    sys.exit(0)
+
+
+def hash_password(plain_password):
+    """Hash a plain password with bcrypt at BCRYPT_ROUNDS; returns the hex string stored in the DB."""
+    return _pool.run(_hashpw, plain_password.encode('utf-8'), BCRYPT_ROUNDS).hex()
+
+
+def hash_passwords(plain_passwords):
+    """hash_password() for a batch (bulk imports), hashed in parallel across HASH_WORKERS processes."""
+    jobs = [(password.encode('utf-8'), BCRYPT_ROUNDS) for password in plain_passwords]
+    return [hashed.hex() for hashed in _pool.map(_hashpw, jobs)]
+
+
+def verify_password(plain_password, hashed_password_hex):
+    """Verify a plain password against a stored hex-encoded hashed password."""
+    try:
+        hashed_password = bytes.fromhex(hashed_password_hex)
+    except (ValueError, TypeError):
+        return False
+    try:
+        return _pool.run(_checkpw, plain_password.encode('utf-8'), hashed_password)
+    except ValueError: # Not a bcrypt hash
+        return False
+
+
+def needs_rehash(hashed_password_hex):
+    """True if a stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    try:
+        # Hex of b'$2b$12$...': the cost is the two digits after the second '$'
+        prefix = bytes.fromhex(hashed_password_hex[:14]).decode('ascii')
+        return int(prefix.split('$')[2]) != BCRYPT_ROUNDS
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return False
@@ -12,16 +12,15 @@ import sqlite3
 import re
 from html import escape
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+import response_cache # Cached public GET responses, invalidated on writes
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-def get_db_connection():
-    """Get database connection"""
-    db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-    return sqlite3.connect(db_path)
-
 def get_all_products():
     """Get all products"""
     conn = get_db_connection()
@@ -54,6 +53,7 @@ def add_product(data):
     product_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    response_cache.invalidate('products')
     
     return product_id
 
@@ -83,6 +83,7 @@ def update_product(product_id, data):
     affected = cursor.rowcount
     conn.commit()
     conn.close()
+    response_cache.invalidate('products')
     return affected > 0
 
 def delete_product(product_id):
@@ -95,6 +96,7 @@ def delete_product(product_id):
     
     conn.commit()
     conn.close()
+    response_cache.invalidate('products')
     
     return affected > 0
 
@@ -163,12 +165,19 @@ def parse_form_data():
         return parsed_data
     return {}
 
+@logged
 def main():
     """Main handler function"""
     print("Content-Type: application/json")
     print("Access-Control-Allow-Origin: *")
     print("Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS") # Added PUT
     print("Access-Control-Allow-Headers: Content-Type")
+    # A GET is looked up in the response cache first: a hit carries its ETag, so neither the
+    # headers nor a 304 need the database
+    cached = None
+    if os.environ.get('REQUEST_METHOD', 'GET') == 'GET':
+        cached = response_cache.lookup('products', f"{script_name}?{os.environ.get('QUERY_STRING', '')}")
+    conditional_get.send_cached_etag(cached)
     print()
 
     try:
@@ -182,8 +191,7 @@ def main():
 
         if method == 'GET':
             logger.info("Handling GET request for all products.")
-            products = get_all_products()
-            print(json.dumps({"success": True, "data": products}))
+            print(cached.get_or_build(lambda: json.dumps({"success": True, "data": get_all_products()})))
             
         elif method == 'POST' or method == 'PUT':
             logger.info(f"Handling {method} request for product.")
@@ -0,0 +1,128 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from db_config import start_query_stats, stop_query_stats
+from logger_config import get_request_logger
+
+# Structured request log: with MATRICA_REQUEST_LOG=json every API request adds one line
+# to logs/requests.log, e.g.
+#   {"ts": "...", "request_id": "3f2a...", "endpoint": "contacts_api.py", "method": "GET",
+#    "status": 200, "duration_ms": 4.1, "db_ms": 2.7, "db_queries": 2, "rows": 51, "bytes": 18234}
+ENABLED = os.environ.get('MATRICA_REQUEST_LOG', 'off').lower() in ('json', 'on', '1', 'true')
+
+_local = threading.local()
+
+
+def new_request_id(incoming=None):
+    """Reuse a well-formed X-Request-ID from the client or proxy, otherwise make one up."""
+    if incoming and len(incoming) <= 64 and incoming.replace('-', '').isalnum():
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+def active():
+    """True while a request on this thread is already being tracked (e.g. by server.py)."""
+    return getattr(_local, 'entry', None) is not None
+
+
+@contextlib.contextmanager
+def track(endpoint, method, request_id=None):
+    """Time the enclosed request and write its log line on exit.
+
+    Yields the entry dict (None when the request log is off); the caller fills in
+    'status' and 'bytes' once it knows them. SQLite time and rows come from db_config.
+    """
+    if not ENABLED or active():
+        yield None
+        return
+
+    entry = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'request_id': request_id or new_request_id(),
+        'endpoint': endpoint,
+        'method': method,
+        'status': 500, # Until the caller says otherwise
+        'bytes': 0,
+    }
+    _local.entry = entry
+    stats = start_query_stats()
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        duration = time.perf_counter() - start
+        stop_query_stats()
+        _local.entry = None
+        entry['duration_ms'] = round(duration * 1000, 2)
+        entry['db_ms'] = round(stats.seconds * 1000, 2)
+        entry['db_queries'] = stats.queries
+        entry['rows'] = stats.rows
+        get_request_logger().info(json.dumps(entry))
+
+
+class _CountingStdout:
+    """Passes CGI output through while noting the Status header and the body size."""
+
+    def __init__(self, target):
+        self.target = target
+        self.status = 200
+        self.body_bytes = 0
+        self._head = ''
+        self._in_body = False
+
+    def write(self, text):
+        if self._in_body:
+            self.body_bytes += len(text.encode('utf-8'))
+        else:
+            self._head += text
+            if '\n\n' in self._head:
+                head, body = self._head.split('\n\n', 1)
+                for line in head.splitlines():
+                    name, _, value = line.partition(':')
+                    if name.strip().lower() == 'status':
+                        self.status = int(value.split()[0])
+                self.body_bytes = len(body.encode('utf-8'))
+                self._in_body = True
+                self._head = ''
+        return self.target.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+def logged(main):
+    """Decorator for an API script's main() that writes its request log line under CGI.
+
+    Under in-process dispatch server.py already tracks the request around main(),
+    so the decorator just calls through.
+    """
+    @functools.wraps(main)
+    def wrapper():
+        if not ENABLED or active():
+            return main()
+
+        script = os.path.basename(sys.modules[main.__module__].__file__)
+        method = os.environ.get('REQUEST_METHOD', 'GET')
+        request_id = new_request_id(os.environ.get('HTTP_X_REQUEST_ID'))
+        stdout = sys.stdout = _CountingStdout(sys.stdout)
+        with track(script, method, request_id) as entry:
+            try:
+                result = main()
+            except SystemExit:
+                # Scripts finish early with sys.exit(0) after printing their response
+                entry['status'] = stdout.status
+                raise
+            else:
+                entry['status'] = stdout.status
+                return result
+            finally:
+                sys.stdout = stdout.target
+                entry['bytes'] = stdout.body_bytes
+    return wrapper
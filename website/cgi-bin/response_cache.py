@@ -0,0 +1,119 @@
+import collections
+import os
+import threading
+import time
+
+from db_config import DB_PATH
+
+# Serialized GET responses of the public catalogue endpoints (products, careers, resources,
+# team). Entries live for CACHE_TTL seconds at most and the least recently used are dropped
+# beyond CACHE_MAX_ENTRIES; MATRICA_CACHE_TTL=0 turns the cache off.
+CACHE_TTL = float(os.environ.get('MATRICA_CACHE_TTL', 300))
+CACHE_MAX_ENTRIES = int(os.environ.get('MATRICA_CACHE_MAX_ENTRIES', 256))
+
+# Writers bump a per-table generation file here. Pre-fork workers each hold their own
+# cache, so a write in one process is seen by the others through the file's inode/mtime,
+# which costs a stat() per cached read rather than a database query.
+GENERATION_DIR = DB_PATH + '-cache'
+
+
+class CachedResponse:
+    """One GET through the cache: the fresh body and ETag found for key, if any.
+
+    The table's generation is read before anything else, so a body built on a miss (and the
+    ETag computed for it) is stored as of that generation: a write landing meanwhile leaves
+    the new entry already stale.
+    """
+
+    def __init__(self, cache, table, key, generation, body=None, etag=None):
+        self.cache = cache
+        self.table = table
+        self.key = key
+        self.generation = generation
+        self.body = body
+        self.etag = etag
+
+    def get_or_build(self, build):
+        """Return the cached body, or call build() and cache what it returns with the ETag.
+
+        Exceptions from build() propagate and nothing is cached.
+        """
+        if self.body is None:
+            self.body = build()
+            self.cache.store(self)
+        return self.body
+
+
+class ResponseCache:
+    """Thread-safe LRU of response bodies (and their ETags) keyed by (table, key), with a TTL and per-table invalidation."""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, generation_dir=GENERATION_DIR):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation_dir = generation_dir
+        self._entries = collections.OrderedDict()  # (table, key) -> (generation, expires, body, etag)
+        self._lock = threading.Lock()
+
+    def lookup(self, table, key):
+        """Return a CachedResponse for key, holding the body and ETag if a fresh entry exists.
+
+        A hit costs a stat() of the generation file and no database query.
+        """
+        if self.ttl <= 0:
+            return CachedResponse(self, table, key, None)
+
+        # Read the generation before anything is built, so a write that lands meanwhile
+        # leaves the new entry already stale instead of hiding the write for a whole TTL.
+        generation = self._generation(table)
+        with self._lock:
+            entry = self._entries.get((table, key))
+            if entry is not None and entry[0] == generation and entry[1] > time.monotonic():
+                self._entries.move_to_end((table, key))
+                return CachedResponse(self, table, key, generation, entry[2], entry[3])
+        return CachedResponse(self, table, key, generation)
+
+    def store(self, response):
+        if self.ttl <= 0:
+            return
+        cache_key = (response.table, response.key)
+        with self._lock:
+            self._entries[cache_key] = (response.generation, time.monotonic() + self.ttl, response.body, response.etag)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table):
+        """Forget every cached response built from table, in this process and in any other."""
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == table]:
+                del self._entries[cache_key]
+        if self.ttl <= 0:
+            return
+
+        os.makedirs(self.generation_dir, exist_ok=True)
+        path = os.path.join(self.generation_dir, table)
+        # A fresh file moved into place always gets a new inode, even within one mtime tick
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, 'w'):
+            pass
+        os.replace(temp_path, path)
+
+    def _generation(self, table):
+        try:
+            stat = os.stat(os.path.join(self.generation_dir, table))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+
+_cache = ResponseCache()
+
+
+def lookup(table, key):
+    """CachedResponse for key (endpoint and query) built from table; pass it to conditional_get.send_cached_etag()."""
+    return _cache.lookup(table, key)
+
+
+def invalidate(table):
+    """Call after committing a change to table."""
+    _cache.invalidate(table)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Admin search API
+Full-text search over contact messages, resources and careers (SQLite FTS5)
+"""
+
+import json
+import os
+import re
+import sys
+import urllib.parse
+from logger_config import get_logger # Import the logger
+from db_config import read_transaction # Shared per-thread SQLite connection
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
+import conditional_get # ETag / 304 for GET responses
+
+# Initialize logger
+script_name = os.path.basename(__file__)
+logger = get_logger(script_name)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Tokens of context either side of the match in each snippet
+SNIPPET_TOKENS = 12
+
+# Scope name -> how to search it. 'fts' is the FTS5 table created by init_db.py,
+# 'columns' are read back from the base table and 'snippet_column' is the index
+# (within the FTS table's columns) of the long text the snippet is cut from.
+SCOPES = {
+    'contacts': {
+        'table': 'contacts',
+        'fts': 'contacts_fts',
+        'columns': ['id', 'name', 'email', 'company', 'subject', 'timestamp'],
+        'snippet_column': 4, # message
+    },
+    'resources': {
+        'table': 'resources',
+        'fts': 'resources_fts',
+        'columns': ['id', 'title', 'type'],
+        'snippet_column': 2, # content
+    },
+    'careers': {
+        'table': 'careers',
+        'fts': 'careers_fts',
+        'columns': ['id', 'title', 'location', 'experience_required'],
+        'snippet_column': 1, # description
+    },
+}
+
+def build_match_query(text):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word must match (implicit AND). Words are quoted so FTS5 operators and
+    punctuation typed by the user can't produce a syntax error; a trailing '*'
+    is kept as a prefix search, e.g. 'eng*' matches 'engineer'.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = re.sub(r'[^\w@.\-]', '', word)
+        if not word:
+            continue
+        terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def search_scope(cursor, scope, match_query, limit, offset):
+    """Ranked hits for one scope, plus whether there are more after this page"""
+    config = SCOPES[scope]
+    columns = ', '.join(f"t.{column}" for column in config['columns'])
+    fts = config['fts']
+    # Fetch one extra row to learn whether there is another page
+    cursor.execute(f'''
+        SELECT {columns}, snippet({fts}, {config['snippet_column']}, '<mark>', '</mark>', '…', {SNIPPET_TOKENS})
+        FROM {fts}
+        JOIN {config['table']} t ON t.id = {fts}.rowid
+        WHERE {fts} MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', (match_query, limit + 1, offset))
+    rows = cursor.fetchall()
+
+    hits = []
+    for row in rows[:limit]:
+        hit = dict(zip(config['columns'], row))
+        hit['snippet'] = row[-1]
+        hits.append(hit)
+
+    return {'hits': hits, 'has_more': len(rows) > limit}
+
+def search(text, scopes, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """Search the given scopes from one read snapshot"""
+    match_query = build_match_query(text)
+    if not match_query:
+        return {scope: {'hits': [], 'has_more': False} for scope in scopes}
+
+    results = {}
+    with read_transaction() as conn:
+        cursor = conn.cursor()
+        for scope in scopes:
+            results[scope] = search_scope(cursor, scope, match_query, limit, offset)
+    return results
+
+def parse_search_params(query_string):
+    """Parse q, scope, limit and offset from the GET query string; raises ValueError on bad input"""
+    query_params = urllib.parse.parse_qs(query_string)
+    get_param = lambda name: query_params.get(name, [''])[0].strip()
+
+    text = get_param('q')
+    if not text:
+        raise ValueError("Search text 'q' is required.")
+
+    requested = get_param('scope')
+    scopes = [name.strip() for name in requested.split(',') if name.strip()] if requested else list(SCOPES)
+    unknown = [name for name in scopes if name not in SCOPES]
+    if unknown:
+        raise ValueError(f"Unknown scopes: {', '.join(unknown)}. Valid scopes: {', '.join(SCOPES)}")
+
+    try:
+        limit = int(get_param('limit') or DEFAULT_PAGE_SIZE)
+        offset = int(get_param('offset') or 0)
+    except ValueError:
+        raise ValueError("'limit' and 'offset' must be integers.")
+    if limit < 1 or offset < 0:
+        raise ValueError("'limit' must be at least 1 and 'offset' must not be negative.")
+
+    return text, scopes, min(limit, MAX_PAGE_SIZE), offset
+
+@logged
+def main():
+    print("Content-Type: application/json")
+    print("Access-Control-Allow-Origin: *")
+    print("Access-Control-Allow-Methods: GET, OPTIONS")
+    print("Access-Control-Allow-Headers: Content-Type")
+    conditional_get.send_etag(['contacts', 'resources', 'careers'])
+    print()
+
+    method = os.environ.get('REQUEST_METHOD', 'GET')
+    logger.info(f"Request received: Method={method}, Path={os.environ.get('PATH_INFO', '')}, Query={os.environ.get('QUERY_STRING', '')}")
+
+    if method == 'OPTIONS':
+        logger.info("Handling OPTIONS request.")
+        print(json.dumps({"status": "ok"}))
+        sys.exit(0)
+
+    try:
+        if method == 'GET':
+            try:
+                text, scopes, limit, offset = parse_search_params(os.environ.get('QUERY_STRING', ''))
+            except ValueError as e:
+                logger.warning(f"Invalid search parameters: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                sys.exit(0)
+
+            logger.info(f"Searching {scopes} for '{text}' (limit={limit}, offset={offset})")
+            results = search(text, scopes, limit, offset)
+            print(json.dumps({"success": True, "data": results, "limit": limit, "offset": offset}))
+
+        else:
+            logger.warning(f"Method {method} not allowed for this endpoint.")
+            print(json.dumps({"success": False, "error": f"Method {method} not allowed."}))
+
+    except Exception as e:
+        logger.error(f"Unhandled error in {script_name}: {e}", exc_info=True)
+        print(json.dumps({"success": False, "error": "An internal server error occurred."}))
+
+if __name__ == "__main__":
+    logger.info(f"{script_name} script started (likely direct execution or misconfiguration).")
+    main()
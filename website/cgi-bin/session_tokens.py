@@ -0,0 +1,223 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+
+from db_config import DB_PATH
+from logger_config import get_logger
+
+logger = get_logger(os.path.basename(__file__))
+
+# Employee sessions are stateless tokens, "<payload>.<signature>" (both base64url), where the
+# payload is JSON {"sub": employee id, "role", "iat", "exp", "jti"} and the signature is
+# HMAC-SHA256 over the payload. Checking one needs no database access.
+SESSION_TTL = int(os.environ.get('MATRICA_SESSION_TTL', 8 * 3600))
+# On by default: the employee APIs only accept a session token. 'off' lets older clients still
+# name themselves with a bare X-Employee-ID / employee_id, which anyone can forge (deprecated)
+REQUIRE_SESSION = os.environ.get('MATRICA_REQUIRE_SESSION', 'on').lower() not in ('off', '0', 'false')
+
+# The signing key comes from MATRICA_SESSION_SECRET or, failing that, is generated once and
+# kept next to the database so every process (CGI, pre-fork workers) and restart shares it.
+SECRET_FILE = os.path.join(os.path.dirname(DB_PATH), 'session_secret')
+# Token ids revoked by logout, with their expiry, one "jti exp" per line
+DENYLIST_FILE = os.path.join(os.path.dirname(DB_PATH), 'revoked_sessions')
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+class InvalidSession(Exception):
+    """The request's session token is malformed, forged, expired or revoked."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signing_key():
+    global _secret
+    if _secret is None:
+        with _secret_lock:
+            if _secret is None:
+                _secret = _load_or_create_secret()
+    return _secret
+
+
+def _load_or_create_secret():
+    configured = os.environ.get('MATRICA_SESSION_SECRET')
+    if configured:
+        return configured.encode('utf-8')
+    try:
+        with open(SECRET_FILE, 'rb') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    # Write to a private temp file and link it into place: if another process won the
+    # race, the link fails and its key is used instead
+    temp_path = f"{SECRET_FILE}.{os.getpid()}.{threading.get_ident()}"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temp_path, SECRET_FILE)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(temp_path)
+    with open(SECRET_FILE, 'rb') as f:
+        return f.read().strip()
+
+
+def _sign(payload):
+    return hmac.new(_signing_key(), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+class _Denylist:
+    """Revoked token ids, kept in memory until their tokens expire.
+
+    Revocations are appended to DENYLIST_FILE, and a process re-reads the file only when
+    its size or mtime changed, so a logout handled by one worker is honoured by all.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._revoked = {}  # jti -> exp
+        self._file_state = None
+        self._lock = threading.Lock()
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._refresh()
+            self._revoked[jti] = exp
+            with open(self.path, 'a') as f:
+                f.write(f"{jti} {exp}\n")
+            self._compact()
+
+    def __contains__(self, jti):
+        with self._lock:
+            self._refresh()
+            exp = self._revoked.get(jti)
+            return exp is not None and exp > time.time()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        state = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if state == self._file_state:
+            return
+        now = time.time()
+        revoked = {}
+        with open(self.path) as f:
+            for line in f:
+                jti, _, exp = line.strip().partition(' ')
+                if jti and exp.isdigit() and int(exp) > now:
+                    revoked[jti] = int(exp)
+        self._revoked = revoked
+        self._file_state = state
+
+    def _compact(self):
+        """Rewrite the file without expired entries once they make up most of it."""
+        now = time.time()
+        live = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        if self._file_state is not None and self._file_state[1] < 64 * 1024 and len(live) * 2 >= len(self._revoked):
+            return
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, 'w') as f:
+            f.writelines(f"{jti} {exp}\n" for jti, exp in live.items())
+        os.replace(temp_path, self.path)
+        self._revoked = live
+        self._file_state = None
+
+
+_denylist = _Denylist(DENYLIST_FILE)
+
+
+def issue(employee_id, role='employee', ttl=SESSION_TTL):
+    """Create a signed session token; returns (token, claims)."""
+    now = int(time.time())
+    claims = {'sub': employee_id, 'role': role, 'iat': now, 'exp': now + ttl, 'jti': secrets.token_urlsafe(12)}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f"{payload}.{_b64encode(_sign(payload))}", claims
+
+
+def verify(token):
+    """Return the claims of a valid token; raises InvalidSession otherwise."""
+    payload, dot, signature = token.partition('.')
+    if not dot:
+        raise InvalidSession("malformed token")
+    try:
+        expected = _sign(payload)
+        provided = _b64decode(signature)
+    except (ValueError, binascii.Error):
+        raise InvalidSession("malformed token")
+    if not hmac.compare_digest(provided, expected):
+        raise InvalidSession("bad signature")
+
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, binascii.Error):
+        raise InvalidSession("malformed payload")
+    if not isinstance(claims, dict) or not isinstance(claims.get('exp'), int):
+        raise InvalidSession("malformed payload")
+    if claims['exp'] <= time.time():
+        raise InvalidSession("token expired")
+    if claims.get('jti') in _denylist:
+        raise InvalidSession("token revoked")
+    return claims
+
+
+def revoke(claims):
+    """Deny a token until it would have expired anyway (logout)."""
+    _denylist.add(claims['jti'], claims['exp'])
+
+
+def current_session():
+    """Claims of the request's 'Authorization: Bearer' token, or None if it sent none.
+
+    Raises InvalidSession for a bad token, and for a missing one when REQUIRE_SESSION is on.
+    """
+    scheme, _, token = os.environ.get('HTTP_AUTHORIZATION', '').partition(' ')
+    token = token.strip()
+    if scheme.lower() != 'bearer' or not token:
+        if REQUIRE_SESSION:
+            raise InvalidSession("no session token")
+        return None
+    return verify(token)
+
+
+def employee_id_from_request():
+    """The requesting employee's id as a string, or None if the request doesn't say.
+
+    A signed session token identifies the employee without a database lookup. Without one,
+    and only with REQUIRE_SESSION off, the X-Employee-ID header is used.
+
+    Call it while the response headers are being printed, before the ETag and the blank
+    line: a bad token finishes the response with a "Session expired or invalid" error
+    and the script exits.
+    """
+    try:
+        session = current_session()
+    except InvalidSession as e:
+        logger.warning(f"Rejected session token: {e}")
+        print()
+        print(json.dumps({"success": False, "error": "Session expired or invalid. Please log in again."}))
+        sys.exit(0)
+    if session:
+        return str(session['sub'])
+    logger.warning("Deprecated: request without a session token, identified by X-Employee-ID / employee_id "
+                   "(MATRICA_REQUIRE_SESSION=off)")
+    return os.environ.get('HTTP_X_EMPLOYEE_ID')
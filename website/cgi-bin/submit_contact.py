@@ -4,27 +4,25 @@ Resources management API
 Handles CRUD operations for resources (blogs, case studies, technical docs)
 """
 
-import cgi
 import json
 import sqlite3
 import os
 import sys
 from html import escape
-import uuid
 import mimetypes
 import urllib.parse
 from datetime import datetime
 from logger_config import get_logger # Import the logger
+from db_config import get_db_connection # Shared per-thread SQLite connection
+from form_parser import parse_form, FormError # Streaming form/upload parser
+import blob_store # Content-addressed, reference-counted upload storage
+import response_cache # Cached public GET responses, invalidated on writes
+from request_log import logged # Structured per-request log line (MATRICA_REQUEST_LOG)
 
 # Initialize logger
 script_name = os.path.basename(__file__)
 logger = get_logger(script_name)
 
-def get_db_connection():
-    """Get database connection"""
-    db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'matrica.db')
-    return sqlite3.connect(db_path)
-
 def get_all_resources():
     """Get all resources"""
     conn = get_db_connection()
@@ -50,26 +48,12 @@ def save_uploaded_file(file_field):
     if not file_field or not file_field.filename:
         return None
     
-    # Create uploads directory if it doesn't exist
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    website_dir = os.path.dirname(script_dir)
-    upload_dir = os.path.join(website_dir, 'uploads', 'resources')
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Generate unique filename
     file_ext = os.path.splitext(file_field.filename)[1].lower()
     if file_ext not in ['.pdf', '.doc', '.docx', '.txt']:
         raise ValueError("Only PDF, DOC, DOCX, and TXT files are allowed")
     
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(upload_dir, unique_filename)
-    
-    # Save file
-    with open(file_path, 'wb') as f:
-        f.write(file_field.file.read())
-    
     # Return relative path for web access
-    return f"/uploads/resources/{unique_filename}"
+    return blob_store.store(file_field, file_ext)
 
 def add_resource(data, file_field=None):
     """Add new resource"""
@@ -80,14 +64,21 @@ def add_resource(data, file_field=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        INSERT INTO resources (title, type, content, file_path) 
-        VALUES (?, ?, ?, ?)
-    ''', (data['title'], data['type'], data['content'], file_path))
-    
-    resource_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    try:
+        cursor.execute('''
+            INSERT INTO resources (title, type, content, file_path) 
+            VALUES (?, ?, ?, ?)
+        ''', (data['title'], data['type'], data['content'], file_path))
+        resource_id = cursor.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if file_path:
+            blob_store.release(file_path)  # No resource ended up referencing it
+        raise
+    finally:
+        conn.close()
+    response_cache.invalidate('resources')
     
     return resource_id
 
@@ -105,31 +96,37 @@ def update_resource(resource_id, data, file_field=None):
     
     old_file_path = result[0]
     new_file_path = old_file_path  # Keep existing file by default
+    stored_file_path = None
     
     # Handle new file upload
     if file_field:
         try:
-            new_file_path = save_uploaded_file(file_field)
-            # Delete old file if it exists and is a local file
-            if old_file_path and old_file_path.startswith('/uploads/'):
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                website_dir = os.path.dirname(script_dir)
-                old_file_full_path = os.path.join(website_dir, old_file_path.lstrip('/'))
-                if os.path.exists(old_file_full_path):
-                    os.remove(old_file_full_path)
+            stored_file_path = save_uploaded_file(file_field)
+            new_file_path = stored_file_path or old_file_path
         except Exception as e:
             conn.close()
             raise e
     
-    cursor.execute('''
-        UPDATE resources 
-        SET title = ?, type = ?, content = ?, file_path = ?
-        WHERE id = ?
-    ''', (data['title'], data['type'], data['content'], new_file_path, resource_id))
+    try:
+        cursor.execute('''
+            UPDATE resources 
+            SET title = ?, type = ?, content = ?, file_path = ?
+            WHERE id = ?
+        ''', (data['title'], data['type'], data['content'], new_file_path, resource_id))
+        affected = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if stored_file_path:
+            blob_store.release(stored_file_path)  # The resource still points at its old file
+        raise
+    finally:
+        conn.close()
+    response_cache.invalidate('resources')
     
-    affected = cursor.rowcount
-    conn.commit()
-    conn.close()
+    # Release the old file if it was replaced and is a local file
+    if stored_file_path:
+        blob_store.release(old_file_path)
     
     return affected > 0
 
@@ -147,14 +144,11 @@ def delete_resource(resource_id):
     
     conn.commit()
     conn.close()
+    response_cache.invalidate('resources')
     
-    # Delete file if it exists and is a local file
-    if result and result[0] and result[0].startswith('/uploads/'):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        website_dir = os.path.dirname(script_dir)
-        file_path = os.path.join(website_dir, result[0].lstrip('/'))
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # Release the file if it is a local file
+    if affected and result and result[0]:
+        blob_store.release(result[0])
     
     return affected > 0
 
@@ -168,6 +162,7 @@ def parse_form_data():
         return urllib.parse.parse_qs(post_data)
     return {}
 
+@logged
 def main():
     """Main handler function"""
     print("Content-Type: application/json")
@@ -196,7 +191,12 @@ def main():
             
         elif method == 'POST':
             logger.info("Handling POST request (intended for resources, though resources_api.py is preferred).")
-            form = cgi.FieldStorage()
+            try:
+                form = parse_form()
+            except FormError as e:
+                logger.warning(f"Rejected request body: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                return
             data = {
                 'title': escape(form.getvalue('title', '').strip()),
                 'type': escape(form.getvalue('type', '').strip()),
@@ -239,7 +239,12 @@ def main():
                 print(json.dumps({"success": False, "error": "Invalid Resource ID format."}))
                 return
 
-            form = cgi.FieldStorage()
+            try:
+                form = parse_form()
+            except FormError as e:
+                logger.warning(f"Rejected request body: {e}")
+                print(json.dumps({"success": False, "error": str(e)}))
+                return
             data = {
                 'title': escape(form.getvalue('title', '').strip()),
                 'type': escape(form.getvalue('type', '').strip()),
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the API scripts
+Builds a scratch database with init_db.py (and the migrations), runs EXPLAIN QUERY PLAN
+on every SQL statement in cgi-bin/ and fails if a query scans a large table it only needs
+part of, or sorts one with a temporary B-tree.
+
+A scan counts as a regression when the statement has a WHERE or a LIMIT. A walk in index
+order (SCAN ... USING INDEX) is accepted with a LIMIT, which stops it early. A statement
+with neither reads the whole table on purpose (full listings, exports) and isn't flagged.
+
+    python3 database/check_query_plans.py            # exit status 1 on any regression
+    python3 database/check_query_plans.py --verbose  # print every plan
+"""
+
+import argparse
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import date as datetime_date
+
+import init_db
+
+CGI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cgi-bin')
+
+# Admin-edited catalogues that stay at a few dozen rows; scanning or sorting them is fine
+SMALL_TABLES = {'products', 'careers', 'team', 'resources', 'company_handbook', 'table_versions'}
+
+
+
+def dynamic_statements():
+    """Statements built at runtime, rendered by the scripts' own query builders.
+
+    Each builder is called with representative arguments, one call per distinct plan.
+    """
+    sys.path.insert(0, CGI_DIR)
+    import attendance_report_api
+    import contacts_api
+
+    after = contacts_api.encode_cursor('2024-01-31 00:00:00', 1)
+    dates = {'date_from': '2024-01-01', 'date_to': '2024-01-31'}
+    start, end = datetime_date(2024, 1, 1), datetime_date(2024, 1, 31)
+    rendered = [
+        ('contacts_api.py', contacts_api.build_contacts_page_query()),
+        ('contacts_api.py', contacts_api.build_contacts_page_query(after=after)),
+        ('contacts_api.py', contacts_api.build_contacts_page_query(filters=dates)),
+        ('contacts_api.py', contacts_api.build_contacts_page_query(after=after, filters={'subject': 'Sales'})),
+        ('attendance_report_api.py', attendance_report_api.build_report_query(start, end)),
+        ('attendance_report_api.py', attendance_report_api.build_report_query(start, end, 1, 'month')),
+    ]
+    return [(script, sql) for script, (sql, _) in rendered]
+
+
+SORT_RE = re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY|LAST TERM OF ORDER BY)')
+SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?( USING .*)?$')  # Every row of a table, or of one of its indexes
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)', re.IGNORECASE)
+
+
+def find_statements(path):
+    """(line, sql) of every string literal passed to execute()/executemany() in a script.
+
+    f-strings and variables are reported as (line, None): their text isn't known statically.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ('execute', 'executemany') and node.args):
+            arg = node.args[0]
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                yield node.lineno, arg.value
+            else:
+                yield node.lineno, None
+
+
+def check_statement(conn, sql):
+    """Return (plan details, problems) for one statement; problems is None if it doesn't apply to matrica.db."""
+    sql = sql.strip()
+    if not re.match(r'(SELECT|INSERT|UPDATE|DELETE|WITH)\b', sql, re.IGNORECASE):
+        return [], []  # PRAGMA, BEGIN, DDL...
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count('?')).fetchall()
+    except sqlite3.OperationalError:
+        return [], None  # e.g. login_throttle.py's own database
+
+    details = [row[3] for row in rows]
+    tables = {name.lower() for name in TABLE_RE.findall(sql)}
+    large = tables - SMALL_TABLES
+    filtered = re.search(r'\bWHERE\b', sql, re.IGNORECASE) is not None
+    limited = re.search(r'\bLIMIT\b', sql, re.IGNORECASE) is not None
+    # ORDER BY on a GROUP BY sorts the groups (one row per employee, month...), not the table
+    grouped = re.search(r'\bGROUP BY\b', sql, re.IGNORECASE) is not None
+    problems = []
+    for detail in details:
+        match = SCAN_RE.match(detail)
+        if match and match.group(1).lower() not in SMALL_TABLES:
+            index_order = match.group(2) is not None
+            if (filtered or limited) and not (index_order and limited):
+                problems.append(f"full scan: {detail}")
+        if SORT_RE.search(detail) and large and not grouped:
+            problems.append(f"temp B-tree sort: {detail}")
+    return details, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the query plans of every SQL statement in cgi-bin/")
+    parser.add_argument('--verbose', action='store_true', help="Print the plan of every statement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, 'plans.db')
+        init_db.init_database(db_path)
+        conn = sqlite3.connect(db_path)
+
+        statements = []
+        dynamic = []
+        for script in sorted(os.listdir(CGI_DIR)):
+            if script.endswith('.py'):
+                for line, sql in find_statements(os.path.join(CGI_DIR, script)):
+                    if sql is None:
+                        dynamic.append(f"{script}:{line}")
+                    else:
+                        statements.append((f"{script}:{line}", sql))
+        statements += [(f"{script} (rendered)", sql) for script, sql in dynamic_statements()]
+
+        failures = checked = 0
+        for location, sql in statements:
+            details, problems = check_statement(conn, sql)
+            if problems is None or not details:
+                continue
+            checked += 1
+            if args.verbose or problems:
+                print(f"{'FAIL' if problems else 'ok  '} {location}: {' '.join(sql.split())[:100]}")
+                for detail in details:
+                    print(f"       {detail}")
+                for problem in problems:
+                    print(f"       !! {problem}")
+            failures += bool(problems)
+        conn.close()
+
+    print(f"{checked} statements checked, {failures} with regressions; "
+          f"{len(dynamic)} built at runtime not read ({', '.join(dynamic)})")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for the Matrica Networks database
+Builds a production-sized database for reproducing slow queries locally: init_db.py's
+schema and sample data, plus as many employees, attendance days, contacts, tasks, leave
+requests, education records and documents as asked for. The same seed and end date
+always produce the same rows.
+
+    python3 database/generate_dataset.py --db database/synthetic.db
+    python3 database/generate_dataset.py --db database/synthetic.db --employees 10000 --years 5 \\
+        --contacts 1000000 --tasks 100000 --force
+    MATRICA_DB_PATH=database/synthetic.db python3 server.py
+
+Rows are loaded with executemany() in a single transaction with the journal off. The
+secondary indexes and the triggers on the loaded tables are dropped first and put back
+at the end; the tables those triggers maintain (attendance_daily, the FTS indexes,
+table_versions) are rebuilt once from the loaded rows.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import time
+from datetime import date, timedelta
+
+import bcrypt
+
+import init_db
+import migrations
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cgi-bin'))
+import password_hashing # bcrypt cost and hex storage format shared with the APIs
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic.db')
+DEFAULT_PASSWORD = 'password123'
+# Tables filled here, plus attendance_daily, whose indexes and triggers wait until the load is done
+LOADED_TABLES = ['employees', 'attendance', 'attendance_daily', 'contacts', 'tasks',
+                 'leave_requests', 'education_history', 'employee_documents']
+# Generated documents point outside /uploads, so blob_store.release() never unlinks a real file
+DOCUMENT_WEB_PREFIX = '/synthetic/documents'
+# Distinct contact messages; rows pick from these
+MESSAGE_POOL = 20000
+
+FIRST_NAMES = ['Aarav', 'Aditi', 'Akash', 'Ananya', 'Arjun', 'Deepa', 'Farhan', 'Ishaan', 'Kavya', 'Meera',
+               'Neha', 'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Riya', 'Rohan', 'Sanjay', 'Sneha', 'Vikram',
+               'Anita', 'Daniel', 'Grace', 'Kiran', 'Maria', 'Omar', 'Sara', 'Tom', 'Wei', 'Yusuf']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Nair', 'Gupta', 'Khan', 'Singh', 'Das', 'Mehta',
+              'Joshi', 'Rao', 'Kulkarni', 'Menon', 'Bose', 'Chen', 'Fernandes', 'Smith', 'Johnson', 'Ali']
+DESIGNATIONS = ['Security Analyst', 'SOC Engineer', 'Penetration Tester', 'Threat Hunter', 'Incident Responder',
+                'Security Architect', 'DevSecOps Engineer', 'GRC Consultant', 'Account Manager', 'HR Executive']
+COMPANIES = ['Acme Corp', 'Globex', 'Initech', 'Umbrella Health', 'Stark Logistics', 'Wayne Finance',
+             'Tyrell Systems', 'Hooli', 'Vandelay Imports', 'Soylent Foods', '']
+SUBJECTS = ['Penetration test quote', 'SOC services', 'Incident response', 'Partnership', 'Careers',
+            'Product demo', 'Compliance audit', 'General enquiry']
+WORDS = ('security network threat incident response audit compliance firewall endpoint cloud breach '
+         'assessment monitoring vulnerability phishing ransomware policy access identity training report '
+         'urgent review please contact schedule meeting budget quarter team support').split()
+TASK_TITLES = ['Review firewall rules', 'Patch VPN appliances', 'Triage SIEM alerts', 'Write incident report',
+               'Update asset inventory', 'Run phishing simulation', 'Audit IAM roles', 'Rotate service credentials',
+               'Prepare client deck', 'Scan web application']
+LEAVE_REASONS = ['Family function', 'Medical appointment', 'Vacation', 'Personal work', 'Wedding', 'Festival']
+INSTITUTIONS = ['IIT Bombay', 'IIT Delhi', 'Anna University', 'University of Pune', 'BITS Pilani',
+                'NIT Trichy', 'VIT Vellore', 'Delhi University', 'Mumbai University', 'IIIT Hyderabad']
+DEGREES = ['B.Tech Computer Science', 'B.E. Electronics', 'BCA', 'MCA', 'M.Tech Information Security',
+           'B.Sc Physics', 'MBA', 'Diploma in Networking']
+DOCUMENT_TYPES = ['aadhaar', 'pan', 'certificate', 'resume', 'offer_letter']
+
+
+def deterministic_password_hash(password, rng):
+    """bcrypt hash (hex, as the APIs store it) with a salt drawn from rng instead of os.urandom."""
+    alphabet = './' + string.ascii_uppercase + string.ascii_lowercase + string.digits
+    # The 22nd salt character only carries two bits; these are its canonical values
+    salt = ''.join(rng.choice(alphabet) for _ in range(21)) + rng.choice('.Oeu')
+    prefix = f"$2b${password_hashing.BCRYPT_ROUNDS:02d}$"
+    return bcrypt.hashpw(password.encode('utf-8'), (prefix + salt).encode()).hex()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choices(WORDS, k=words)).capitalize() + '.'
+
+
+# 'THH:MM:SS' for every second of the day; formatting millions of timestamps dominates otherwise
+CLOCK = [f"T{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in range(86400)]
+
+
+def timestamp(day, seconds):
+    """ISO timestamp like datetime.isoformat(), from an ISO date and seconds after midnight."""
+    return day + CLOCK[seconds]
+
+
+def generate_employees(rng, count, password_hash):
+    for n in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        username = f"emp{n:06d}"
+        yield (f"{first} {last}", username, password_hash, rng.choice(DESIGNATIONS), '',
+               f"{username}@matrica.example", f"+91 9{rng.randrange(10**9):09d}")
+
+
+def generate_attendance(rng, employee_ids, days, presence):
+    """Day by day, as the rows would arrive in production; days are ISO date strings."""
+    draw, gauss = rng.random, rng.gauss  # The inner loop runs once per row
+    for day in days:
+        if date.fromisoformat(day).weekday() >= 5:
+            continue
+        for employee_id in employee_ids:
+            if draw() >= presence:
+                continue
+            punch_in = min(86399, max(0, int(gauss(9 * 3600 + 15 * 60, 25 * 60))))
+            # A few punch-outs are forgotten every day
+            punch_out = None if draw() < 0.02 else day + CLOCK[min(86399, punch_in + int(gauss(9 * 3600, 45 * 60)))]
+            yield employee_id, day + CLOCK[punch_in], punch_out, day
+
+
+def generate_contacts(rng, count, start, end):
+    # Messages come from a pool drawn up front: composing a fresh one per row would cost more than the insert
+    messages = [sentence(rng, rng.randint(8, 40)) for _ in range(MESSAGE_POOL)]
+    days = [(start + timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
+    span = (end - start).days * 86400
+    step = max(span // max(count, 1), 1)
+    draw = rng.random  # The loop runs once per row
+    for n in range(count):
+        # Spread evenly over the range, ids and timestamps rising together
+        offset = n * span // max(count, 1) + int(draw() * step)
+        first, last = FIRST_NAMES[int(draw() * len(FIRST_NAMES))], LAST_NAMES[int(draw() * len(LAST_NAMES))]
+        yield (f"{first} {last}", f"{first.lower()}.{last.lower()}{n}@example.com", f"+91 9{int(draw() * 10**9):09d}",
+               COMPANIES[int(draw() * len(COMPANIES))], SUBJECTS[int(draw() * len(SUBJECTS))],
+               messages[int(draw() * MESSAGE_POOL)], days[offset // 86400] + CLOCK[offset % 86400])
+
+
+def generate_tasks(rng, count, employee_ids, start, end):
+    days = (end - start).days
+    for _ in range(count):
+        created = start + timedelta(days=rng.randrange(days))
+        due = created + timedelta(days=rng.randint(1, 30))
+        status = 'Completed' if due < end and rng.random() < 0.8 else rng.choice(['Pending', 'In Progress'])
+        created_at = timestamp(created.isoformat(), rng.randrange(9 * 3600, 18 * 3600))
+        yield (rng.choice(employee_ids), rng.choice(TASK_TITLES), sentence(rng, rng.randint(5, 20)),
+               due.isoformat(), status, created_at, created_at)
+
+
+def generate_leave(rng, count, employee_ids, start, end):
+    days = (end - start).days
+    for _ in range(count):
+        requested = start + timedelta(days=rng.randrange(days))
+        first_day = requested + timedelta(days=rng.randint(1, 45))
+        status = rng.choice(['Approved', 'Approved', 'Approved', 'Rejected']) if first_day < end else 'Pending'
+        yield (rng.choice(employee_ids), first_day.isoformat(), (first_day + timedelta(days=rng.randint(0, 5))).isoformat(),
+               rng.choice(LEAVE_REASONS), status, timestamp(requested.isoformat(), rng.randrange(86400)))
+
+
+def generate_education(rng, employee_ids, per_employee):
+    for employee_id in employee_ids:
+        for _ in range(rng.randint(0, 2 * per_employee)):
+            yield (employee_id, rng.choice(INSTITUTIONS), rng.choice(DEGREES), rng.randint(1995, 2024),
+                   f"{rng.randint(55, 95)}%")
+
+
+def generate_documents(rng, employee_ids, per_employee, start, end):
+    days = (end - start).days
+    document_id = 0
+    for employee_id in employee_ids:
+        for _ in range(rng.randint(0, 2 * per_employee)):
+            document_id += 1
+            document_type = rng.choice(DOCUMENT_TYPES)
+            uploaded = start + timedelta(days=rng.randrange(days))
+            yield (employee_id, document_type, f"{document_type}.pdf", f"{DOCUMENT_WEB_PREFIX}/{document_id}.pdf",
+                   timestamp(uploaded.isoformat(), rng.randrange(86400)))
+
+
+def drop_indexes_and_triggers(cursor, tables):
+    """Drop the explicit indexes and the triggers on tables; returns their SQL to recreate them."""
+    placeholders = ', '.join('?' * len(tables))
+    cursor.execute(f'''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        ORDER BY type = 'trigger', rowid
+    ''', tables)
+    saved = cursor.fetchall()
+    for kind, name, _ in saved:
+        cursor.execute(f"DROP {kind.upper()} {name}")
+    return [sql for _, _, sql in saved]
+
+
+def generate(db_path, options):
+    """Build the dataset in db_path + '.tmp' and move it into place once complete."""
+    rng = random.Random(options.seed)
+    end = date.fromisoformat(options.end_date) if options.end_date else date.today()
+    start = end - timedelta(days=int(365.25 * options.years))
+    temp_path = db_path + '.tmp'
+    for path in (temp_path, temp_path + '-wal', temp_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    init_db.init_database(temp_path)  # Schema, migrations and insert_sample_data()
+    conn = sqlite3.connect(temp_path, isolation_level=None)
+    cursor = conn.cursor()
+    # Nothing to protect until the file is moved into place, so skip the journal and fsyncs
+    cursor.execute("PRAGMA journal_mode=OFF")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA cache_size=-262144")  # 256 MiB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+
+    began = time.perf_counter()
+
+    def step(label, sql, rows):
+        step_began = time.perf_counter()
+        cursor.executemany(sql, rows)
+        print(f"  {label}: {cursor.rowcount} rows in {time.perf_counter() - step_began:.1f}s", file=sys.stderr)
+
+    cursor.execute("BEGIN")
+    deferred = drop_indexes_and_triggers(cursor, LOADED_TABLES)
+
+    step_began = time.perf_counter()
+    cursor.executemany('''
+        INSERT INTO employees (full_name, username, password_hash, designation, profile_picture_url, email, phone)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', generate_employees(rng, options.employees, deterministic_password_hash(options.password, rng)))
+    cursor.execute("SELECT id FROM employees WHERE username LIKE 'emp%' ORDER BY id")
+    employee_ids = [row[0] for row in cursor.fetchall()]
+    print(f"  employees: {len(employee_ids)} in {time.perf_counter() - step_began:.1f}s", file=sys.stderr)
+
+    if employee_ids:
+        # Today is left out so a generated employee can still punch in
+        days = [(start + timedelta(days=n)).isoformat() for n in range((end - start).days)]
+        tables = [
+            ('attendance', "INSERT INTO attendance (employee_id, punch_in_time, punch_out_time, date) VALUES (?, ?, ?, ?)",
+             generate_attendance(rng, employee_ids, days, options.presence)),
+            ('tasks', '''INSERT INTO tasks (assigned_to_employee_id, title, description, due_date, status, created_at, updated_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+             generate_tasks(rng, options.tasks, employee_ids, start, end)),
+            ('leave_requests', '''INSERT INTO leave_requests (employee_id, start_date, end_date, reason, status, requested_at)
+                                  VALUES (?, ?, ?, ?, ?, ?)''',
+             generate_leave(rng, options.leave, employee_ids, start, end)),
+            ('education_history', '''INSERT INTO education_history (employee_id, institution_name, degree, year_of_completion, details)
+                                     VALUES (?, ?, ?, ?, ?)''',
+             generate_education(rng, employee_ids, options.education)),
+            ('employee_documents', '''INSERT INTO employee_documents (employee_id, document_type, file_name, file_path, uploaded_at)
+                                      VALUES (?, ?, ?, ?, ?)''',
+             generate_documents(rng, employee_ids, options.documents, start, end)),
+        ]
+    else:
+        tables = []
+    tables.append(('contacts', '''INSERT INTO contacts (name, email, phone, company, subject, message, timestamp)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                   generate_contacts(rng, options.contacts, start, end)))
+    for table, sql, rows in tables:
+        step(table, sql, rows)
+
+    step_began = time.perf_counter()
+    cursor.execute(f"INSERT OR REPLACE INTO attendance_daily SELECT {migrations.attendance_summary('attendance')} FROM attendance")
+    for table in LOADED_TABLES:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",))
+        if cursor.fetchone():
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+    for sql in deferred:
+        cursor.execute(sql)
+    cursor.execute(f"UPDATE table_versions SET version = version + 1 WHERE table_name IN ({', '.join('?' * len(LOADED_TABLES))})",
+                   LOADED_TABLES)
+    print(f"  summaries, search indexes, {len(deferred)} indexes and triggers: "
+          f"{time.perf_counter() - step_began:.1f}s", file=sys.stderr)
+    cursor.execute("COMMIT")
+
+    cursor.execute("ANALYZE")  # Production-like planner statistics
+    cursor.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    os.replace(temp_path, db_path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    print(f"Generated {db_path} ({os.path.getsize(db_path) / 2**20:.0f} MiB) in {time.perf_counter() - began:.1f}s",
+          file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large, deterministic Matrica Networks database")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"Database file to create (default: {DEFAULT_DB})")
+    parser.add_argument('--force', action='store_true', help="Replace the file if it already exists")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument('--end-date', help="Last day of generated history, YYYY-MM-DD (default: today)")
+    parser.add_argument('--years', type=float, default=1, help="Years of attendance and other history (default: 1)")
+    parser.add_argument('--employees', type=int, default=1000, help="Employees (default: 1000)")
+    parser.add_argument('--presence', type=float, default=0.9,
+                        help="Share of employees present on a working day (default: 0.9)")
+    parser.add_argument('--contacts', type=int, default=100000, help="Contact form submissions (default: 100000)")
+    parser.add_argument('--tasks', type=int, default=10000, help="Tasks (default: 10000)")
+    parser.add_argument('--leave', type=int, default=5000, help="Leave requests (default: 5000)")
+    parser.add_argument('--education', type=int, default=1, help="Average education records per employee (default: 1)")
+    parser.add_argument('--documents', type=int, default=1, help="Average documents per employee (default: 1)")
+    parser.add_argument('--password', default=DEFAULT_PASSWORD,
+                        help=f"Password of every generated employee, emp000001... (default: {DEFAULT_PASSWORD})")
+    return parser.parse_args(argv)
+
+
+def main():
+    options = parse_args()
+    db_path = os.path.abspath(options.db)
+    if os.path.exists(db_path) and not options.force:
+        print(f"{db_path} already exists; pass --force to replace it")
+        sys.exit(1)
+    generate(db_path, options)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,16 @@ Creates SQLite database with required tables
 
 import sqlite3
 import os
+import migrations # Numbered schema changes on top of the tables created here
 
-def init_database():
+def init_database(db_path=None):
     """Initialize the SQLite database with required tables"""
-    db_path = os.path.join(os.path.dirname(__file__), 'matrica.db')
+    db_path = db_path or os.path.join(os.path.dirname(__file__), 'matrica.db')
     
     conn = sqlite3.connect(db_path)
+    # Write-ahead logging is a property of the database file, so switch it on once here;
+    # the APIs (cgi-bin/db_config.py) rely on it for concurrent readers and writers.
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     
     # Create contacts table
@@ -170,8 +174,13 @@ def init_database():
     insert_sample_data(cursor)
     
     conn.commit()
+
+    # Later schema changes (database/migrations.py)
+    applied = migrations.migrate(conn)
     conn.close()
     print(f"Database initialized successfully at {db_path}")
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
 
 def insert_sample_data(cursor):
     """Insert sample data for demonstration"""
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for the Matrica Networks database
+init_db.py creates the baseline schema (version 0); every later change is a numbered
+migration here, applied in order and recorded in PRAGMA user_version.
+
+    python3 database/migrations.py            # apply pending migrations
+    python3 database/migrations.py --dry-run  # only show what would run
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+DB_PATH = os.environ.get('MATRICA_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matrica.db'))
+# How long a migration waits for the APIs' writes to finish before giving up
+BUSY_TIMEOUT_MS = 30000
+
+# The tables init_db.py creates; the migrations build on all of them
+BASELINE_TABLES = [
+    'contacts', 'team', 'careers', 'resources', 'products', 'employees', 'company_handbook',
+    'tasks', 'leave_requests', 'attendance', 'employee_documents', 'education_history',
+]
+# Tables whose changes invalidate the ETags of the API GET responses built from them: all of them
+VERSIONED_TABLES = BASELINE_TABLES
+
+
+class MigrationError(Exception):
+    """The database can't be migrated as it stands."""
+
+
+def add_column(table, column, definition):
+    """Step: ALTER TABLE ... ADD COLUMN, skipped if the column is already there."""
+    statement = f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+
+    def step(cursor):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(statement)
+    step.__doc__ = statement
+    return step
+
+
+def create_index(name, table, columns):
+    """Step: CREATE INDEX IF NOT EXISTS.
+
+    SQLite builds an index in one pass while holding the write lock. Under WAL, readers
+    carry on meanwhile and writers wait (busy timeout), so give a large index a migration
+    of its own to keep that pause to a single build.
+    """
+    return f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+
+
+def rebuild_table(table, old_fragment, new_fragment):
+    """Step: rebuild table with old_fragment of its definition replaced, skipped if it isn't there.
+
+    SQLite can't drop a constraint in place, so the rows are copied into a table created
+    from the new definition, which then takes the old one's name. The table's indexes and
+    triggers go with the old table and are created again afterwards.
+    """
+    def step(cursor):
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        table_sql = cursor.fetchone()[0]
+        if old_fragment not in table_sql:
+            return
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                       (table,))
+        dependents = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = ', '.join(row[1] for row in cursor.fetchall())
+
+        new_sql = table_sql.replace(old_fragment, new_fragment, 1).replace(table, f"{table}_new", 1)
+        cursor.execute(new_sql)
+        cursor.execute(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for sql in dependents:
+            cursor.execute(sql)
+    step.__doc__ = f"Rebuild {table} with {old_fragment!r} -> {new_fragment!r}"
+    return step
+
+
+def fts_index(table, columns):
+    """Step: an external-content FTS5 index over table(columns), kept in sync by triggers.
+
+    The index stores only the search terms; the text itself stays in the base table.
+    The index is rebuilt from the rows already in the table.
+    """
+    fts_table = f"{table}_fts"
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"new.{column}" for column in columns)
+    old_values = ', '.join(f"old.{column}" for column in columns)
+
+    def step(cursor):
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
+            USING fts5({column_list}, content='{table}', content_rowid='id')
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    step.__doc__ = f"FTS5 index {fts_table} over {table} ({column_list}), its sync triggers, and a rebuild"
+    return step
+
+
+def version_triggers(tables):
+    """Step: table_versions and the triggers that count every insert, update and delete on tables."""
+    def step(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0 -- Bumped by triggers on every row written
+            )
+        ''')
+        for table in tables:
+            cursor.execute("INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)", (table,))
+            for suffix, event in (('vi', 'INSERT'), ('vu', 'UPDATE'), ('vd', 'DELETE')):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_{suffix} AFTER {event} ON {table} BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                    END
+                ''')
+    step.__doc__ = f"table_versions, with insert/update/delete triggers on {', '.join(tables)}"
+    return step
+
+
+def attendance_summary(row):
+    """The attendance_daily column values, as SQL, for an attendance row called row ('new', 'attendance'...)"""
+    return f'''
+        {row}.date, {row}.employee_id,
+        CAST(round((julianday({row}.punch_in_time) - julianday(date({row}.punch_in_time))) * 86400) AS INTEGER),
+        CASE WHEN {row}.punch_out_time IS NULL THEN 0
+             ELSE max(0, CAST(round((julianday({row}.punch_out_time) - julianday({row}.punch_in_time)) * 86400) AS INTEGER))
+        END,
+        {row}.punch_out_time IS NOT NULL
+    '''
+
+
+def attendance_daily(cursor):
+    """attendance_daily, the triggers that keep it in step with attendance, and a backfill"""
+    # Punch times are ISO strings; the triggers turn them into seconds once, when a punch
+    # is written, so a report over any date range is a single scan of the (date,
+    # employee_id) primary key.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            date DATE NOT NULL,
+            employee_id INTEGER NOT NULL,
+            punch_in_seconds INTEGER, -- Seconds after midnight of the punch-in, for late arrivals
+            worked_seconds INTEGER NOT NULL DEFAULT 0, -- Punch-in to punch-out, 0 until punched out
+            punched_out INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, employee_id)
+        ) WITHOUT ROWID
+    ''')
+    # Reports for a single employee
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_daily_employee ON attendance_daily (employee_id, date)")
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_ai AFTER INSERT ON attendance BEGIN
+            INSERT OR REPLACE INTO attendance_daily VALUES ({attendance_summary('new')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_au AFTER UPDATE ON attendance BEGIN
+            DELETE FROM attendance_daily WHERE date = old.date AND employee_id = old.employee_id;
+            INSERT OR REPLACE INTO attendance_daily VALUES ({attendance_summary('new')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_ad AFTER DELETE ON attendance BEGIN
+            DELETE FROM attendance_daily WHERE date = old.date AND employee_id = old.employee_id;
+        END
+    ''')
+    cursor.execute(f"INSERT OR REPLACE INTO attendance_daily SELECT {attendance_summary('attendance')} FROM attendance")
+
+
+# (version, description, steps). A step is an SQL statement or a function taking a cursor.
+# Never edit or renumber a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    (1, "Add resources.file_url, which resources_api.py reads and writes", [
+        add_column('resources', 'file_url', 'TEXT'),
+    ]),
+    # 2-6: covering indexes for the per-employee lists, in the order each query sorts, so
+    # SQLite reads one index range and never touches the table or a temp B-tree.
+    # database/check_query_plans.py fails if one of these queries stops using them.
+    (2, "Covering index for tasks_api.py's task list", [
+        create_index('idx_tasks_employee_due', 'tasks',
+                     ['assigned_to_employee_id', 'due_date', 'created_at DESC', 'title', 'description', 'status', 'updated_at']),
+    ]),
+    (3, "Covering index for leave_api.py's leave history", [
+        create_index('idx_leave_requests_employee_requested', 'leave_requests',
+                     ['employee_id', 'requested_at', 'start_date', 'end_date', 'reason', 'status']),
+    ]),
+    (4, "Covering index for employee_documents_api.py's document list", [
+        create_index('idx_employee_documents_employee_uploaded', 'employee_documents',
+                     ['employee_id', 'uploaded_at', 'document_type', 'file_name', 'file_path']),
+    ]),
+    (5, "Covering index for education_api.py's education history", [
+        create_index('idx_education_history_employee_year', 'education_history',
+                     ['employee_id', 'year_of_completion', 'id', 'institution_name', 'degree', 'details']),
+    ]),
+    (6, "Covering index for employee_admin_api.py's employee directory", [
+        create_index('idx_employees_full_name', 'employees',
+                     ['full_name', 'username', 'designation', 'profile_picture_url', 'email', 'phone']),
+    ]),
+    # 7-11 are written to be re-run safely: a database created by an init_db.py that still
+    # built these objects itself passes through them unchanged (apart from the rebuilds).
+    (7, "Index contacts for contacts_api.py's newest-first keyset pagination", [
+        create_index('idx_contacts_timestamp_id', 'contacts', ['timestamp DESC', 'id DESC']),
+    ]),
+    (8, "Full-text search indexes for search_api.py", [
+        fts_index('contacts', ['name', 'email', 'company', 'subject', 'message']),
+        fts_index('resources', ['title', 'type', 'content']),
+        fts_index('careers', ['title', 'description', 'location']),
+    ]),
+    (9, "Content-addressed upload store: upload_blobs refcounts, shared employee document files", [
+        '''
+        CREATE TABLE IF NOT EXISTS upload_blobs (
+            file_path TEXT PRIMARY KEY, -- Web path, /uploads/blobs/<xx>/<sha256><ext>
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0, -- Records pointing at this file
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Documents with identical content point at the same stored file
+        rebuild_table('employee_documents', 'file_path TEXT NOT NULL UNIQUE',
+                      'file_path TEXT NOT NULL'),
+    ]),
+    (10, "Change counters behind the API ETags (conditional_get.py)", [
+        version_triggers(VERSIONED_TABLES),
+    ]),
+    (11, "Daily attendance summary for attendance_report_api.py", [
+        attendance_daily,
+    ]),
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending(conn):
+    version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def describe_step(step):
+    return step.__doc__ if callable(step) else ' '.join(step.split())
+
+
+def plan(conn):
+    """Lines describing each pending migration and its steps, for --dry-run."""
+    check_baseline(conn)
+    lines = []
+    for version, description, steps in pending(conn):
+        lines.append(f"{version}: {description}")
+        for step in steps:
+            line = f"    {describe_step(step)}"
+            match = re.match(r'CREATE (?:UNIQUE )?INDEX .* ON (\w+)', describe_step(step))
+            if match:
+                rows = conn.execute(f"SELECT COUNT(*) FROM {match.group(1)}").fetchone()[0]
+                line += f"  -- builds over {rows} rows"
+            lines.append(line)
+    return lines
+
+
+def check_baseline(conn):
+    """Raise MigrationError if migrations are pending on a database without all of init_db.py's tables."""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    missing = [table for table in BASELINE_TABLES if table not in existing]
+    if missing and pending(conn):
+        raise MigrationError(f"missing baseline tables ({', '.join(missing)}); "
+                             f"run python3 database/init_db.py, which creates them and then migrates")
+
+
+def migrate(conn):
+    """Apply pending migrations in order, each in its own IMMEDIATE transaction.
+
+    A migration's steps and its user_version bump commit together, so a failure leaves
+    the database at the last version that applied cleanly. Processes starting at the
+    same time are safe: the version is re-read once the write lock is held. Returns the
+    versions applied. Raises MigrationError (see check_baseline()) before changing anything.
+    """
+    check_baseline(conn)
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # Explicit BEGIN/COMMIT below
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    applied = []
+    try:
+        for version, description, steps in MIGRATIONS:
+            if version <= current_version(conn):
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= current_version(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+        if applied:
+            # Refresh the query planner's statistics for any new indexes
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def migrate_database(db_path=DB_PATH, dry_run=False):
+    """Open db_path and migrate it (or, with dry_run, return the plan lines); None if it doesn't exist yet."""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        return plan(conn) if dry_run else migrate(conn)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the Matrica Networks schema migrations")
+    parser.add_argument('--db', default=DB_PATH, help=f"Database file (default: {DB_PATH})")
+    parser.add_argument('--dry-run', action='store_true', help="Show pending migrations without applying them")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"{args.db} does not exist; create it with database/init_db.py")
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        print(f"Schema version {current_version(conn)}, latest {MIGRATIONS[-1][0]}")
+        try:
+            if args.dry_run:
+                print('\n'.join(plan(conn)) or "Nothing to apply")
+            else:
+                applied = migrate(conn)
+                print(f"Applied {', '.join(map(str, applied))}" if applied else "Nothing to apply")
+        except MigrationError as e:
+            print(f"Can't migrate {args.db}: {e}")
+            sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
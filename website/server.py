@@ -4,84 +4,1110 @@ Simple HTTP server for Matrica Networks website
 Serves static files and handles CGI scripts
 """
 
+import argparse
+import collections
+import collections.abc
+import email.utils
+import gzip
 import http.server
-import socketserver
+import importlib
+import io
+import logging
 import os
+import re
+import signal
+import socketserver
+import subprocess
 import sys
+import tempfile
+import threading
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
 from http.server import CGIHTTPRequestHandler, HTTPServer
 
+# Header parsing shared with the API scripts in cgi-bin/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cgi-bin'))
+import http_headers
+
+DISPATCH_MODES = ('inprocess', 'cgi')
+CONCURRENCY_MODES = ('single', 'threads', 'prefork')
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_DEPTH = 32
+# HTTP/1.1 keep-alive: how long an idle connection may hold a worker, and how many requests it may carry
+DEFAULT_IDLE_TIMEOUT = 5.0
+DEFAULT_MAX_REQUESTS = 100
+
+# Static files: text-like types are gzipped once per file version and kept in memory
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+GZIP_MIN_BYTES = 1024               # Not worth the CPU (or the extra header) below this
+GZIP_MAX_BYTES = 4 * 1024 * 1024    # Larger files are sent as they are
+GZIP_CACHE_BYTES = 32 * 1024 * 1024 # Compressed bytes kept across all files
+# Site assets whose names carry a content hash (main.3f9a1c2b.css) never change, so any cache
+# may keep them for a year; everything else is revalidated with its ETag.
+HASHED_NAME_RE = re.compile(r'(?:/[0-9a-f]{32,}|\.[0-9a-f]{8,})\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Uploads are personal (ID scans, employee documents, profile pictures): hashed blob names or not,
+# only the browser may keep them, and it checks back so a deleted file stops being served
+UPLOADS_DIR = 'uploads'
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+# API responses are framed with a Content-Length unless they are streamed: in-process when the
+# script flushes stdout after its headers, under --dispatch cgi once the output passes this size
+STREAM_THRESHOLD = 256 * 1024
+
+
+class _ThreadLocalStream:
+    """Stand-in for sys.stdin/sys.stdout that routes to the stream bound to the current thread.
+
+    The API scripts talk CGI: they print headers and body to stdout and read the
+    request body from stdin. In-process dispatch binds a per-request buffer to the
+    handling thread so the scripts run unchanged and concurrent requests never
+    interleave their output.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def bind(self, stream):
+        self._local.stream = stream
+
+    def unbind(self):
+        self._local.stream = None
+
+    def _target(self):
+        return getattr(self._local, 'stream', None) or self._default
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class _ThreadLocalEnviron(collections.abc.MutableMapping):
+    """Stand-in for os.environ that exposes the CGI variables of the request bound to the current thread."""
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def bind(self, environ):
+        self._local.environ = environ
+
+    def unbind(self):
+        self._local.environ = None
+
+    def _target(self):
+        environ = getattr(self._local, 'environ', None)
+        return self._default if environ is None else environ
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def copy(self):
+        return dict(self._target())
+
+
+class _RequestBody(io.RawIOBase):
+    """The request body as a readable stream that stops after Content-Length bytes.
+
+    Scripts read it straight from the connection, so an upload is never held in memory
+    as a whole, and they can't read past the end into the next request on the socket.
+    """
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self._rfile.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def drain(self):
+        """Discard whatever part of the body the script didn't read."""
+        while self.remaining > 0 and self.read(64 * 1024):
+            pass
+
+
+class _ResponseStream(io.RawIOBase):
+    """stdout of an in-process script: collected whole, unless the script flushes it once its headers are out.
+
+    That flush, which is also how a CGI script gets output to the client early, starts the
+    response without a Content-Length; every later flush sends what was written since, so
+    a large export goes out piece by piece instead of being held in memory.
+    """
+
+    def __init__(self, handler, extra_headers=()):
+        self.handler = handler
+        self.extra_headers = list(extra_headers)
+        self.pending = bytearray()
+        self.status = None
+        self.body = None  # The handler's StreamedBody once the response has started
+        self.finished = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending += data
+        return len(data)
+
+    def flush(self):
+        if self.body is None:
+            # The flush after main() returns only hands over the last text; it never starts a stream
+            if self.finished or (b'\n\n' not in self.pending and b'\r\n\r\n' not in self.pending):
+                return
+            self.status, reason, headers, data = parse_cgi_output(bytes(self.pending))
+            self.body = self.handler.start_streamed_response(self.status, reason, headers + self.extra_headers)
+            self.pending = bytearray(data)
+        if self.pending:
+            self.body.write(self.pending)
+            self.pending.clear()
+
+
+class StreamedBody:
+    """Body of an API response sent as it is produced: HTTP/1.1 chunks, or bytes ended by closing the connection."""
+
+    def __init__(self, wfile, chunked, send=True):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.send = send  # False for HEAD and 304, which have no body
+        self.bytes = 0
+
+    def write(self, data):
+        if data and self.send:
+            try:
+                self.wfile.write(b'%x\r\n%b\r\n' % (len(data), data) if self.chunked else data)
+            except OSError:
+                self.send = False  # The client is gone; the error stops the script, and finish() sends nothing
+                raise
+            self.bytes += len(data)
+
+    def finish(self):
+        """Send the last chunk, which tells the client the response is complete"""
+        if self.chunked and self.send:
+            self.wfile.write(b'0\r\n\r\n')
+
+
+class ApiRequest:
+    """An API call as seen by a cgi-bin script: method, headers, query and body.
+
+    body is either bytes or a binary stream of content_length bytes.
+    """
+
+    def __init__(self, method, script_name, path_info='', query='', headers=None, body=b'', client_address=('', 0),
+                 content_length=None):
+        self.method = method
+        self.script_name = script_name
+        self.path_info = path_info
+        self.query = query
+        self.headers = headers if headers is not None else {}
+        self.body = body
+        self.content_length = len(body) if content_length is None else content_length
+        self.client_address = client_address
+
+    def to_environ(self, base_environ, handler):
+        """Build the CGI environment the scripts expect (same variables run_cgi provides)."""
+        env = dict(base_environ)
+        env['SERVER_SOFTWARE'] = handler.version_string()
+        env['SERVER_NAME'] = handler.server.server_name
+        env['GATEWAY_INTERFACE'] = 'CGI/1.1'
+        env['SERVER_PROTOCOL'] = handler.protocol_version
+        env['SERVER_PORT'] = str(handler.server.server_port)
+        env['REQUEST_METHOD'] = self.method
+        env['PATH_INFO'] = urllib.parse.unquote(self.path_info)
+        env['SCRIPT_NAME'] = self.script_name
+        env['QUERY_STRING'] = self.query
+        env['REMOTE_ADDR'] = self.client_address[0]
+        env['CONTENT_LENGTH'] = str(self.content_length) if self.content_length else ''
+        for name, value in self.headers.items():
+            key = name.upper().replace('-', '_')
+            if key == 'CONTENT_TYPE':
+                env['CONTENT_TYPE'] = value
+            elif key != 'CONTENT_LENGTH':
+                env['HTTP_' + key] = value
+        return env
+
+
+class InProcessDispatcher:
+    """Imports each cgi-bin API module once and runs its main() inside the server process."""
+
+    def __init__(self, cgi_dir):
+        self.cgi_dir = cgi_dir
+        self._modules = {}
+        self._import_lock = threading.Lock()
+
+        if self.cgi_dir not in sys.path:
+            sys.path.insert(0, self.cgi_dir)
+
+        # Swap in the thread-aware proxies before any API module is imported, so a module
+        # that keeps a reference to os.environ or sys.stdin still sees the current request.
+        if not isinstance(sys.stdout, _ThreadLocalStream):
+            sys.stdout = _ThreadLocalStream(sys.stdout)
+            sys.stdin = _ThreadLocalStream(sys.stdin)
+        if not isinstance(os.environ, _ThreadLocalEnviron):
+            os.environ = _ThreadLocalEnviron(os.environ)
+        self._base_environ = dict(os.environ._default)
+        # Shared with the scripts: writes the structured request log when MATRICA_REQUEST_LOG=json
+        self.request_log = importlib.import_module('request_log')
+        # bcrypt work goes to a process pool rather than blocking request threads
+        try:
+            importlib.import_module('password_hashing').use_pool()
+        except ImportError:
+            pass  # bcrypt not installed; the login scripts report it when preloaded
+
+    def available_scripts(self):
+        return sorted(name for name in os.listdir(self.cgi_dir) if name.endswith('.py'))
+
+    def preload(self):
+        """Import every API module up front so the first request doesn't pay for it."""
+        loaded, failed = [], []
+        for script in self.available_scripts():
+            try:
+                if self.get_module(script) is not None:
+                    loaded.append(script)
+            except Exception as e:
+                failed.append((script, e))
+        return loaded, failed
+
+    def get_module(self, script):
+        """Return the imported module for a script name, or None if it isn't an API entry point."""
+        module = self._modules.get(script)
+        if module is not None:
+            return module
+        with self._import_lock:
+            module = self._modules.get(script)
+            if module is None:
+                module = importlib.import_module(script[:-3])
+                if not callable(getattr(module, 'main', None)):
+                    return None
+                self._modules[script] = module
+        return module
+
+    def dispatch(self, request, handler):
+        """Run the script's main() against the request and return (status, reason, headers, body).
+
+        Returns None instead if the script streamed its response, which has then been sent.
+        """
+        module = self.get_module(request.script_name.rsplit('/', 1)[-1])
+        if module is None:
+            return HTTPStatus.NOT_FOUND, None, [('Content-Type', 'text/plain')], b'No such API script'
+
+        incoming_id = next((value for name, value in request.headers.items() if name.lower() == 'x-request-id'), None)
+        request_id = self.request_log.new_request_id(incoming_id)
+        with self.request_log.track(module.__name__ + '.py', request.method, request_id) as entry:
+            raw_out = _ResponseStream(handler, [('X-Request-ID', request_id)] if entry is not None else [])
+            stdout = io.TextIOWrapper(raw_out, encoding='utf-8', newline='\n')
+            body = request.body
+            if isinstance(body, bytes):
+                body = io.BytesIO(body)
+            elif isinstance(body, io.RawIOBase):
+                body = io.BufferedReader(body)
+            stdin = io.TextIOWrapper(body, encoding='utf-8')
+
+            sys.stdout.bind(stdout)
+            sys.stdin.bind(stdin)
+            os.environ.bind(request.to_environ(self._base_environ, handler))
+            try:
+                module.main()
+            except SystemExit:
+                pass  # Scripts end early with sys.exit(0) after printing an error response
+            finally:
+                os.environ.unbind()
+                sys.stdin.unbind()
+                sys.stdout.unbind()
+                raw_out.finished = True
+                stdout.flush()
+
+            if raw_out.body is not None:
+                raw_out.body.finish()
+                if entry is not None:
+                    entry['status'] = int(raw_out.status)
+                    entry['bytes'] = raw_out.body.bytes
+                return None
+
+            status, reason, headers, body = parse_cgi_output(bytes(raw_out.pending))
+            if entry is not None:
+                entry['status'] = int(status)
+                entry['bytes'] = len(body)
+                headers.append(('X-Request-ID', request_id))
+        return status, reason, headers, body
+
+
+class StaticFileCache:
+    """Gzipped copies of static files, keyed by path and invalidated when the file's mtime or size changes.
+
+    Shared by every handler thread; least recently used entries are dropped once the
+    compressed bytes held exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=GZIP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # path -> (mtime_ns, size, gzipped bytes or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_gzip(self, path, stat, read):
+        """Return the gzipped body for this version of the file, compressing it via read() on a miss.
+
+        None means compression doesn't make the file smaller; that is remembered too.
+        """
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == key:
+                self._entries.move_to_end(path)
+                return entry[2]
+
+        # Compress outside the lock; two threads racing on a cold file just both do the work
+        data = read()
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) >= len(data):
+            compressed = None
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None and old[2] is not None:
+                self._bytes -= len(old[2])
+            self._entries[path] = key + (compressed,)
+            if compressed is not None:
+                self._bytes += len(compressed)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                if evicted[2] is not None:
+                    self._bytes -= len(evicted[2])
+        return compressed
+
+
+class FileBody:
+    """Body of a static file response: spans of the open file, sent with sendfile(), and literal bytes.
+
+    parts holds (offset, length) tuples for file content and bytes for anything between
+    them, such as the part headers of a multipart/byteranges response.
+    """
+
+    def __init__(self, file, parts):
+        self.file = file
+        self.parts = parts
+
+    def close(self):
+        self.file.close()
+
+
+def parse_byte_ranges(header, size):
+    """Parse a Range header against a file of size bytes.
+
+    Returns a sorted list of non-overlapping (start, end) pairs, end inclusive; [] if
+    no range can be satisfied (416); None if the header is malformed, uses another
+    unit or asks for too many ranges, in which case the whole file is sent.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    specs = [item.strip() for item in spec.split(',') if item.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    for item in specs:
+        first, dash, last = item.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or (not first and last.isdigit())) or (last and not last.isdigit()):
+            return None
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        elif int(last):
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            continue
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    # Overlapping or adjacent ranges are merged, so no byte is sent twice
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def make_etag(stat, encoding=None):
+    """Strong validator for one representation of a file version"""
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    if encoding:
+        etag += '-' + encoding
+    return f'"{etag}"'
+
+
+class CgiProcessDispatcher:
+    """Runs each API script in a child process, like CGI, but returns the parsed response.
+
+    Used for --dispatch cgi. The stock run_cgi() streams the script's output straight to
+    the socket: it ignores the Status header (so a 304 went out as an empty 200), passes
+    only a few request headers (not X-Employee-ID or If-None-Match) and sends no
+    Content-Length, so keep-alive connections could only end by closing. Here the output
+    is collected, the Status header honoured and the response framed like an in-process one;
+    output that grows past STREAM_THRESHOLD (an export) is streamed from there on instead.
+    """
+
+    def __init__(self, cgi_dir):
+        self.cgi_dir = cgi_dir
+
+    def dispatch(self, request, handler):
+        """Run the script with the request on stdin and return (status, reason, headers, body), or None if streamed."""
+        script_path = os.path.join(self.cgi_dir, request.script_name.rsplit('/', 1)[-1])
+        environ = request.to_environ(os.environ, handler)
+
+        # The body goes through a temporary file so an upload is never held in memory
+        with tempfile.TemporaryFile() as body:
+            while True:
+                chunk = request.body.read(64 * 1024)
+                if not chunk:
+                    break
+                body.write(chunk)
+            body.seek(0)
+            process = subprocess.Popen([sys.executable, script_path], stdin=body, stdout=subprocess.PIPE,
+                                       env=environ, cwd=self.cgi_dir)
+
+        output, streamed = bytearray(), None
+        with process:
+            while True:
+                data = process.stdout.read1(64 * 1024)
+                if not data:
+                    break
+                if streamed is not None:
+                    streamed.write(data)
+                    continue
+                output += data
+                if len(output) > STREAM_THRESHOLD and (b'\n\n' in output or b'\r\n\r\n' in output):
+                    status, reason, headers, data = parse_cgi_output(bytes(output))
+                    streamed = handler.start_streamed_response(status, reason, headers)
+                    streamed.write(data)
+                    output = None
+            returncode = process.wait()
+
+        if returncode:
+            handler.log_error("CGI script exit status %#x", returncode)
+        if streamed is not None:
+            if returncode:
+                handler.close_connection = True  # Without the last chunk the client knows the body is incomplete
+            else:
+                streamed.finish()
+            return None
+        return parse_cgi_output(bytes(output))
+
+
+def parse_cgi_output(output):
+    """Split a CGI response into (status, reason, headers, body), honouring Status/Location headers."""
+    ends = [(output.find(sep), sep) for sep in (b'\r\n\r\n', b'\n\n') if sep in output]
+    if ends:
+        index, separator = min(ends)
+        head, body = output[:index], output[index + len(separator):]
+    else:
+        head, body = output, b''
+
+    status, reason, headers = HTTPStatus.OK, None, []
+    for line in head.decode('latin-1').splitlines():
+        if ':' not in line:
+            continue
+        name, value = line.split(':', 1)
+        name, value = name.strip(), value.strip()
+        if name.lower() == 'status':
+            code, _, reason = value.partition(' ')
+            status, reason = int(code), reason or None
+        else:
+            if name.lower() == 'location' and status == HTTPStatus.OK:
+                status = HTTPStatus.FOUND
+            headers.append((name, value))
+    return status, reason, headers, body
+
+
 class MatricaHTTPRequestHandler(CGIHTTPRequestHandler):
     """Custom HTTP request handler with CORS support"""
-    
+
+    dispatcher = None
+    static_cache = StaticFileCache()
+    keep_alive = False
+    idle_timeout = DEFAULT_IDLE_TIMEOUT
+    max_requests = DEFAULT_MAX_REQUESTS
+    connection_header_sent = False
+    streamed_body = None
+
+    def handle(self):
+        """Serve requests on the connection until it closes, goes idle or reaches max_requests"""
+        if not self.keep_alive:
+            return super().handle()
+
+        self.requests_served = 0
+        self.close_connection = True
+        while self.wait_for_request():
+            self.handle_one_request()
+            if self.close_connection:
+                break
+
+    def wait_for_request(self):
+        """Wait up to idle_timeout for the next request; False if the client hung up or stayed quiet.
+
+        peek() returns at once when a pipelined request is already buffered.
+        """
+        self.connection.settimeout(self.idle_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:  # Includes TimeoutError
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        if self.keep_alive:
+            self.requests_served += 1
+        return True
+
+    def send_response(self, code, message=None):
+        self.connection_header_sent = False
+        super().send_response(code, message)
+        if not self.keep_alive:
+            return
+        if self.requests_served >= self.max_requests:
+            self.send_header('Connection', 'close')
+        elif not self.close_connection and self.request_version == 'HTTP/1.0':
+            # A 1.0 client asked for keep-alive; it only keeps the connection if told so
+            self.send_header('Connection', 'keep-alive')
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            # send_error() adds its own 'Connection: close' after send_response() may have
+            if self.connection_header_sent and value.lower() == 'close':
+                self.close_connection = True
+                return
+            self.connection_header_sent = True
+        super().send_header(keyword, value)
+
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         super().end_headers()
-    
+
     def do_OPTIONS(self):
         """Handle OPTIONS requests for CORS preflight"""
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
-    
+
+    def send_head(self):
+        """Serve static files with ETag/Last-Modified validation, cache headers, gzip and byte ranges"""
+        if self.is_cgi():
+            return self.run_cgi()
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            path = next((os.path.join(path, index) for index in ('index.html', 'index.htm')
+                         if os.path.isfile(os.path.join(path, index))), path)
+        if not os.path.isfile(path) or path.endswith('/'):
+            # Directory redirects and listings, and 404s, are left to SimpleHTTPRequestHandler
+            return http.server.SimpleHTTPRequestHandler.send_head(self)
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            stat = os.fstat(f.fileno())
+            content_type = self.guess_type(path)
+            compressible = content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+            # Ranges always refer to the file itself, so a range request is never gzipped
+            range_header = self.headers.get('Range') if self.command == 'GET' else None
+
+            body = None
+            if (compressible and not range_header and GZIP_MIN_BYTES <= stat.st_size <= GZIP_MAX_BYTES
+                    and http_headers.accepts_gzip(self.headers.get('Accept-Encoding'))):
+                body = self.static_cache.get_gzip(path, stat, f.read)
+            encoding = 'gzip' if body is not None else None
+            etag = make_etag(stat, encoding)
+
+            if self.not_modified(etag, stat):
+                f.close()
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_static_headers(path, etag, stat, compressible)
+                self.end_headers()
+                return None
+
+            if range_header and self.range_applies(etag, stat):
+                ranges = parse_byte_ranges(range_header, stat.st_size)
+                if ranges is not None:
+                    return self.send_ranges(f, path, content_type, etag, stat, compressible, ranges)
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', content_type)
+            self.send_static_headers(path, etag, stat, compressible)
+            if body is not None:
+                f.close()
+                self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                return io.BytesIO(body)
+            self.send_header('Content-Length', str(stat.st_size))
+            self.end_headers()
+            return FileBody(f, [(0, stat.st_size)])
+        except:
+            f.close()
+            raise
+
+    def range_applies(self, etag, stat):
+        """If-Range: serve the range only if the client's copy is still this version (strong comparison)"""
+        if_range = self.headers.get('If-Range')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == etag
+        return if_range == self.date_time_string(stat.st_mtime)
+
+    def send_ranges(self, f, path, content_type, etag, stat, compressible, ranges):
+        """Send a 206 with one range, a 206 multipart/byteranges with several, or a 416 with none"""
+        size = stat.st_size
+        if not ranges:
+            f.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_static_headers(path, etag, stat, compressible)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            return FileBody(f, [(start, end - start + 1)])
+
+        boundary = os.urandom(12).hex()
+        parts = []
+        for start, end in ranges:
+            parts.append((f'\r\n--{boundary}\r\n'
+                          f'Content-Type: {content_type}\r\n'
+                          f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('latin-1'))
+            parts.append((start, end - start + 1))
+        parts.append(f'\r\n--{boundary}--\r\n'.encode('latin-1'))
+        length = sum(len(part) if isinstance(part, bytes) else part[1] for part in parts)
+        self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        return FileBody(f, parts)
+
+    def copyfile(self, source, outputfile):
+        """Send file spans with sendfile() so their bytes never pass through Python"""
+        if not isinstance(source, FileBody):
+            return super().copyfile(source, outputfile)
+        for part in source.parts:
+            if isinstance(part, bytes):
+                outputfile.write(part)
+            elif part[1]:
+                # socket.sendfile() uses os.sendfile() and falls back to send() where it is missing
+                self.connection.sendfile(source.file, part[0], part[1])
+
+    def not_modified(self, etag, stat):
+        """Evaluate If-None-Match, or If-Modified-Since when no ETag was sent (RFC 9110 13.2.2)"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return http_headers.etag_matches(if_none_match, etag)
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if since is None or since.tzinfo is None:
+            return False
+        # Last-Modified has one-second resolution
+        return int(stat.st_mtime) <= since.timestamp()
+
+    def send_static_headers(self, path, etag, stat, compressible):
+        """Validators and caching policy shared by 200 and 304 responses"""
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+        self.send_header('Accept-Ranges', 'bytes')
+        if path.startswith(os.path.join(self.directory, UPLOADS_DIR) + os.sep):
+            self.send_header('Cache-Control', PRIVATE_CACHE_CONTROL)
+        elif HASHED_NAME_RE.search(path):
+            self.send_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+        else:
+            self.send_header('Cache-Control', REVALIDATE_CACHE_CONTROL)
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+
     def do_DELETE(self):
         """Handle DELETE requests by treating them as CGI requests"""
         if self.is_cgi():
             self.run_cgi()
         else:
             self.send_error(405, "Method Not Allowed")
-    
+
     def do_PUT(self):
         """Handle PUT requests by treating them as CGI requests"""
         if self.is_cgi():
             self.run_cgi()
         else:
             self.send_error(405, "Method Not Allowed")
-    
+
+    def run_cgi(self):
+        """Run an API script through the dispatcher (in-process, or a child process for --dispatch cgi)"""
+        return self.run_dispatched()
+
+    def build_api_request(self):
+        """Translate the current HTTP request into an ApiRequest for the dispatcher"""
+        directory, rest = self.cgi_info
+        rest, _, query = rest.partition('?')
+        script, slash, path_info = rest.partition('/')
+
+        length = int(self.headers.get('content-length') or 0)
+
+        return ApiRequest(
+            method=self.command,
+            script_name=f"{directory}/{script}",
+            path_info=slash + path_info,
+            query=query,
+            headers=dict(self.headers.items()),
+            body=_RequestBody(self.rfile, length),
+            client_address=self.client_address,
+            content_length=length,
+        )
+
+    def run_dispatched(self):
+        """Hand an API request to the dispatcher and send its response with a Content-Length, unless it was streamed"""
+        request = self.build_api_request()
+        script = request.script_name.rsplit('/', 1)[-1]
+        if not os.path.isfile(os.path.join(self.dispatcher.cgi_dir, script)):
+            request.body.drain()
+            self.send_error(HTTPStatus.NOT_FOUND, f"No such CGI script ({request.script_name!r})")
+            return
+
+        self.streamed_body = None
+        try:
+            response = self.dispatcher.dispatch(request, self)
+        except Exception:
+            if self.streamed_body is None:
+                traceback.print_exc()
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "API script failed")
+            else:
+                if self.streamed_body.send:
+                    traceback.print_exc()  # Not just the client hanging up mid-stream
+                # The headers are already out; closing without the last chunk tells the client the body is cut short
+                self.close_connection = True
+            return
+        finally:
+            request.body.drain()
+        if response is None:
+            return  # Streamed while the script ran
+
+        status, reason, headers, body = response
+
+        self.send_response(status, reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        if status == HTTPStatus.NOT_MODIFIED:
+            body = b''
+        elif not any(name.lower() == 'content-length' for name, _ in headers):
+            self.send_header('Content-Length', str(len(body)))
+        # The scripts send their own CORS headers, so skip the ones end_headers() adds
+        super().end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def start_streamed_response(self, status, reason, headers):
+        """Send the status line and headers of an API response whose length isn't known yet.
+
+        An HTTP/1.1 exchange uses chunked transfer encoding, so a keep-alive connection stays
+        usable afterwards; otherwise the end of the body is marked by closing the connection.
+        Returns the StreamedBody to write the body to.
+        """
+        send = self.command != 'HEAD' and status != HTTPStatus.NOT_MODIFIED
+        chunked = send and self.protocol_version == 'HTTP/1.1' and self.request_version == 'HTTP/1.1'
+        if send and not chunked:
+            self.close_connection = True  # Before send_response(), so it doesn't offer keep-alive
+        self.send_response(status, reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        # The scripts send their own CORS headers, so skip the ones end_headers() adds
+        super().end_headers()
+        self.streamed_body = StreamedBody(self.wfile, chunked, send)
+        return self.streamed_body
+
     def log_message(self, format, *args):
         """Custom log format"""
-        print(f"[{self.log_date_time_string()}] {format % args}")
+        # A streamed response is logged while the script's stdout is still bound to this thread
+        stdout = sys.stdout._default if isinstance(sys.stdout, _ThreadLocalStream) else sys.stdout
+        print(f"[{self.log_date_time_string()}] {format % args}", file=stdout)
 
 class MatricaHTTPServer(HTTPServer):
     """Custom HTTP server with proper server_name attribute"""
-    
-    def __init__(self, server_address, RequestHandlerClass):
+
+    def __init__(self, server_address, RequestHandlerClass, queue_depth=DEFAULT_QUEUE_DEPTH):
+        # Listen backlog: connections the kernel holds while every worker is busy
+        self.request_queue_size = queue_depth
         super().__init__(server_address, RequestHandlerClass)
         self.server_name = server_address[0]
         self.server_port = server_address[1]
 
-def run_server(port=12000, host='0.0.0.0'):
+class BoundedThreadPoolMixIn(socketserver.ThreadingMixIn):
+    """ThreadingMixIn that runs requests on a fixed pool of threads instead of one thread per request.
+
+    At most ``workers`` requests run at once and ``queue_depth`` more may wait for a
+    free thread; anything beyond that is answered with 503 straight away rather than
+    piling up unbounded threads.
+    """
+
+    daemon_threads = True
+    # Set by start_pool() once the socket is bound; a failed bind calls server_close() before that
+    _executor = None
+
+    def start_pool(self, workers, queue_depth):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='matrica-worker')
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        try:
+            self._executor.submit(self._run_pooled, request, client_address)
+        except RuntimeError:  # Pool already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _run_pooled(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def reject_request(self, request):
+        try:
+            request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                            b"Retry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+class MatricaThreadedHTTPServer(BoundedThreadPoolMixIn, MatricaHTTPServer):
+    """MatricaHTTPServer backed by a bounded pool of worker threads"""
+
+    def __init__(self, server_address, RequestHandlerClass, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH):
+        super().__init__(server_address, RequestHandlerClass, queue_depth)
+        self.start_pool(workers, queue_depth)
+
+def create_server(host, port, handler, concurrency='single', workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH):
+    """Build the server for the chosen concurrency model"""
+    if concurrency == 'threads':
+        return MatricaThreadedHTTPServer((host, port), handler, workers, queue_depth)
+    return MatricaHTTPServer((host, port), handler, queue_depth)
+
+def serve_prefork(httpd, workers):
+    """Fork ``workers`` processes that all accept() on the already-bound listening socket.
+
+    The parent only supervises: it restarts workers that die and stops them all on Ctrl+C.
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Pre-fork mode needs os.fork(), which this platform does not provide")
+
+    # Every worker wakes up on a new connection; the losers get EAGAIN instead of blocking in accept()
+    httpd.socket.setblocking(False)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Stop like Ctrl+C (scripts' own sys.exit() calls are swallowed by the dispatcher)
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                # os._exit() skips atexit, so flush the application log (and its writer thread) first
+                logging.shutdown()
+                os._exit(0)
+        return pid
+
+    children = {spawn() for _ in range(workers)}
+    try:
+        while children:
+            pid, _ = os.wait()
+            children.discard(pid)
+            print(f"⚠️  Worker {pid} exited, starting a replacement")
+            children.add(spawn())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+def run_server(port=12000, host='0.0.0.0', dispatch='inprocess', concurrency='single',
+               workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH, keep_alive=False,
+               idle_timeout=DEFAULT_IDLE_TIMEOUT, max_requests=DEFAULT_MAX_REQUESTS, migrate=True):
     """Run the HTTP server"""
-    
+
     # Get the directory where this script is located
     script_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(script_dir)
-    
+
+    # Bring the schema up to date before any API module (or worker) touches the database
+    migration_note = None
+    if migrate:
+        sys.path.insert(0, os.path.join(script_dir, 'database'))
+        try:
+            applied = importlib.import_module('migrations').migrate_database()
+        except Exception as e:
+            # The failed migration rolled back, but the APIs expect the whole schema:
+            # serving from an older version would fail request by request instead
+            print(f"❌ Schema migration failed: {e}")
+            print("   Not starting. Fix the database (or run python3 database/init_db.py to create")
+            print("   missing tables) and try again; --no-migrate skips the migrations.")
+            sys.exit(1)
+        else:
+            if applied is None:
+                migration_note = "⚠️  No database yet: run python3 database/init_db.py"
+            elif applied:
+                migration_note = f"🗄️  Applied schema migrations: {', '.join(map(str, applied))}"
+
     # Set CGI directories
     handler = MatricaHTTPRequestHandler
     handler.cgi_directories = ['/cgi-bin']
-    
+
+    if dispatch == 'inprocess':
+        # Preloading before any fork lets pre-fork workers share the imported modules
+        handler.dispatcher = InProcessDispatcher(os.path.join(script_dir, 'cgi-bin'))
+        if concurrency != 'prefork':
+            # One process sees every login, so throttling state can stay in memory; pre-fork
+            # workers each see a share and keep the shared SQLite buckets
+            importlib.import_module('login_throttle').use_memory_store()
+        loaded, failed = handler.dispatcher.preload()
+        for script, error in failed:
+            print(f"⚠️  Could not preload {script}: {error}")
+    else:
+        handler.dispatcher = CgiProcessDispatcher(os.path.join(script_dir, 'cgi-bin'))
+
+    if keep_alive:
+        handler.protocol_version = 'HTTP/1.1'
+        # CGIHTTPRequestHandler reads unbuffered so run_cgi() can hand the socket to a child;
+        # both dispatchers read through rfile, so buffer it (also makes peek() available)
+        handler.rbufsize = -1
+        # Headers and body go out in separate writes; with Nagle on, the body waits ~40ms for
+        # the client's delayed ACK of the headers on every reused connection
+        handler.disable_nagle_algorithm = True
+        handler.keep_alive = True
+        handler.idle_timeout = idle_timeout
+        handler.max_requests = max_requests
+
     # Create server
-    with MatricaHTTPServer((host, port), handler) as httpd:
+    with create_server(host, port, handler, concurrency, workers, queue_depth) as httpd:
         print(f"🚀 Matrica Networks server starting...")
         print(f"📍 Server address: http://{host}:{port}")
         print(f"📁 Serving from: {os.getcwd()}")
         print(f"🔧 CGI enabled for: {handler.cgi_directories}")
+        if dispatch == 'inprocess':
+            print(f"⚡ API dispatch: in-process ({len(loaded)} modules loaded)")
+        else:
+            print(f"🐢 API dispatch: CGI (one process per request)")
+        if concurrency == 'threads':
+            print(f"🧵 Concurrency: {workers} worker threads, up to {queue_depth} queued requests")
+        elif concurrency == 'prefork':
+            print(f"🍴 Concurrency: {workers} pre-forked worker processes, listen backlog {queue_depth}")
+        else:
+            print(f"🔂 Concurrency: single process, one request at a time")
+        if migration_note:
+            print(migration_note)
+        if keep_alive:
+            print(f"🔗 Keep-alive: HTTP/1.1, idle timeout {idle_timeout:g}s, up to {max_requests} requests per connection")
         print(f"🌐 Access URLs:")
         print(f"   • Main site: http://localhost:{port}")
         print(f"   • Admin panel: http://localhost:{port}/admin.html")
         print(f"   • Dashboard: http://localhost:{port}/dashboard.html")
         print(f"🔐 Admin credentials: psychy / Scambanenabler")
         print(f"📊 Server ready! Press Ctrl+C to stop.")
-        
+
         try:
-            httpd.serve_forever()
+            if concurrency == 'prefork':
+                serve_prefork(httpd, workers)
+                print("\n🛑 Server stopped by user")
+            else:
+                httpd.serve_forever()
         except KeyboardInterrupt:
             print("\n🛑 Server stopped by user")
             httpd.shutdown()
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Matrica Networks development server")
+    parser.add_argument('port', nargs='?', type=int, default=12000, help="Port to listen on (default: 12000)")
+    parser.add_argument('--host', default='0.0.0.0', help="Interface to bind (default: 0.0.0.0)")
+    parser.add_argument('--dispatch', choices=DISPATCH_MODES, default='inprocess',
+                        help="Run API scripts in-process (default) or fork one CGI process per request")
+    parser.add_argument('--concurrency', choices=CONCURRENCY_MODES, default='single',
+                        help="single process (default), a bounded thread pool, or pre-forked worker processes")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Worker threads or processes for --concurrency threads/prefork (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help=f"Requests allowed to wait for a busy worker before new ones are refused (default: {DEFAULT_QUEUE_DEPTH})")
+    parser.add_argument('--keep-alive', action='store_true',
+                        help="Speak HTTP/1.1 and keep connections open between requests")
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f"Seconds an idle keep-alive connection is kept open (default: {DEFAULT_IDLE_TIMEOUT:g})")
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help=f"Requests served on one keep-alive connection before it is closed (default: {DEFAULT_MAX_REQUESTS})")
+    parser.add_argument('--no-migrate', dest='migrate', action='store_false',
+                        help="Don't apply pending schema migrations (database/migrations.py) at startup")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    # Get port from command line or use default
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 12000
-    run_server(port)
\ No newline at end of file
+    args = parse_args()
+    run_server(args.port, args.host, args.dispatch, args.concurrency, args.workers, args.queue_depth,
+               args.keep_alive, args.idle_timeout, args.max_requests, args.migrate)